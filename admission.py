@@ -0,0 +1,337 @@
+"""
+Admission control.
+
+Before a job is queued for the GPU its video is probed with ffprobe (for a
+URL only the container header and index are read, through HTTP range
+requests) and the job is costed with a simple model:
+
+    output frames   = window x fps generated (preprocess_data.py resamples)
+    sampling        = frames x megapixels x seconds per megapixel-frame
+    preprocessing   = frames x seconds per frame
+    peak VRAM       = resident weights + activations per megapixel
+                      + output frames of one generation run (memory_policy.py)
+
+The plan then has to fit the budget. The memory mode (what is kept off
+the GPU) is chosen first, the fastest one that fits; a job that fits in
+none is downscaled. One over the GPU-seconds (or cost) budget has its fps and then
+its resolution reduced, and a job whose single generation run would be too
+long is split into segments. With ADMISSION_POLICY=reject the job is
+refused instead of degraded. The plan, with its estimate, is returned to the
+client before any GPU time is spent.
+
+Coefficients are defaults for an 80 GB card; fit them to a worker's own
+metrics log with:
+
+    python admission.py --calibrate /tmp/faceswap_metrics.jsonl > cost_model.json
+
+and point COST_MODEL_FILE at the result.
+"""
+
+import argparse
+import json
+import math
+import os
+import subprocess
+from functools import lru_cache
+from pathlib import Path
+
+from memory_policy import MEMORY_MODE, MEMORY_MODES, SAMPLING_FACTOR, describe, peak_vram_gb, select_mode
+from segment import SEGMENT_SECONDS
+
+ADMISSION_POLICY = os.environ.get("ADMISSION_POLICY", "degrade")
+MAX_GPU_SECONDS = float(os.environ.get("ADMISSION_MAX_GPU_SECONDS", "0"))
+MAX_COST = float(os.environ.get("ADMISSION_MAX_COST", "0"))
+MAX_VIDEO_SECONDS = float(os.environ.get("ADMISSION_MAX_VIDEO_SECONDS", "0"))
+MAX_RUN_SECONDS = float(os.environ.get("ADMISSION_MAX_RUN_SECONDS", "0"))
+MIN_FPS = int(os.environ.get("ADMISSION_MIN_FPS", "16"))
+GPU_COST_PER_SECOND = float(os.environ.get("GPU_COST_PER_SECOND", "0"))
+COST_MODEL_FILE = os.environ.get("COST_MODEL_FILE", "")
+
+# Frame rate preprocess_data.py resamples to, and what generation saves at
+DEFAULT_FPS = 30
+FPS_STEPS = (30, 24, 20, 16, 12)
+# Standard 16:9 sizes to step down through (Wan needs multiples of 16)
+RESOLUTION_STEPS = ((1920, 1080), (1280, 720), (1024, 576), (960, 540), (832, 480), (640, 360))
+
+COST_MODEL = {
+    "sampling_seconds_per_mp_frame": 0.8,
+    "preprocess_seconds_per_frame": 0.1,
+    "fixed_seconds": 20.0,
+    "vram_base_gb": 40.0,
+    "vram_gb_per_mp": 12.0
+}
+
+
+class AdmissionError(Exception):
+    """The job cannot be made to fit the budget."""
+
+    def __init__(self, message: str, plan: dict):
+        super().__init__(message)
+        self.plan = plan
+
+
+def load_cost_model(path: str = COST_MODEL_FILE) -> dict:
+    """Default coefficients, overridden by the JSON file at path if there is one."""
+    model = dict(COST_MODEL)
+    if path:
+        try:
+            model.update(json.loads(Path(path).read_text()))
+        except (OSError, ValueError) as e:
+            print(f"Could not read cost model {path}: {e}; using defaults")
+    return model
+
+
+def probe_media(source: str) -> dict:
+    """
+    Duration, frame rate, frame count and size of a video file or URL.
+
+    Only the container header is parsed: nothing is decoded, and over HTTP
+    ffprobe fetches just the byte ranges it needs.
+    """
+    result = subprocess.run([
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration:stream=codec_type,width,height,avg_frame_rate,r_frame_rate,nb_frames",
+        "-of", "json",
+        str(source)
+    ], capture_output=True, text=True, timeout=60)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {result.stderr.strip()}")
+    info = json.loads(result.stdout)
+    streams = [s for s in info.get("streams", []) if s.get("codec_type") == "video"]
+    if not streams:
+        raise RuntimeError("No video stream found")
+    stream = streams[0]
+
+    fps = _rate(stream.get("avg_frame_rate")) or _rate(stream.get("r_frame_rate")) or DEFAULT_FPS
+    duration = float(info.get("format", {}).get("duration") or 0)
+    frames = int(stream.get("nb_frames") or 0) or int(round(duration * fps))
+    if not duration:
+        duration = frames / fps
+    return {
+        "duration": round(duration, 3),
+        "fps": round(fps, 3),
+        "frames": frames,
+        "width": int(stream["width"]),
+        "height": int(stream["height"]),
+        "audio": any(s.get("codec_type") == "audio" for s in info.get("streams", []))
+    }
+
+
+def _rate(text: str) -> float:
+    if not text or text == "0/0":
+        return 0.0
+    num, _, den = text.partition("/")
+    return float(num) / float(den or 1) if float(den or 1) else 0.0
+
+
+def run_frames(duration: float, fps: int, run_seconds: float = SEGMENT_SECONDS) -> int:
+    """Frames in the longest generation run (one segment, or the whole video when unsegmented)."""
+    return int(math.ceil(min(duration, run_seconds or duration) * fps))
+
+
+def estimate(duration: float, resolution: tuple, fps: int, model: dict, mode: str = "max_speed",
+             run_seconds: float = SEGMENT_SECONDS) -> dict:
+    """GPU seconds and peak VRAM of generating duration seconds at resolution and fps in a memory mode."""
+    frames = int(math.ceil(duration * fps))
+    megapixels = resolution[0] * resolution[1] / 1e6
+    sampling = frames * megapixels * model["sampling_seconds_per_mp_frame"] * SAMPLING_FACTOR[mode]
+    preprocess = frames * model["preprocess_seconds_per_frame"]
+    gpu_seconds = sampling + preprocess + model["fixed_seconds"]
+    result = {
+        "output_frames": frames,
+        "sampling_seconds": round(sampling, 1),
+        "preprocess_seconds": round(preprocess, 1),
+        "gpu_seconds": round(gpu_seconds, 1),
+        "peak_vram_gb": round(peak_vram_gb(mode, resolution, run_frames(duration, fps, run_seconds), model), 1)
+    }
+    if GPU_COST_PER_SECOND:
+        result["cost"] = round(gpu_seconds * GPU_COST_PER_SECOND, 4)
+    return result
+
+
+def detect_vram_gb() -> float:
+    """Memory of the smallest visible GPU in GB (ADMISSION_MAX_VRAM_GB overrides; 80 if unknown)."""
+    if os.environ.get("ADMISSION_MAX_VRAM_GB"):
+        return float(os.environ["ADMISSION_MAX_VRAM_GB"])
+    try:
+        result = subprocess.run(["nvidia-smi", "--query-gpu=memory.total", "--format=csv,noheader,nounits"],
+                                capture_output=True, text=True, timeout=10)
+        sizes = [float(line) / 1024 for line in result.stdout.split() if line.strip()]
+        if result.returncode == 0 and sizes:
+            return min(sizes)
+    except (OSError, subprocess.SubprocessError, ValueError):
+        pass
+    return 80.0
+
+
+@lru_cache(maxsize=None)
+def engine_memory(mode: str = MEMORY_MODE, resolution: tuple = (1280, 720), vram_gb: float = None) -> dict:
+    """
+    Memory selection a resident pipeline loads with (it keeps its T5
+    placement and weight dtype for every job): mode, or for "auto" what a
+    full-length run at the default resolution needs on this GPU. Computed
+    once per process.
+    """
+    frames = run_frames(SEGMENT_SECONDS or 20.0, DEFAULT_FPS)
+    return select_mode(vram_gb or detect_vram_gb(), resolution, frames, load_cost_model(), mode)
+
+
+def plan_job(media: dict, resolution: tuple, max_gpu_seconds: float = None, policy: str = ADMISSION_POLICY,
+             vram_gb: float = None, model: dict = None, start: float = None, end: float = None,
+             target_fps: float = None, max_frames: int = None, memory_mode: str = None) -> dict:
+    """
+    Fit a job into the budget.
+
+    start/end (seconds), target_fps and max_frames come from the request and
+    narrow the work before the budget is applied; max_frames counts frames
+    at the requested fps. memory_mode is a memory_policy mode, or "auto"
+    (MEMORY_MODE by default).
+
+    Returns the plan (time window, resolution and fps to generate at, segment
+    length, memory mode, the estimate and the actions taken) or raises
+    AdmissionError.
+    """
+    model = model or load_cost_model()
+    vram_gb = vram_gb or detect_vram_gb()
+    memory_mode = memory_mode or MEMORY_MODE
+    gpu_budget = min(b for b in (max_gpu_seconds or 0, MAX_GPU_SECONDS, math.inf) if b)
+    if MAX_COST and GPU_COST_PER_SECOND:
+        gpu_budget = min(gpu_budget, MAX_COST / GPU_COST_PER_SECOND)
+
+    start = float(start or 0.0)
+    end = min(float(end), media["duration"]) if end is not None else media["duration"]
+    if not 0 <= start < end:
+        raise AdmissionError(f"Job rejected: empty time window {start}-{end}s "
+                             f"(video is {media['duration']}s)", {"source": media})
+    fps = min(DEFAULT_FPS, int(target_fps)) if target_fps else DEFAULT_FPS
+    if max_frames:
+        end = min(end, start + int(max_frames) / fps)
+        if not start < end:
+            raise AdmissionError(f"Job rejected: max_frames {max_frames} leaves no frames at {fps} fps",
+                                 {"source": media})
+    duration = end - start
+    window = [round(start, 3), round(end, 3)] if start > 0 or end < media["duration"] else None
+    resolution = tuple(resolution)
+    run_seconds = SEGMENT_SECONDS
+    # One entry per reason; stepping down repeatedly keeps only the final outcome
+    actions = {}
+
+    def fit_memory():
+        return select_mode(vram_gb, resolution, run_frames(duration, fps, run_seconds), model, memory_mode)
+
+    def make_plan():
+        return {
+            "source": media,
+            "window": window,
+            "resolution": list(resolution),
+            "fps": fps,
+            "segment_seconds": None,
+            "memory": memory,
+            "estimate": estimate(duration, resolution, fps, model, memory["mode"], run_seconds),
+            "actions": list(actions.values())
+        }
+
+    memory = fit_memory()
+
+    def refuse(reason):
+        plan = make_plan()
+        raise AdmissionError(f"Job rejected: {reason} (estimate: {plan['estimate']})", plan)
+
+    if MAX_VIDEO_SECONDS and duration > MAX_VIDEO_SECONDS:
+        refuse(f"video is {duration:.0f}s, limit is {MAX_VIDEO_SECONDS:.0f}s")
+
+    smaller = [size for size in RESOLUTION_STEPS if size[0] * size[1] < resolution[0] * resolution[1]]
+    lower_fps = [step for step in FPS_STEPS if MIN_FPS <= step < fps]
+
+    # Peak VRAM depends on resolution and the frames of one run; offloading comes before downscaling
+    while not memory["fits"]:
+        if policy == "reject" or not smaller:
+            refuse(f"needs {memory['peak_vram_gb']} GB of VRAM in {memory['mode']} memory mode, "
+                   f"{vram_gb:.0f} GB available")
+        resolution = smaller.pop(0)
+        memory = fit_memory()
+        actions["vram"] = f"downscaled to {resolution[0]}x{resolution[1]} to fit {vram_gb:.0f} GB of VRAM"
+
+    # GPU time: drop fps first (cheaper in quality), then resolution
+    while estimate(duration, resolution, fps, model, memory["mode"], run_seconds)["gpu_seconds"] > gpu_budget:
+        if policy == "reject" or not (lower_fps or smaller):
+            gpu_seconds = estimate(duration, resolution, fps, model, memory["mode"], run_seconds)["gpu_seconds"]
+            refuse(f"needs {gpu_seconds:.0f} GPU seconds, budget is {gpu_budget:.0f}")
+        if lower_fps:
+            fps = lower_fps.pop(0)
+            actions["fps"] = f"reduced to {fps} fps to fit {gpu_budget:.0f} GPU seconds"
+        else:
+            resolution = smaller.pop(0)
+            actions["gpu_seconds"] = f"downscaled to {resolution[0]}x{resolution[1]} to fit {gpu_budget:.0f} GPU seconds"
+
+    # Keep each generation run short enough that a failure only repeats one segment
+    sampling = estimate(duration, resolution, fps, model, memory["mode"], run_seconds)["sampling_seconds"]
+    segment_seconds = None
+    if MAX_RUN_SECONDS and sampling > MAX_RUN_SECONDS:
+        runs = math.ceil(sampling / MAX_RUN_SECONDS)
+        if duration / runs >= 5.0:
+            segment_seconds = round(duration / runs, 1)
+            actions["segments"] = f"split into {segment_seconds}s segments (about {runs} runs)"
+
+    # Lower fps, resolution or shorter runs may let a faster memory mode fit
+    run_seconds = segment_seconds or run_seconds
+    memory = fit_memory()
+    if memory["mode"] != "max_speed" and memory_mode not in MEMORY_MODES:
+        actions["memory"] = f"{describe(memory)} to fit {vram_gb:.0f} GB of VRAM"
+    plan = make_plan()
+    plan["segment_seconds"] = segment_seconds
+    return plan
+
+
+def calibrate(records: list) -> dict:
+    """Fit the per-frame coefficients to successful jobs from a metrics log."""
+    model = dict(COST_MODEL)
+    sampling = mp_frames = preprocess = frames = 0.0
+    for record in records:
+        resolution = record.get("labels", {}).get("resolution")
+        if record.get("status") != "success" or not record.get("frames") or not resolution:
+            continue
+        stages = record.get("stages", {})
+        if "sampling" in stages:
+            sampling += stages["sampling"]
+            mp_frames += record["frames"] * resolution[0] * resolution[1] / 1e6
+        if "preprocess" in stages:
+            preprocess += stages["preprocess"]
+            frames += record["frames"]
+    if mp_frames:
+        model["sampling_seconds_per_mp_frame"] = round(sampling / mp_frames, 4)
+    if frames:
+        model["preprocess_seconds_per_frame"] = round(preprocess / frames, 4)
+    return model
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Probe and cost a job, or calibrate the cost model")
+    parser.add_argument("video", nargs="?", help="Video file or URL to plan")
+    parser.add_argument("--resolution", type=int, nargs=2, default=[1280, 720])
+    parser.add_argument("--max-gpu-seconds", type=float, default=None)
+    parser.add_argument("--start", type=float, default=None)
+    parser.add_argument("--end", type=float, default=None)
+    parser.add_argument("--target-fps", type=float, default=None)
+    parser.add_argument("--max-frames", type=int, default=None)
+    parser.add_argument("--calibrate", metavar="METRICS_LOG", help="Fit coefficients to a metrics JSONL log")
+    args = parser.parse_args()
+
+    if args.calibrate:
+        with open(args.calibrate) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        print(json.dumps(calibrate(records), indent=2))
+    elif args.video:
+        try:
+            plan = plan_job(probe_media(args.video), args.resolution, args.max_gpu_seconds, start=args.start,
+                            end=args.end, target_fps=args.target_fps, max_frames=args.max_frames)
+        except AdmissionError as e:
+            print(e)
+            raise SystemExit(1)
+        print(json.dumps(plan, indent=2))
+    else:
+        parser.error("give a video to plan or --calibrate")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Chunked base64 encode/decode between memory, streams and files.
+
+Decoding works on fixed-size slices with a carry for incomplete quads, so
+writing a base64 payload to disk never holds more than one chunk of decoded
+bytes. Encoding reads the file in multiples of 3 bytes so each chunk
+encodes independently.
+
+encode_file() cannot be bounded the same way: an inline JSON result needs
+the whole encoded text as one str, and a str can only be built by copying
+the encoded bytes. Its peak is therefore about twice the encoded size
+(8/3 of the file), no better than b64encode(f.read()), and serializing
+the result adds more. That O(size) floor is why handler.py uploads outputs
+over INLINE_OUTPUT_MAX_MB instead when storage is configured.
+"""
+
+import binascii
+from pathlib import Path
+
+CHUNK_BYTES = 3 * 256 * 1024       # raw bytes per encode step
+CHUNK_CHARS = 4 * 256 * 1024       # base64 characters per decode step
+_WHITESPACE = b" \t\r\n"
+
+
+def decode_stream(chunks, dest: Path) -> int:
+    """Decode an iterable of base64 str/bytes chunks into dest. Returns bytes written."""
+    written = 0
+    carry = b""
+    with open(dest, "wb") as f:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("ascii")
+            chunk = carry + chunk.translate(None, _WHITESPACE)
+            usable = len(chunk) - len(chunk) % 4
+            carry = chunk[usable:]
+            if usable:
+                data = binascii.a2b_base64(chunk[:usable])
+                f.write(data)
+                written += len(data)
+        if carry:
+            raise ValueError("Invalid base64 data: truncated input")
+    return written
+
+
+def decode_to_file(data: str, dest: Path, chunk_chars: int = CHUNK_CHARS) -> Path:
+    """Decode a base64 string to dest one slice at a time."""
+    decode_stream((data[i:i + chunk_chars] for i in range(0, len(data), chunk_chars)), dest)
+    return dest
+
+
+def encode_file(path: Path, chunk_bytes: int = CHUNK_BYTES) -> str:
+    """Base64 encode a file into a str, reading it a chunk at a time (the result is O(size), see above)."""
+    size = Path(path).stat().st_size
+    buffer = bytearray(4 * ((size + 2) // 3))
+    view = memoryview(buffer)
+    position = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_bytes)
+            if not chunk:
+                break
+            encoded = binascii.b2a_base64(chunk, newline=False)
+            view[position:position + len(encoded)] = encoded
+            position += len(encoded)
+    view.release()
+    return buffer.decode("ascii")
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Peak-memory benchmark for base64 ingest and egress.
+
+For each output size a file is encoded to base64 and decoded back, each
+step in a fresh child process. Peak RSS (VmHWM) is reset once the step's
+input is loaded, so it measures that step alone:
+
+    chunked - b64stream.encode_file / decode_to_file, what the handler calls
+              for inline outputs (encode_output) and inline inputs
+    legacy  - b64encode(f.read()).decode() / b64decode(data), the old path
+
+Both steps start from or end in the whole base64 str, as a JSON payload
+does, so neither can be flat. The payload column is that str's size.
+Decoding should peak near it (the decoded file is written a chunk at a
+time) while legacy adds the whole decoded file on top. Encoding peaks
+near twice the payload either way (see b64stream.py).
+
+    python benchmarks/bench_base64_memory.py --sizes 10 100 1000 --legacy
+"""
+
+import argparse
+import base64
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from b64stream import decode_to_file, encode_file  # noqa: E402
+
+
+def make_file(path: Path, size_mb: int):
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as f:
+        for _ in range(size_mb):
+            f.write(block)
+
+
+def reset_peak_rss():
+    """Start VmHWM over from the current RSS (Linux 4.0+)."""
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def peak_rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024
+    raise RuntimeError("No VmHWM in /proc/self/status")
+
+
+def child(mode: str, src: str, dest: str):
+    """Run one step and print its peak RSS in MB (a decode step's payload str included)."""
+    # A decode step starts from the payload str, as the handler does from its JSON input
+    data = Path(src).read_text() if mode.endswith("-decode") else None
+    reset_peak_rss()
+    if mode == "chunked-encode":
+        encoded = encode_file(Path(src))
+    elif mode == "chunked-decode":
+        decode_to_file(data, Path(dest))
+    elif mode == "legacy-encode":
+        with open(src, "rb") as f:
+            encoded = base64.b64encode(f.read()).decode("utf-8")
+    elif mode == "legacy-decode":
+        with open(dest, "wb") as f:
+            f.write(base64.b64decode(data))
+    peak = peak_rss_mb()
+    if mode.endswith("-encode"):
+        Path(dest).write_text(encoded)
+    print(peak)
+
+
+def measure(mode: str, src: Path, dest: Path) -> float:
+    result = subprocess.run([sys.executable, __file__, "--child", mode, str(src), str(dest)],
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak RSS of base64 encode/decode by output size")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="Sizes in MB")
+    parser.add_argument("--legacy", action="store_true", help="Also measure the whole-file path")
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child)
+        return
+
+    modes = ["chunked"] + (["legacy"] if args.legacy else [])
+    print(f"{'size':>8}  {'mode':<8}  {'payload':>10}  {'encode peak':>12}  {'decode peak':>12}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        temp_path = Path(temp_dir)
+        for size_mb in args.sizes:
+            raw = temp_path / "raw.bin"
+            make_file(raw, size_mb)
+            for mode in modes:
+                encoded = temp_path / "encoded.b64"
+                decoded = temp_path / "decoded.bin"
+                encode_peak = measure(f"{mode}-encode", raw, encoded)
+                decode_peak = measure(f"{mode}-decode", encoded, decoded)
+                if decoded.stat().st_size != raw.stat().st_size:
+                    raise RuntimeError(f"{mode} round trip lost data at {size_mb}MB")
+                payload = encoded.stat().st_size / 1024**2
+                print(f"{size_mb:>6}MB  {mode:<8}  {payload:>8.1f}MB  {encode_peak:>10.1f}MB  {decode_peak:>10.1f}MB")
+                encoded.unlink()
+                decoded.unlink()
+            raw.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Drive a queue of jobs through client.py against the fake endpoint, in one process.
+
+The fake endpoint (benchmarks/fake_endpoint.py) runs in the same event loop
+on a free port; every output is checked against the payload it served.
+Reports the client summary (latency p50/p95/p99, jobs/s), API calls per
+job by route, HTTP retries and peak RSS.
+
+    python benchmarks/bench_client.py                                   # 500 jobs, 100 workers
+    python benchmarks/bench_client.py --jobs 500 --concurrency 500 --error-rate 0.05 --output-url
+    python benchmarks/bench_client.py --poll                            # /status instead of /stream
+"""
+
+import argparse
+import asyncio
+import json
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from client import FaceSwapClient, summarize  # noqa: E402
+from fake_endpoint import add_endpoint_args, endpoint_from_args, start  # noqa: E402
+
+
+async def bench(args) -> dict:
+    endpoint = endpoint_from_args(args)
+    runner = await start(endpoint)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            jobs = [({"video_url": f"https://example.com/{i}.mp4", "photo_url": "https://example.com/face.jpg"},
+                     Path(tmp) / f"job_{i:05d}.mp4", f"job_{i:05d}") for i in range(args.jobs)]
+            start_time = time.time()
+            async with FaceSwapClient("fake", base_url=f"{endpoint.base_url}/v2", concurrency=args.concurrency,
+                                      use_stream=not args.poll, poll_min=args.poll_min, poll_max=args.poll_max,
+                                      job_retries=args.job_retries) as client:
+                results = await client.run_many(jobs)
+            summary = summarize(results, time.time() - start_time)
+            summary["http_retries"] = client.http_retries
+            summary["corrupt_outputs"] = sum(1 for r in results for path in r.output_paths
+                                             if path.read_bytes() != endpoint.payload)
+    finally:
+        await runner.cleanup()
+
+    summary["api_calls_per_job"] = {route: round(count / args.jobs, 2)
+                                    for route, count in sorted(endpoint.requests.items())}
+    summary["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    errors = sorted({r.error for r in results if r.status != "success"})
+    if errors:
+        summary["errors"] = errors[:5]
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark client.py against a local fake endpoint")
+    parser.add_argument("--jobs", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=200, help="Client jobs in flight")
+    parser.add_argument("--poll", action="store_true", help="Poll /status instead of following /stream")
+    parser.add_argument("--poll-min", type=float, default=0.25)
+    parser.add_argument("--poll-max", type=float, default=5.0)
+    parser.add_argument("--job-retries", type=int, default=0)
+    add_endpoint_args(parser)
+    parser.set_defaults(workers=100)
+    args = parser.parse_args()
+
+    summary = asyncio.run(bench(args))
+    print(json.dumps(summary, indent=2))
+    sys.exit(0 if summary["failed"] == 0 and summary["corrupt_outputs"] == 0 else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the serverless handler, no GPU or model needed.
+
+A temporary WAN_DIR holds stand-ins for preprocess_data.py and generate.py
+that sleep for a configurable time and copy their input video through, and
+handler() is driven directly (subprocess generation backend) with inputs
+given either as URLs on a local HTTP server or inline as base64. Each
+scenario (input mode x video size x concurrency) runs in a fresh child
+process so its peak RSS is its own.
+
+Reported per scenario: p50/p95 latency, handler overhead (latency minus the
+stand-ins' sleeps), mean seconds per stage from the job metrics, jobs/s,
+input MB/s and peak RSS.
+
+    python benchmarks/bench_handler.py                      # run and compare to the baseline
+    python benchmarks/bench_handler.py --save-baseline      # record a new baseline
+
+Exits non-zero when a metric regresses past the baseline's thresholds.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import resource
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE = Path(__file__).resolve().parent / "baseline_handler.json"
+
+# Thresholds used when the baseline file doesn't carry its own
+DEFAULT_THRESHOLDS = {
+    "latency_p50": 0.25,    # may grow by 25%
+    "overhead_p50": 0.50,   # handler overhead is small and noisy
+    "peak_rss_mb": 0.20,
+    "jobs_per_second": 0.25  # may drop by 25%
+}
+HIGHER_IS_BETTER = {"jobs_per_second"}
+
+# Stage time: a random pick from FAKE_STAGE_SAMPLES (JSON {stage: [seconds, ...]}) if set,
+# else FAKE_<STAGE>_SECONDS
+FAKE_STAGE_SECONDS = '''
+import json, os, random
+def stage_seconds(name):
+    samples = os.environ.get("FAKE_STAGE_SAMPLES")
+    if samples:
+        with open(samples) as f:
+            return random.choice(json.load(f)[name])
+    return float(os.environ.get(f"FAKE_{name.upper()}_SECONDS", "0"))
+'''
+
+FAKE_PREPROCESS = FAKE_STAGE_SECONDS + '''
+import os, shutil, sys, time
+args = sys.argv
+video = args[args.index("--video_path") + 1]
+photo = args[args.index("--refer_path") + 1]
+out = args[args.index("--save_path") + 1]
+os.makedirs(out, exist_ok=True)
+time.sleep(stage_seconds("preprocess"))
+shutil.copy(video, os.path.join(out, "src_pose.mp4"))
+shutil.copy(video, os.path.join(out, "src_face.mp4"))
+shutil.copy(photo, os.path.join(out, "src_ref.png"))
+'''
+
+FAKE_GENERATE = FAKE_STAGE_SECONDS + '''
+import os, shutil, sys, time
+args = sys.argv
+src = args[args.index("--src_root_path") + 1]
+save_file = args[args.index("--save_file") + 1]
+time.sleep(stage_seconds("generate"))
+shutil.copy(os.environ.get("FAKE_OUTPUT") or os.path.join(src, "src_pose.mp4"), save_file)
+'''
+
+
+def make_video(path: Path, size_mb: float):
+    """A short valid mp4 padded with a trailing 'free' box to about size_mb."""
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", "testsrc=size=320x240:rate=16",
+        "-t", "4", "-c:v", "libx264", "-pix_fmt", "yuv420p", str(path)
+    ], check=True)
+    padding = int(size_mb * 1024**2) - path.stat().st_size - 8
+    if padding > 0:
+        with open(path, "ab") as f:
+            f.write(struct.pack(">I", padding + 8) + b"free")
+            block = b"\0" * (1024 * 1024)
+            while padding > 0:
+                f.write(block[:padding])
+                padding -= len(block)
+
+
+def make_wan_dir(root: Path) -> tuple:
+    wan_dir = root / "Wan2.2"
+    script_dir = wan_dir / "wan" / "modules" / "animate" / "preprocess"
+    script_dir.mkdir(parents=True)
+    (script_dir / "preprocess_data.py").write_text(FAKE_PREPROCESS)
+    (wan_dir / "generate.py").write_text(FAKE_GENERATE)
+    model_dir = root / "model"
+    (model_dir / "process_checkpoint").mkdir(parents=True)
+    (model_dir / ".download_complete").write_text("{}")
+    return wan_dir, model_dir
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve(directory: Path) -> tuple:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(_QuietHandler, directory=str(directory)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def child(spec: dict):
+    """Run one scenario in this process and print its result as JSON."""
+    os.environ.update({
+        "WAN_DIR": spec["wan_dir"],
+        "MODEL_DIR": spec["model_dir"],
+        "GENERATION_BACKEND": "subprocess",
+        "GPU_COUNT": "1",
+        "MAX_CONCURRENT_JOBS": str(spec["concurrency"]),
+        "PREPROCESS_CACHE": "0",
+        "RESULT_CACHE": "0",
+        "CHECKPOINT_DIR": str(Path(spec["wan_dir"]).parent / "checkpoints"),
+        "METRICS_LOG": "",
+        "FAKE_PREPROCESS_SECONDS": str(spec["preprocess_seconds"]),
+        "FAKE_GENERATE_SECONDS": str(spec["generate_seconds"]),
+        "FAKE_OUTPUT": spec.get("output") or ""
+    })
+    sys.path.insert(0, str(ROOT))
+    import handler
+
+    if spec["mode"] == "url":
+        job_input = {"video_url": spec["video_url"], "photo_url": spec["photo_url"]}
+    else:
+        job_input = {
+            "video_base64": base64.b64encode(Path(spec["video"]).read_bytes()).decode("ascii"),
+            "photo_base64": base64.b64encode(Path(spec["photo"]).read_bytes()).decode("ascii")
+        }
+
+    async def run_all():
+        limit = asyncio.Semaphore(spec["concurrency"])
+
+        async def one(i):
+            async with limit:
+                start = time.time()
+                # The handler streams progress events; the result comes last
+                async for result in handler.handler({"id": f"bench-{i}", "input": dict(job_input)}):
+                    pass
+                # Don't hold every job's inlined output, or peak RSS grows with --jobs
+                result.pop("output_base64", None)
+                return time.time() - start, result
+
+        return await asyncio.gather(*[one(i) for i in range(spec["jobs"])])
+
+    start = time.time()
+    runs = asyncio.run(run_all())
+    elapsed = time.time() - start
+
+    errors = [result.get("error") for _, result in runs if result.get("status") != "success"]
+    latencies = [latency for latency, _ in runs]
+    sleeps = spec["preprocess_seconds"] + spec["generate_seconds"]
+    stages = {}
+    for _, result in runs:
+        for name, seconds in result.get("metrics", {}).get("stages", {}).items():
+            stages.setdefault(name, []).append(seconds)
+
+    print("RESULT " + json.dumps({
+        "jobs": spec["jobs"],
+        "errors": errors,
+        "latency_p50": round(percentile(latencies, 0.5), 3),
+        "latency_p95": round(percentile(latencies, 0.95), 3),
+        "overhead_p50": round(percentile(latencies, 0.5) - sleeps, 3),
+        "stages": {name: round(statistics.mean(values), 3) for name, values in stages.items()},
+        "jobs_per_second": round(spec["jobs"] / elapsed, 3),
+        "input_mb_per_second": round(spec["jobs"] * spec["size_mb"] / elapsed, 2),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }))
+
+
+def run_child(spec: dict) -> dict:
+    result = subprocess.run([sys.executable, __file__, "--child", json.dumps(spec)],
+                            capture_output=True, text=True, cwd=ROOT)
+    for line in result.stdout.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    raise RuntimeError(f"Scenario {spec['name']} failed:\n{result.stdout[-2000:]}\n{result.stderr[-2000:]}")
+
+
+def compare(results: dict, baseline: dict) -> list:
+    """Return a description of every metric that regressed past its threshold."""
+    thresholds = {**DEFAULT_THRESHOLDS, **baseline.get("thresholds", {})}
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get("scenarios", {}).get(name)
+        if expected is None:
+            continue
+        for metric, tolerance in thresholds.items():
+            old, new = expected.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            if metric in HIGHER_IS_BETTER:
+                limit = old * (1 - tolerance)
+                worse = new < limit
+            else:
+                # Small absolute floor so sub-100ms noise never fails the run
+                limit = old * (1 + tolerance) + 0.05
+                worse = new > limit
+            if worse:
+                regressions.append(f"{name}: {metric} {new} vs baseline {old} (limit {limit:.3f})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline handler benchmark with regression check")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 10, 50], help="Input video sizes in MB")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2], help="Jobs in flight")
+    parser.add_argument("--modes", nargs="+", default=["url", "base64"], choices=["url", "base64"])
+    # Enough jobs that one slow job does not move p50 past the thresholds
+    parser.add_argument("--jobs", type=int, default=8, help="Jobs per scenario")
+    parser.add_argument("--preprocess-seconds", type=float, default=0.2, help="Stand-in preprocessing time")
+    parser.add_argument("--generate-seconds", type=float, default=0.3, help="Stand-in generation time")
+    parser.add_argument("--output-mb", type=float, default=None,
+                        help="Size of the generated video (default: same as the input)")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(json.loads(args.child))
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir)
+        wan_dir, model_dir = make_wan_dir(root)
+        media = root / "media"
+        media.mkdir()
+        photo = media / "photo.jpg"
+        photo.write_bytes(os.urandom(200 * 1024))
+        output = None
+        if args.output_mb:
+            output = media / "output.mp4"
+            make_video(output, args.output_mb)
+        server, base_url = serve(media)
+
+        print(f"{'scenario':<24} {'p50':>7} {'p95':>7} {'overhead':>9} {'jobs/s':>7} {'MB/s':>7} {'rss':>8}")
+        try:
+            for size_mb in args.sizes:
+                video = media / f"video_{size_mb:g}mb.mp4"
+                make_video(video, size_mb)
+                for mode in args.modes:
+                    for concurrency in args.concurrency:
+                        name = f"{mode}-{size_mb:g}mb-c{concurrency}"
+                        spec = {
+                            "name": name, "mode": mode, "size_mb": size_mb, "concurrency": concurrency,
+                            "jobs": args.jobs, "wan_dir": str(wan_dir), "model_dir": str(model_dir),
+                            "video": str(video), "photo": str(photo),
+                            "video_url": f"{base_url}/{video.name}", "photo_url": f"{base_url}/{photo.name}",
+                            "preprocess_seconds": args.preprocess_seconds,
+                            "generate_seconds": args.generate_seconds,
+                            "output": str(output) if output else None
+                        }
+                        result = results[name] = run_child(spec)
+                        if result["errors"]:
+                            raise RuntimeError(f"{name}: {result['errors'][0]}")
+                        print(f"{name:<24} {result['latency_p50']:>6.2f}s {result['latency_p95']:>6.2f}s "
+                              f"{result['overhead_p50']:>8.2f}s {result['jobs_per_second']:>7.2f} "
+                              f"{result['input_mb_per_second']:>7.1f} {result['peak_rss_mb']:>6.0f}MB")
+                        print(f"{'':<24} stages: " + ", ".join(f"{stage} {seconds:.2f}s"
+                                                              for stage, seconds in result["stages"].items()))
+        finally:
+            server.shutdown()
+
+    settings = {"jobs": args.jobs, "preprocess_seconds": args.preprocess_seconds,
+                "generate_seconds": args.generate_seconds, "output_mb": args.output_mb}
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps({
+            "thresholds": DEFAULT_THRESHOLDS,
+            "settings": settings,
+            "scenarios": results
+        }, indent=2) + "\n")
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}; run with --save-baseline to record one")
+        return
+    baseline = json.loads(args.baseline.read_text())
+    if baseline.get("settings") != settings:
+        print(f"WARNING: settings differ from the baseline's {baseline.get('settings')}; comparison may not be meaningful")
+    regressions = compare(results, baseline)
+    if regressions:
+        print("\nREGRESSIONS:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print("\nNo regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
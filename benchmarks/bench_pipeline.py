@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Synthetic benchmark for the staged job pipeline.
+
+Runs N jobs through stub stages (sleeps standing in for download,
+preprocessing, generation and encoding) once strictly in sequence and once
+through StagedPipeline, and reports the throughput of each.
+
+    python benchmarks/bench_pipeline.py --jobs 8 --ingest 0.3 --preprocess 0.6 --generate 1.0
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pipeline import Stage, StagedPipeline  # noqa: E402
+
+
+def stub(seconds: float):
+    def run(ctx):
+        time.sleep(seconds)
+        return ctx
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sequential and pipelined job throughput")
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--ingest", type=float, default=0.3, help="Seconds per download")
+    parser.add_argument("--preprocess", type=float, default=0.6, help="Seconds per preprocessing run")
+    parser.add_argument("--generate", type=float, default=1.0, help="Seconds per generation (GPU)")
+    parser.add_argument("--encode", type=float, default=0.1, help="Seconds per result encoding")
+    parser.add_argument("--concurrency", type=int, default=2, help="Jobs accepted at once")
+    args = parser.parse_args()
+
+    durations = [args.ingest, args.preprocess, args.generate, args.encode]
+
+    # Sequential: the current single-job handler
+    start = time.time()
+    for _ in range(args.jobs):
+        for seconds in durations:
+            stub(seconds)({})
+    sequential = time.time() - start
+
+    # Pipelined
+    pipeline = StagedPipeline([
+        Stage("ingest", stub(args.ingest), concurrency=args.concurrency),
+        Stage("preprocess", stub(args.preprocess), concurrency=1),
+        Stage("generate", stub(args.generate), concurrency=1),
+        Stage("encode", stub(args.encode), concurrency=1),
+    ])
+    start = time.time()
+    futures = [pipeline.submit({"job": i}) for i in range(args.jobs)]
+    for future in futures:
+        future.result()
+    pipelined = time.time() - start
+    stats = pipeline.stats()
+    pipeline.shutdown()
+
+    bottleneck = max(durations)
+    print(f"Jobs:        {args.jobs}")
+    print(f"Sequential:  {sequential:.2f}s  ({args.jobs / sequential:.2f} jobs/s)")
+    print(f"Pipelined:   {pipelined:.2f}s  ({args.jobs / pipelined:.2f} jobs/s)")
+    print(f"Speedup:     {sequential / pipelined:.2f}x "
+          f"(ideal {sum(durations) / bottleneck:.2f}x, bound by slowest stage)")
+    gpu_busy = stats["generate"]["busy_seconds"] / pipelined
+    print(f"GPU stage utilisation: {gpu_busy:.0%}")
+
+
+if __name__ == "__main__":
+    main()
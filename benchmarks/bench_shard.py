@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Scaling of frame-sharded preprocessing (shard.py) with a stub per-frame workload.
+
+A stand-in preprocess_data.py burns --frame-ms of CPU per input frame and
+copies its clip through as the pose/face/bg/mask outputs, so the work
+scales with frames like the real one does. The same test video is then
+preprocessed with each shard count, and for every run the benchmark
+reports wall time, speedup over one shard, parallel efficiency and the
+PSNR of the merged src_pose.mp4 against the input (a shard boundary off
+by a frame shows up as a sharp drop).
+
+    python benchmarks/bench_shard.py                            # 1, 2, 4, 8 shards
+    python benchmarks/bench_shard.py --frames 960 --frame-ms 40 --shards 1 4 16
+
+Shards run side by side up to the cores available, so speedup flattens
+once the shard count passes the core count.
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# One core per stub shard and no memory cap, so the pool is limited only by cores
+os.environ.setdefault("PREPROCESS_SHARD_CPUS", "1")
+os.environ.setdefault("PREPROCESS_SHARD_MEMORY_GB", "0")
+os.environ["PREPROCESS_SHARD_MIN_FRAMES"] = "1"
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from preprocess import PREPROCESS_SCRIPT, run_preprocessing  # noqa: E402
+from segment import probe_frames  # noqa: E402
+from shard import available_cpus, preprocess_sharded  # noqa: E402
+
+STUB_PREPROCESS = '''
+import os, shutil, subprocess, sys, time
+args = sys.argv
+video = args[args.index("--video_path") + 1]
+photo = args[args.index("--refer_path") + 1]
+out = args[args.index("--save_path") + 1]
+frames = int(subprocess.run(["ffprobe", "-v", "error", "-select_streams", "v:0", "-count_packets",
+                             "-show_entries", "stream=nb_read_packets", "-of", "csv=p=0", video],
+                            capture_output=True, text=True, check=True).stdout)
+for _ in range(frames):
+    end = time.process_time() + float(os.environ["STUB_FRAME_MS"]) / 1000
+    while time.process_time() < end:
+        pass
+os.makedirs(out, exist_ok=True)
+for name in ("src_pose.mp4", "src_face.mp4", "src_bg.mp4", "src_mask.mp4"):
+    shutil.copy(video, os.path.join(out, name))
+shutil.copy(photo, os.path.join(out, "src_ref.png"))
+'''
+
+
+def make_inputs(root: Path, frames: int) -> tuple:
+    wan_dir = root / "Wan2.2"
+    script = wan_dir / PREPROCESS_SCRIPT
+    script.parent.mkdir(parents=True)
+    script.write_text(STUB_PREPROCESS)
+    model_dir = root / "model"
+    (model_dir / "process_checkpoint").mkdir(parents=True)
+
+    video, photo = root / "input.mp4", root / "face.png"
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", "testsrc2=size=320x240:rate=25",
+        "-frames:v", str(frames), "-c:v", "libx264", "-pix_fmt", "yuv420p", str(video)
+    ], check=True)
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", "color=c=gray:size=64x64", "-frames:v", "1", str(photo)
+    ], check=True)
+    return wan_dir, model_dir, video, photo
+
+
+def psnr(path: Path, reference: Path) -> float:
+    result = subprocess.run([
+        "ffmpeg", "-hide_banner", "-i", str(path), "-i", str(reference),
+        "-lavfi", "psnr", "-f", "null", "-"
+    ], capture_output=True, text=True)
+    match = re.search(r"average:(\S+)", result.stderr)
+    return float(match.group(1)) if match and match.group(1) != "inf" else float("inf")
+
+
+def bench(args) -> list:
+    os.environ["STUB_FRAME_MS"] = str(args.frame_ms)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        wan_dir, model_dir, video, photo = make_inputs(root, args.frames)
+
+        def run(clip, output_dir):
+            return run_preprocessing(wan_dir, model_dir, clip, photo, output_dir, (320, 240))
+
+        for shards in args.shards:
+            out = root / f"out_{shards}"
+            start = time.time()
+            if not preprocess_sharded(run, video, out, root / f"work_{shards}", setting=str(shards)):
+                run(video, out)
+            seconds = time.time() - start
+            results.append({
+                "shards": shards,
+                "seconds": round(seconds, 2),
+                "frames_out": probe_frames(out / "src_pose.mp4"),
+                "psnr_vs_input": round(psnr(out / "src_pose.mp4", video), 1)
+            })
+
+    # Relative to the first run (one shard by default)
+    base = results[0]["seconds"]
+    for result in results:
+        result["speedup"] = round(base / result["seconds"], 2)
+        result["efficiency"] = round(result["speedup"] * results[0]["shards"] / result["shards"], 2)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark frame-sharded preprocessing with a stub workload")
+    parser.add_argument("--frames", type=int, default=480, help="Frames in the test video")
+    parser.add_argument("--frame-ms", type=float, default=20, help="Stub CPU time per frame")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    results = bench(args)
+    print(json.dumps({"frames": args.frames, "frame_ms": args.frame_ms, "cpus": available_cpus(),
+                      "runs": results}, indent=2))
+    sys.exit(0 if all(r["frames_out"] == args.frames for r in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
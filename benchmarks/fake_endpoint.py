@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the RunPod serverless API, for exercising client.py.
+
+Serves /v2/<endpoint>/{run,runsync,status,stream,cancel,health} the way a
+streaming endpoint with return_aggregate_stream does. Jobs queue for a pool
+of simulated workers, take a random time within --job-seconds, emit
+progress events and finish with an output_base64 (or output_url served
+from /files). --fail-rate makes jobs FAIL; --error-rate answers API calls
+with a 503 so client retries get exercised.
+
+    python benchmarks/fake_endpoint.py --port 8000 --workers 50
+    RUNPOD_API_BASE=http://127.0.0.1:8000/v2 RUNPOD_ENDPOINT_ID=fake python client.py jobs.jsonl
+"""
+
+import argparse
+import asyncio
+import base64
+import os
+import random
+import time
+import uuid
+from collections import Counter
+
+from aiohttp import web
+
+PROGRESS_EVENTS = 4
+
+
+class FakeEndpoint:
+    """In-memory job queue worked by `workers` simulated GPU workers."""
+
+    def __init__(self, workers: int = 8, job_seconds: tuple = (1.0, 3.0), output_kb: int = 256,
+                 output_url: bool = False, fail_rate: float = 0.0, error_rate: float = 0.0,
+                 api_key: str = None):
+        self.workers = workers
+        self.job_seconds = job_seconds
+        self.output_url = output_url
+        self.fail_rate = fail_rate
+        self.error_rate = error_rate
+        self.api_key = api_key
+        # Every job returns the same bytes, so 500 jobs don't need 500 outputs in memory
+        self.payload = os.urandom(output_kb * 1024)
+        self.payload_base64 = base64.b64encode(self.payload).decode("ascii")
+        self.jobs = {}
+        self.requests = Counter()
+        self.base_url = None
+        self._queue = asyncio.Queue()
+        self._tasks = []
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        app.add_routes([
+            web.post("/v2/{endpoint}/run", self.run),
+            web.post("/v2/{endpoint}/runsync", self.runsync),
+            web.get("/v2/{endpoint}/status/{job_id}", self.status),
+            web.get("/v2/{endpoint}/stream/{job_id}", self.stream),
+            web.post("/v2/{endpoint}/cancel/{job_id}", self.cancel),
+            web.get("/v2/{endpoint}/health", self.health),
+            web.get("/files/{name}", self.file)
+        ])
+        app.on_startup.append(self._start_workers)
+        app.on_cleanup.append(self._stop_workers)
+        return app
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        route = request.path.split("/")[3] if request.path.startswith("/v2/") else "files"
+        self.requests[route] += 1
+        if route != "files":
+            if self.api_key and request.headers.get("Authorization") != f"Bearer {self.api_key}":
+                raise web.HTTPUnauthorized()
+            if random.random() < self.error_rate:
+                self.requests["injected_503"] += 1
+                raise web.HTTPServiceUnavailable()
+        return await handler(request)
+
+    async def _start_workers(self, app):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _stop_workers(self, app):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _emit(self, job: dict, output):
+        job["unread"].append({"output": output})
+        job["output"].append(output)
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            if job["status"] != "IN_QUEUE":
+                continue
+            job["status"] = "IN_PROGRESS"
+            job["started"] = time.time()
+            duration = random.uniform(*self.job_seconds)
+            for step in range(1, PROGRESS_EVENTS + 1):
+                await asyncio.sleep(duration / PROGRESS_EVENTS)
+                if job["status"] == "CANCELLED":
+                    break
+                self._emit(job, {"status": "in_progress", "stage": "generate", "step": step,
+                                 "steps": PROGRESS_EVENTS,
+                                 "eta_seconds": round(duration * (PROGRESS_EVENTS - step) / PROGRESS_EVENTS, 1)})
+            else:
+                if random.random() < self.fail_rate:
+                    job["status"], job["error"] = "FAILED", "simulated failure"
+                else:
+                    result = {"status": "success"}
+                    if self.output_url:
+                        result["output_url"] = f"{self.base_url}/files/{job['id']}.mp4"
+                    else:
+                        result["output_base64"] = self.payload_base64
+                    self._emit(job, result)
+                    job["status"] = "COMPLETED"
+            job["finished"] = time.time()
+
+    def _job(self, request) -> dict:
+        job = self.jobs.get(request.match_info["job_id"])
+        if job is None:
+            raise web.HTTPNotFound()
+        return job
+
+    def _status(self, job: dict) -> dict:
+        data = {"id": job["id"], "status": job["status"]}
+        if job.get("started"):
+            data["delayTime"] = int((job["started"] - job["created"]) * 1000)
+        if job.get("finished"):
+            data["executionTime"] = int((job["finished"] - job["started"]) * 1000)
+        if job["status"] == "COMPLETED":
+            data["output"] = job["output"]
+        if job.get("error"):
+            data["error"] = job["error"]
+        return data
+
+    async def _submit(self, request) -> dict:
+        body = await request.json()
+        if "input" not in body:
+            raise web.HTTPBadRequest(text="missing input")
+        job = {"id": uuid.uuid4().hex, "status": "IN_QUEUE", "input": body["input"], "created": time.time(),
+               "unread": [], "output": []}
+        self.jobs[job["id"]] = job
+        self._queue.put_nowait(job)
+        return job
+
+    async def run(self, request):
+        job = await self._submit(request)
+        return web.json_response({"id": job["id"], "status": job["status"]})
+
+    async def runsync(self, request):
+        job = await self._submit(request)
+        while job["status"] in ("IN_QUEUE", "IN_PROGRESS"):
+            await asyncio.sleep(0.1)
+        return web.json_response(self._status(job))
+
+    async def status(self, request):
+        return web.json_response(self._status(self._job(request)))
+
+    async def stream(self, request):
+        # Like RunPod, each call returns only the items produced since the last one
+        job = self._job(request)
+        items, job["unread"] = job["unread"], []
+        return web.json_response({"status": job["status"], "stream": items})
+
+    async def cancel(self, request):
+        job = self._job(request)
+        if job["status"] in ("IN_QUEUE", "IN_PROGRESS"):
+            job["status"] = "CANCELLED"
+        return web.json_response({"id": job["id"], "status": job["status"]})
+
+    async def health(self, request):
+        counts = Counter(job["status"] for job in self.jobs.values())
+        return web.json_response({"jobs": dict(counts), "workers": self.workers})
+
+    async def file(self, request):
+        return web.Response(body=self.payload, content_type="video/mp4")
+
+
+async def start(endpoint: FakeEndpoint, host: str = "127.0.0.1", port: int = 0) -> web.AppRunner:
+    """Serve endpoint in the running loop (port 0 picks a free port); sets endpoint.base_url."""
+    runner = web.AppRunner(endpoint.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_host, bound_port = runner.addresses[0][:2]
+    endpoint.base_url = f"http://{bound_host}:{bound_port}"
+    return runner
+
+
+def parse_range(value: str) -> tuple:
+    low, _, high = value.partition(",")
+    return float(low), float(high or low)
+
+
+def add_endpoint_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--workers", type=int, default=8, help="Simulated workers")
+    parser.add_argument("--job-seconds", type=parse_range, default=(1.0, 3.0), help="MIN,MAX run time per job")
+    parser.add_argument("--output-kb", type=int, default=256, help="Size of each job's output")
+    parser.add_argument("--output-url", action="store_true", help="Return output_url instead of output_base64")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of jobs that end FAILED")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of API calls answered with 503")
+
+
+def endpoint_from_args(args) -> FakeEndpoint:
+    return FakeEndpoint(workers=args.workers, job_seconds=args.job_seconds, output_kb=args.output_kb,
+                        output_url=args.output_url, fail_rate=args.fail_rate, error_rate=args.error_rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake RunPod serverless endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_endpoint_args(parser)
+    args = parser.parse_args()
+
+    async def serve():
+        endpoint = endpoint_from_args(args)
+        runner = await start(endpoint, args.host, args.port)
+        print(f"Fake endpoint on {endpoint.base_url}/v2/<endpoint_id> with {args.workers} workers")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+Load and latency-SLO harness for sizing worker counts, no GPU needed.
+
+A local stand-in for the RunPod job queue feeds a pool of worker processes,
+each running handler() with the stand-in Wan scripts from bench_handler.py.
+Stage times are drawn per job from recorded distributions (a METRICS_LOG,
+or ranges given on the command line), and a worker that scales up pays a
+cold start drawn the same way. Arrivals are open loop: Poisson, bursts or a
+replayed trace. Scaling follows the serverless rules: a worker starts while
+queued and running jobs exceed the capacity of the live workers (up to
+--max-workers), takes up to --concurrency jobs (MAX_CONCURRENT_JOBS), and
+stops after --idle-timeout seconds without work, down to --active workers.
+
+Every combination of --max-workers, --concurrency and --active replays the
+same arrivals and reports queue wait, the share of jobs that waited on a
+cold start, p50/p95/p99 end-to-end latency, GPU utilization (sampling time
+over billed worker time) and billed worker seconds.
+
+    python benchmarks/load_test.py --max-workers 1 2 4 --concurrency 1 2
+    python benchmarks/load_test.py --arrivals burst --burst 10 --burst-every 600 --slo-p95 900
+    python benchmarks/load_test.py --metrics-log /runpod-volume/metrics.jsonl --arrivals trace --trace arrivals.txt
+
+All times are simulated seconds, run --time-scale times faster. The
+handler's own overhead (probing, copying, encoding) runs at real speed and
+so appears 1/time-scale times longer; keep the scale near 0.02 or above.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_handler import ROOT, make_video, make_wan_dir, percentile, serve  # noqa: E402
+
+# Simulated seconds, used for stages the metrics log doesn't cover
+DEFAULT_RANGES = {
+    "preprocess": (15.0, 45.0),
+    "generate": (60.0, 240.0),
+    "cold_start": (60.0, 180.0)
+}
+# Metrics log stage for each stand-in stage
+LOG_STAGES = {"preprocess": "preprocess", "generate": "sampling", "cold_start": "model_load"}
+LINE_LIMIT = 1024 * 1024
+
+
+def parse_range(value: str) -> tuple:
+    low, _, high = value.partition(",")
+    return float(low), float(high or low)
+
+
+def load_samples(metrics_log: Path = None, ranges: dict = None, count: int = 500) -> dict:
+    """Seconds per stage: recorded values from a metrics log, else draws from a uniform range."""
+    samples = {stage: [] for stage in DEFAULT_RANGES}
+    if metrics_log:
+        with open(metrics_log) as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get("status") != "success":
+                    continue
+                for stage, log_stage in LOG_STAGES.items():
+                    seconds = record.get("stages", {}).get(log_stage)
+                    # model_load is ~0 on warm workers; only cold ones say anything about cold starts
+                    if seconds is not None and (stage != "cold_start" or seconds > 1.0):
+                        samples[stage].append(seconds)
+    for stage, (low, high) in {**DEFAULT_RANGES, **(ranges or {})}.items():
+        if not samples[stage] or (ranges and stage in ranges):
+            samples[stage] = [random.uniform(low, high) for _ in range(count)]
+    return samples
+
+
+def make_arrivals(args) -> list:
+    """Arrival offsets in simulated seconds."""
+    if args.arrivals == "trace":
+        offsets = []
+        with open(args.trace) as f:
+            for line in f:
+                if line.strip():
+                    value = json.loads(line)
+                    offsets.append(float(value["t"] if isinstance(value, dict) else value))
+        first = min(offsets)
+        return sorted(offset - first for offset in offsets)
+    if args.arrivals == "burst":
+        return [group * args.burst_every for group in range(-(-args.jobs // args.burst))
+                for _ in range(args.burst)][:args.jobs]
+    offsets, now = [], 0.0
+    for _ in range(args.jobs):
+        offsets.append(now)
+        now += random.expovariate(args.rate / 60)
+    return offsets
+
+
+def worker(spec: dict):
+    """
+    A worker process: import the handler, then follow JSON commands on stdin.
+    {"start": seconds} sleeps through a cold start and prints READY;
+    {"job": {...}} runs a job and prints RESULT when it finishes.
+    """
+    os.environ.update({
+        "WAN_DIR": spec["wan_dir"],
+        "MODEL_DIR": spec["model_dir"],
+        "GENERATION_BACKEND": "subprocess",
+        "GPU_COUNT": "1",
+        "MAX_CONCURRENT_JOBS": str(spec["concurrency"]),
+        "PREPROCESS_CACHE": "0",
+        "RESULT_CACHE": "0",
+        "METRICS_LOG": "",
+        "FAKE_STAGE_SAMPLES": spec["samples_file"]
+    })
+    sys.path.insert(0, str(ROOT))
+    import handler
+
+    def emit(line: str):
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+    async def run_job(job):
+        async for result in handler.handler(job):
+            pass
+        emit("RESULT " + json.dumps({
+            "id": job["id"],
+            "status": result.get("status"),
+            "error": result.get("error"),
+            "sampling": result.get("metrics", {}).get("stages", {}).get("sampling", 0.0)
+        }))
+
+    async def start(seconds):
+        await asyncio.sleep(seconds)
+        emit("READY")
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        commands = asyncio.Queue()
+
+        def read_stdin():
+            for line in sys.stdin:
+                loop.call_soon_threadsafe(commands.put_nowait, json.loads(line))
+            loop.call_soon_threadsafe(commands.put_nowait, None)
+
+        threading.Thread(target=read_stdin, daemon=True).start()
+        emit("BOOTED")
+        tasks = set()
+        while (command := await commands.get()) is not None:
+            task = asyncio.ensure_future(start(command["start"]) if "start" in command else run_job(command["job"]))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+
+
+class Job:
+    def __init__(self, index: int, arrival: float):
+        self.id = f"load-{index}"
+        self.arrival = arrival
+        self.dispatched = None
+        self.finished = None
+        self.cold = False
+        self.status = None
+        self.error = None
+        self.sampling = 0.0
+
+
+class Worker:
+    """One worker process; parked until the scaler starts it."""
+
+    def __init__(self, process):
+        self.process = process
+        self.state = "parked"   # parked -> booting -> ready -> parked
+        self.running = {}
+        self.started_at = None
+        self.ready_at = None
+        self.idle_since = None
+        self.billed = 0.0
+        self.booted = asyncio.Event()
+
+    def send(self, command: dict):
+        self.process.stdin.write((json.dumps(command) + "\n").encode("utf-8"))
+
+    def start(self, cold_start: float):
+        self.state = "booting"
+        self.started_at = time.time()
+        self.send({"start": cold_start})
+
+    def stop(self, now: float):
+        self.state = "parked"
+        self.billed += now - self.started_at
+
+
+async def run_config(config: dict, arrivals: list, samples: dict, spec: dict, args) -> dict:
+    """Replay arrivals against one worker configuration and summarize the jobs."""
+    scale = args.time_scale
+    concurrency = config["concurrency"]
+    wake = asyncio.Event()
+    queue = deque()
+    jobs = []
+
+    async def follow(worker: Worker):
+        while line := await worker.process.stdout.readline():
+            line = line.decode("utf-8", "replace").rstrip("\n")
+            now = time.time()
+            if line == "BOOTED":
+                worker.booted.set()
+            elif line == "READY":
+                worker.state, worker.ready_at, worker.idle_since = "ready", now, now
+            elif line.startswith("RESULT "):
+                result = json.loads(line[len("RESULT "):])
+                job = worker.running.pop(result["id"])
+                job.finished, job.status, job.error = now, result["status"], result["error"]
+                job.sampling = result["sampling"] or 0.0
+                if not worker.running:
+                    worker.idle_since = now
+            else:
+                continue
+            wake.set()
+
+    processes = [await asyncio.create_subprocess_exec(
+        sys.executable, __file__, "--worker", json.dumps({**spec, "concurrency": concurrency}),
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+        cwd=ROOT, limit=LINE_LIMIT) for _ in range(config["max_workers"])]
+    workers = [Worker(process) for process in processes]
+    readers = [asyncio.ensure_future(follow(worker)) for worker in workers]
+    await asyncio.gather(*[worker.booted.wait() for worker in workers])
+
+    # Active workers are warm before the first job arrives
+    for worker in workers[:config["active"]]:
+        worker.start(0)
+    while any(worker.state == "booting" for worker in workers):
+        await asyncio.sleep(0.01)
+
+    start = time.time()
+
+    async def arrive():
+        for index, offset in enumerate(arrivals):
+            await asyncio.sleep(max(0.0, start + offset * scale - time.time()))
+            job = Job(index, time.time())
+            jobs.append(job)
+            queue.append(job)
+            wake.set()
+
+    arrivals_task = asyncio.ensure_future(arrive())
+    peak_workers = 0
+    while not arrivals_task.done() or queue or any(worker.running for worker in workers):
+        now = time.time()
+        # Hand queued jobs to the least loaded ready worker
+        while queue:
+            ready = [w for w in workers if w.state == "ready" and len(w.running) < concurrency]
+            if not ready:
+                break
+            worker = min(ready, key=lambda w: len(w.running))
+            job = queue.popleft()
+            job.dispatched = now
+            job.cold = worker.ready_at > job.arrival
+            worker.running[job.id] = job
+            worker.send({"job": {"id": job.id, "input": {
+                "video_url": f"{spec['video_url']}?job={job.id}",
+                "photo_url": spec["photo_url"]
+            }}})
+
+        # Scale up while work exceeds the capacity of live workers
+        live = [w for w in workers if w.state != "parked"]
+        demand = len(queue) + sum(len(w.running) for w in live)
+        parked = [w for w in workers if w.state == "parked"]
+        while demand > len(live) * concurrency and parked:
+            worker = parked.pop()
+            worker.start(random.choice(samples["cold_start"]) * scale)
+            live.append(worker)
+
+        # Scale down idle workers past the idle timeout, keeping the active ones
+        for worker in live:
+            if (len(live) > config["active"] and worker.state == "ready" and not worker.running
+                    and now - worker.idle_since >= args.idle_timeout * scale):
+                worker.stop(now)
+                live.remove(worker)
+        peak_workers = max(peak_workers, len(live))
+
+        wake.clear()
+        try:
+            await asyncio.wait_for(wake.wait(), timeout=0.05)
+        except asyncio.TimeoutError:
+            pass
+
+    end = time.time()
+    for worker in workers:
+        if worker.state != "parked":
+            worker.stop(end)
+        worker.process.stdin.close()
+    await asyncio.gather(*[worker.process.wait() for worker in workers])
+    await asyncio.gather(*readers)
+
+    done = [job for job in jobs if job.status == "success"]
+    waits = [(job.dispatched - job.arrival) / scale for job in jobs]
+    latencies = [(job.finished - job.arrival) / scale for job in done]
+    billed = sum(worker.billed for worker in workers)
+    summary = {
+        **config,
+        "jobs": len(jobs),
+        "failed": len(jobs) - len(done),
+        "queue_wait_p50": round(percentile(waits, 0.50), 1),
+        "queue_wait_p95": round(percentile(waits, 0.95), 1),
+        "latency_p50": round(percentile(latencies, 0.50), 1) if latencies else None,
+        "latency_p95": round(percentile(latencies, 0.95), 1) if latencies else None,
+        "latency_p99": round(percentile(latencies, 0.99), 1) if latencies else None,
+        "cold_start_share": round(sum(job.cold for job in jobs) / len(jobs), 3),
+        "gpu_utilization": round(sum(job.sampling for job in jobs) / billed, 3) if billed else None,
+        "worker_seconds": round(billed / scale, 1),
+        "peak_workers": peak_workers,
+        "makespan_seconds": round((end - start) / scale, 1)
+    }
+    errors = sorted({job.error for job in jobs if job.error})
+    if errors:
+        summary["errors"] = errors[:3]
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load/SLO harness against a local fake serverless runtime")
+    parser.add_argument("--max-workers", type=int, nargs="+", default=[1, 2, 4], help="Worker limits to try")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1], help="Jobs per worker to try")
+    parser.add_argument("--active", type=int, nargs="+", default=[0], help="Always-on worker counts to try")
+    parser.add_argument("--idle-timeout", type=float, default=5.0, help="Seconds before an idle worker stops")
+    parser.add_argument("--arrivals", choices=["poisson", "burst", "trace"], default="poisson")
+    parser.add_argument("--jobs", type=int, default=40, help="Jobs to send (poisson, burst)")
+    parser.add_argument("--rate", type=float, default=2.0, help="Mean arrivals per minute (poisson)")
+    parser.add_argument("--burst", type=int, default=10, help="Jobs per burst (burst)")
+    parser.add_argument("--burst-every", type=float, default=600.0, help="Seconds between bursts (burst)")
+    parser.add_argument("--trace", type=Path, help="Arrival times, one per line: seconds or {\"t\": seconds}")
+    parser.add_argument("--metrics-log", type=Path, help="METRICS_LOG to draw stage and cold-start times from")
+    for stage in DEFAULT_RANGES:
+        parser.add_argument(f"--{stage.replace('_', '-')}", type=parse_range, metavar="MIN,MAX",
+                            help=f"{stage} seconds (default: metrics log, else {DEFAULT_RANGES[stage]})")
+    parser.add_argument("--time-scale", type=float, default=0.02, help="Real seconds per simulated second")
+    parser.add_argument("--slo-p95", type=float, help="p95 latency target in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="Also write the results here")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(json.loads(args.worker))
+        return
+    if args.arrivals == "trace" and not args.trace:
+        parser.error("--arrivals trace needs --trace")
+
+    random.seed(args.seed)
+    ranges = {stage: getattr(args, stage) for stage in DEFAULT_RANGES if getattr(args, stage)}
+    samples = load_samples(args.metrics_log, ranges)
+    arrivals = make_arrivals(args)
+    configs = [{"max_workers": w, "concurrency": c, "active": a}
+               for w, c, a in itertools.product(args.max_workers, args.concurrency, args.active) if a <= w]
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir)
+        wan_dir, model_dir = make_wan_dir(root)
+        media = root / "media"
+        media.mkdir()
+        make_video(media / "video.mp4", 0.1)
+        (media / "photo.jpg").write_bytes(os.urandom(64 * 1024))
+        samples_file = root / "samples.json"
+        samples_file.write_text(json.dumps({stage: [seconds * args.time_scale for seconds in values]
+                                            for stage, values in samples.items()}))
+        server, base_url = serve(media)
+        spec = {"wan_dir": str(wan_dir), "model_dir": str(model_dir), "samples_file": str(samples_file),
+                "video_url": f"{base_url}/video.mp4", "photo_url": f"{base_url}/photo.jpg"}
+
+        print(f"{len(arrivals)} jobs over {arrivals[-1]:.0f}s ({args.arrivals}); "
+              + ", ".join(f"{stage} p50 {percentile(values, 0.5):.0f}s" for stage, values in samples.items()))
+        print(f"{'workers':>7} {'conc':>4} {'active':>6} {'wait p50':>9} {'wait p95':>9} {'p50':>7} {'p95':>7} "
+              f"{'p99':>7} {'cold':>6} {'gpu':>6} {'worker-s':>9}" + ("  SLO" if args.slo_p95 else ""))
+        try:
+            for config in configs:
+                summary = asyncio.run(run_config(config, arrivals, samples, spec, args))
+                if args.slo_p95:
+                    summary["meets_slo"] = (summary["failed"] == 0 and summary["latency_p95"] is not None
+                                            and summary["latency_p95"] <= args.slo_p95)
+                results.append(summary)
+                print(f"{summary['max_workers']:>7} {summary['concurrency']:>4} {summary['active']:>6} "
+                      f"{summary['queue_wait_p50']:>8.0f}s {summary['queue_wait_p95']:>8.0f}s "
+                      f"{summary['latency_p50'] or 0:>6.0f}s {summary['latency_p95'] or 0:>6.0f}s "
+                      f"{summary['latency_p99'] or 0:>6.0f}s {summary['cold_start_share']:>6.0%} "
+                      f"{summary['gpu_utilization'] or 0:>6.0%} {summary['worker_seconds']:>9.0f}"
+                      + (f"  {'ok' if summary['meets_slo'] else 'MISS'}" if args.slo_p95 else ""))
+                if summary["failed"]:
+                    print(f"        {summary['failed']} failed: {summary.get('errors')}")
+        finally:
+            server.shutdown()
+
+    if args.slo_p95:
+        passing = [summary for summary in results if summary["meets_slo"]]
+        if passing:
+            best = min(passing, key=lambda summary: summary["worker_seconds"])
+            print(f"\nCheapest configuration meeting p95 <= {args.slo_p95:g}s: max_workers={best['max_workers']} "
+                  f"concurrency={best['concurrency']} active={best['active']} ({best['worker_seconds']:.0f} worker-s)")
+        else:
+            print(f"\nNo configuration meets p95 <= {args.slo_p95:g}s")
+    if args.json:
+        args.json.write_text(json.dumps({"arrivals": args.arrivals, "jobs": len(arrivals), "results": results},
+                                        indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Resumable job checkpoints on the network volume.
+
+A job's working directory is local and dies with the worker, so a job cut
+off by preemption or the execution timeout would otherwise start again
+from the download when it is retried. With checkpoints, the outputs of
+each finished unit of work are copied to the volume as the job goes:
+
+    admission        - the plan (no files)
+    ingest           - the downloaded or decoded inputs
+    preprocess       - every segment's processed_video directory
+    clip/<name>      - each generated segment or span clip
+
+A retry of the same job (same idempotency_key, or else the same request)
+restores what is there and only runs what is missing. Copying every
+unit to the volume is not worth it for a job that is quick to rerun, so
+only jobs admission estimates at CHECKPOINT_MIN_GPU_SECONDS or more get
+a checkpoint. Layout:
+
+    <root>/jobs/<key>/manifest.json   finished units and their state
+    <root>/jobs/<key>/files/...       saved files, by path inside the job directory
+    <root>/jobs/<key>/.lock           flock held by the worker running the job
+    <root>/trash/                     discarded checkpoints awaiting deletion
+
+Files are copied before the manifest names them and the manifest is
+replaced atomically, so a unit is either fully saved or not at all. A
+successful job discards its checkpoint; one that fails keeps it for the
+retry. Checkpoints untouched for CHECKPOINT_TTL_HOURS are orphans and
+collect_garbage() removes them (never one whose lock is held).
+"""
+
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from preprocess_cache import link_or_copy
+
+CHECKPOINTS = os.environ.get("CHECKPOINTS", "1") == "1"
+CHECKPOINT_DIR = os.environ.get("CHECKPOINT_DIR", "/runpod-volume/checkpoints")
+CHECKPOINT_TTL = float(os.environ.get("CHECKPOINT_TTL_HOURS", "24")) * 3600
+CHECKPOINT_GC_INTERVAL = float(os.environ.get("CHECKPOINT_GC_INTERVAL", "600"))
+CHECKPOINT_MIN_GPU_SECONDS = float(os.environ.get("CHECKPOINT_MIN_GPU_SECONDS", "300"))
+MANIFEST = "manifest.json"
+
+_gc_lock = threading.Lock()
+_last_gc = 0.0
+
+
+def _copy(src: Path, dst: Path):
+    """Copy a file or directory tree, hard-linking where the filesystem allows."""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if src.is_dir():
+        shutil.copytree(src, dst, copy_function=link_or_copy, dirs_exist_ok=True)
+    else:
+        dst.unlink(missing_ok=True)
+        link_or_copy(src, dst)
+
+
+class Checkpoint:
+    """One job's checkpoint directory; only usable while acquire() holds its lock."""
+
+    def __init__(self, root: Path, key: str):
+        self.root = Path(root)
+        self.key = key
+        self.dir = self.root / "jobs" / key
+        self.files_dir = self.dir / "files"
+        self._lock_file = None
+        self.manifest = {}
+        # Segments generated side by side save their clips from several threads
+        self._save_lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        """Lock the checkpoint and load its manifest; False if another worker holds it."""
+        while True:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            lock_file = open(self.dir / ".lock", "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            # collect_garbage() may have moved the directory away between the open and the lock
+            try:
+                if os.stat(self.dir / ".lock").st_ino == os.fstat(lock_file.fileno()).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            lock_file.close()
+        self._lock_file = lock_file
+        try:
+            self.manifest = json.loads((self.dir / MANIFEST).read_text())
+        except (OSError, ValueError):
+            self.manifest = {"key": self.key, "created": time.time(), "units": {}}
+        return True
+
+    def release(self):
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+
+    @property
+    def units(self) -> dict:
+        return self.manifest["units"]
+
+    def done(self, unit: str) -> bool:
+        return unit in self.units
+
+    def save(self, unit: str, job_dir: Path, paths: list = (), state: dict = None):
+        """Record unit as finished: copy paths (inside job_dir) to the volume, then the manifest."""
+        job_dir = Path(job_dir)
+        files = [str(Path(path).relative_to(job_dir)) for path in paths]
+        for rel in files:
+            _copy(job_dir / rel, self.files_dir / rel)
+        with self._save_lock:
+            self.units[unit] = {"files": files, "state": state or {}, "saved": time.time()}
+            self.manifest["updated"] = time.time()
+            staging = self.dir / f"{MANIFEST}.{uuid.uuid4().hex}"
+            staging.write_text(json.dumps(self.manifest))
+            os.replace(staging, self.dir / MANIFEST)
+
+    def restore(self, unit: str, job_dir: Path):
+        """Copy a finished unit's files back into job_dir and return its state, or None if not finished."""
+        if unit not in self.units:
+            return None
+        for rel in self.units[unit]["files"]:
+            _copy(self.files_dir / rel, Path(job_dir) / rel)
+        return self.units[unit]["state"]
+
+    def discard(self):
+        """Drop the checkpoint: one rename now, the deletion in collect_garbage()."""
+        trash = self.root / "trash"
+        trash.mkdir(parents=True, exist_ok=True)
+        try:
+            os.rename(self.dir, trash / f"{self.key}.{uuid.uuid4().hex}")
+        except OSError as e:
+            print(f"Could not discard checkpoint {self.key[:12]}: {e}")
+        self.release()
+
+
+def worth_checkpointing(gpu_seconds: float, min_gpu_seconds: float = CHECKPOINT_MIN_GPU_SECONDS) -> bool:
+    """Whether a job of this estimated GPU time should be checkpointed."""
+    return CHECKPOINTS and gpu_seconds >= min_gpu_seconds
+
+
+def open_checkpoint(key: str, root: Path = None, create: bool = True):
+    """
+    Return the locked Checkpoint for key, or None when checkpoints are
+    disabled, the volume is unavailable or another worker is running the
+    same job (it then runs without one). With create=False only an
+    existing checkpoint, left by an earlier attempt, is opened.
+    """
+    if not CHECKPOINTS:
+        return None
+    checkpoint = Checkpoint(Path(root or CHECKPOINT_DIR), key)
+    if not create and not (checkpoint.dir / MANIFEST).exists():
+        return None
+    try:
+        if checkpoint.acquire():
+            return checkpoint
+        print(f"Checkpoint {key[:12]} is held by another worker; running without it")
+    except OSError as e:
+        print(f"Checkpoints unavailable: {e}")
+    return None
+
+
+def collect_garbage(root: Path = None, ttl: float = CHECKPOINT_TTL) -> int:
+    """Delete discarded checkpoints and unlocked ones not updated within ttl; returns how many went."""
+    root = Path(root or CHECKPOINT_DIR)
+    trash = root / "trash"
+    removed = 0
+    if trash.is_dir():
+        for entry in trash.iterdir():
+            shutil.rmtree(entry, ignore_errors=True)
+            removed += 1
+
+    jobs = root / "jobs"
+    if not jobs.is_dir():
+        return removed
+    for job_dir in jobs.iterdir():
+        try:
+            updated = json.loads((job_dir / MANIFEST).read_text()).get("updated")
+        except (OSError, ValueError):
+            updated = None
+        try:
+            if time.time() - (updated or job_dir.stat().st_mtime) <= ttl:
+                continue
+            # Unpublish under the job's own lock so a retry can't pick it up half-deleted
+            with open(job_dir / ".lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                orphan = trash / f"{job_dir.name}.{uuid.uuid4().hex}"
+                trash.mkdir(parents=True, exist_ok=True)
+                os.rename(job_dir, orphan)
+        except OSError:
+            continue  # Gone already, or a worker is running it
+        shutil.rmtree(orphan, ignore_errors=True)
+        removed += 1
+        print(f"Removed orphaned checkpoint {job_dir.name[:12]}")
+    return removed
+
+
+def collect_garbage_async(interval: float = CHECKPOINT_GC_INTERVAL):
+    """Run collect_garbage() on a background thread, at most once per interval."""
+    global _last_gc
+    if not CHECKPOINTS:
+        return
+    with _gc_lock:
+        if time.time() - _last_gc < interval:
+            return
+        _last_gc = time.time()
+
+    def run():
+        try:
+            collect_garbage()
+        except OSError as e:
+            print(f"Checkpoint garbage collection failed: {e}")
+
+    threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Async client for the face swap endpoint.
+
+Submits many jobs at once under an in-flight limit and follows each one on
+/stream (or /status with --poll):
+
+    polling   starts every POLL_MIN seconds, backs off x1.5 while the job is
+              quiet, drops back when events arrive, follows the job's ETA
+              and never waits longer than POLL_MAX
+    retries   429/5xx responses and connection errors are retried with
+              exponential backoff and jitter; jobs that end FAILED or
+              TIMED_OUT are resubmitted up to --job-retries times
+    outputs   output_base64 is decoded to disk in chunks and output_url is
+              downloaded in chunks, so no decoded video is held in memory
+
+    python client.py --video-url URL --photo-url URL                # one job
+    python client.py jobs.jsonl --concurrency 64 --out outputs/     # a queue of jobs
+
+Each line of a jobs file is a job input ({"video_url": ..., "photo_url": ...})
+with an optional "output" file name. Per-job results go to
+<out>/results.jsonl, followed by a latency summary (p50/p95/p99, jobs/s).
+Point RUNPOD_API_BASE at benchmarks/fake_endpoint.py to try it locally.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+import aiohttp
+
+from b64stream import decode_to_file
+
+RUNPOD_API_BASE = os.environ.get("RUNPOD_API_BASE", "https://api.runpod.ai/v2")
+POLL_MIN = 1.0
+POLL_MAX = 15.0
+TRANSIENT_STATUSES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_JOB_STATUSES = {"FAILED", "TIMED_OUT"}
+DOWNLOAD_CHUNK = 1024 * 1024
+
+
+class TransientError(Exception):
+    """A response worth retrying (rate limit, gateway error)."""
+
+
+class JobFailed(Exception):
+    """The endpoint reported the job as failed."""
+
+    def __init__(self, status: str, error):
+        super().__init__(f"{status}: {error}")
+        self.status = status
+        self.error = error
+
+
+class JobResult:
+    """Outcome and timings of one job."""
+
+    def __init__(self, name: str, job_input: dict):
+        self.name = name
+        self.job_input = job_input
+        self.job_id = None
+        self.status = None
+        self.error = None
+        self.output_paths = []
+        self.attempts = 0
+        self.started_at = time.time()
+        self.first_event_at = None
+        self.finished_at = None
+
+    @property
+    def latency(self) -> float:
+        return (self.finished_at or time.time()) - self.started_at
+
+    def as_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "job_id": self.job_id,
+            "status": self.status,
+            "error": self.error,
+            "outputs": [str(path) for path in self.output_paths],
+            "attempts": self.attempts,
+            "latency_seconds": round(self.latency, 3),
+            "first_event_seconds": round(self.first_event_at - self.started_at, 3) if self.first_event_at else None
+        }
+
+
+def final_output(output):
+    """The job result from an output: the last item of an aggregated stream, or the output itself."""
+    if isinstance(output, list):
+        output = output[-1] if output else None
+    if not isinstance(output, dict):
+        raise JobFailed("COMPLETED", f"unexpected output: {output!r}")
+    if output.get("error"):
+        raise JobFailed("FAILED", output["error"])
+    return output
+
+
+def format_progress(event: dict) -> str:
+    """One line for a progress event, e.g. 'generate step 9/20 (run 1/3), ETA 37s'."""
+    line = event.get("stage", "")
+    if "steps" in event:
+        line += f" step {event['step']}/{event['steps']}"
+    if "runs" in event:
+        line += f" (run {event['run']}/{event['runs']})"
+    if "eta_seconds" in event:
+        line += f", ETA {event['eta_seconds']:.0f}s"
+    return line
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(results: list, wall_seconds: float) -> dict:
+    """Counts, throughput and latency percentiles over finished jobs."""
+    latencies = [r.latency for r in results if r.status == "success"]
+    first_events = [r.first_event_at - r.started_at for r in results if r.first_event_at]
+    summary = {
+        "jobs": len(results),
+        "succeeded": len(latencies),
+        "failed": len(results) - len(latencies),
+        "resubmitted": sum(r.attempts - 1 for r in results),
+        "wall_seconds": round(wall_seconds, 3),
+        "jobs_per_second": round(len(results) / wall_seconds, 3) if wall_seconds else None
+    }
+    if latencies:
+        summary.update({
+            "latency_p50": round(percentile(latencies, 0.50), 3),
+            "latency_p95": round(percentile(latencies, 0.95), 3),
+            "latency_p99": round(percentile(latencies, 0.99), 3),
+            "latency_max": round(max(latencies), 3)
+        })
+    if first_events:
+        summary["first_event_p50"] = round(percentile(first_events, 0.50), 3)
+    return summary
+
+
+class FaceSwapClient:
+    """
+    Submit and follow jobs on one endpoint. Use as an async context manager;
+    run() and run_many() may be called from many tasks at once.
+    """
+
+    def __init__(self, endpoint_id: str, api_key: str = None, base_url: str = RUNPOD_API_BASE,
+                 concurrency: int = 16, use_stream: bool = True, poll_min: float = POLL_MIN,
+                 poll_max: float = POLL_MAX, retries: int = 5, job_retries: int = 0):
+        self.endpoint_url = f"{base_url.rstrip('/')}/{endpoint_id}"
+        self.api_key = api_key
+        self.concurrency = concurrency
+        self.use_stream = use_stream
+        self.poll_min = poll_min
+        self.poll_max = poll_max
+        self.retries = retries
+        self.job_retries = job_retries
+        self.http_retries = 0
+        self.session = None
+        self._limit = asyncio.Semaphore(concurrency)
+
+    async def __aenter__(self):
+        # Polls are short; keep a connection per in-flight job plus some for downloads
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency + 8),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=300)
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    def _headers(self) -> dict:
+        # Only on API calls: output URLs are presigned and must not see the key
+        return {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+
+    async def _retrying(self, attempt_fn):
+        for attempt in range(self.retries + 1):
+            try:
+                return await attempt_fn()
+            except (TransientError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError,
+                    asyncio.TimeoutError) as e:
+                if attempt == self.retries:
+                    raise
+                self.http_retries += 1
+                delay = min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.5)
+                print(f"  retrying in {delay:.1f}s after {type(e).__name__}: {e}", file=sys.stderr)
+                await asyncio.sleep(delay)
+
+    async def _api(self, method: str, path: str, **kwargs) -> dict:
+        async def attempt():
+            async with self.session.request(method, f"{self.endpoint_url}/{path}", headers=self._headers(),
+                                            **kwargs) as response:
+                if response.status in TRANSIENT_STATUSES:
+                    raise TransientError(f"HTTP {response.status} from {path.split('/')[0]}")
+                response.raise_for_status()
+                return await response.json()
+        return await self._retrying(attempt)
+
+    async def submit(self, job_input: dict) -> str:
+        """Queue a job and return its id."""
+        return (await self._api("POST", "run", json={"input": job_input}))["id"]
+
+    async def wait(self, job_id: str, on_event=None) -> dict:
+        """Follow a job until it finishes and return its result (raises JobFailed)."""
+        interval = self.poll_min
+        while True:
+            if self.use_stream:
+                data = await self._api("GET", f"stream/{job_id}")
+                items = data.get("stream") or []
+            else:
+                data = await self._api("GET", f"status/{job_id}")
+                items = []
+
+            eta = None
+            for item in items:
+                output = item.get("output")
+                if isinstance(output, dict) and output.get("status") == "in_progress":
+                    eta = output.get("eta_seconds", eta)
+                    if on_event:
+                        on_event(output)
+                elif output is not None:
+                    return final_output(output)
+
+            status = data.get("status")
+            if status == "COMPLETED":
+                if self.use_stream:
+                    # Non-streaming handlers only report their output on /status
+                    data = await self._api("GET", f"status/{job_id}")
+                return final_output(data.get("output"))
+            if status in ("FAILED", "CANCELLED", "TIMED_OUT"):
+                raise JobFailed(status, data.get("error"))
+
+            # Poll quickly while the job reports progress, back off while it is quiet
+            interval = self.poll_min if items else min(self.poll_max, interval * 1.5)
+            if eta:
+                interval = min(self.poll_max, max(interval, eta / 4))
+            await asyncio.sleep(interval * random.uniform(0.9, 1.1))
+
+    async def save(self, result: dict, dest: Path) -> list:
+        """Write a result's output(s) to dest (dest_0, dest_1, ... for several photos)."""
+        dest = Path(dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        outputs = result["outputs"] if "outputs" in result else [result]
+        paths = []
+        for i, output in enumerate(outputs):
+            path = dest if len(outputs) == 1 else dest.with_name(f"{dest.stem}_{i}{dest.suffix}")
+            partial = path.with_name(f".{path.name}.partial")
+            if "output_base64" in output:
+                await asyncio.to_thread(decode_to_file, output["output_base64"], partial)
+            elif "output_url" in output:
+                await self._retrying(lambda url=output["output_url"], to=partial: self._download(url, to))
+            else:
+                raise JobFailed("COMPLETED", f"no output in result: {sorted(output)}")
+            os.replace(partial, path)
+            paths.append(path)
+        return paths
+
+    async def _download(self, url: str, dest: Path):
+        async with self.session.get(url) as response:
+            if response.status in TRANSIENT_STATUSES:
+                raise TransientError(f"HTTP {response.status} downloading output")
+            response.raise_for_status()
+            with open(dest, "wb") as f:
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK):
+                    f.write(chunk)
+
+    async def run(self, job_input: dict, dest: Path, name: str = None, on_event=None) -> JobResult:
+        """Submit one job, wait for it and save its output; never raises for a failed job."""
+        result = JobResult(name or Path(dest).name, job_input)
+
+        def event(output):
+            if result.first_event_at is None:
+                result.first_event_at = time.time()
+            if on_event:
+                on_event(result, output)
+
+        async with self._limit:
+            result.started_at = time.time()
+            for attempt in range(self.job_retries + 1):
+                result.attempts += 1
+                try:
+                    result.job_id = await self.submit(job_input)
+                    output = await self.wait(result.job_id, event)
+                    result.output_paths = await self.save(output, dest)
+                    result.status, result.error = "success", None
+                    break
+                except JobFailed as e:
+                    result.status, result.error = e.status.lower(), e.error
+                    if e.status not in RETRYABLE_JOB_STATUSES:
+                        break
+                except Exception as e:
+                    result.status, result.error = "error", f"{type(e).__name__}: {e}"
+                    break
+            result.finished_at = time.time()
+        return result
+
+    async def run_many(self, jobs: list, on_result=None, on_event=None) -> list:
+        """Run (job_input, dest, name) tuples with at most `concurrency` in flight; results in job order."""
+        async def one(job):
+            result = await self.run(*job, on_event=on_event)
+            if on_result:
+                on_result(result)
+            return result
+        return await asyncio.gather(*[one(job) for job in jobs])
+
+
+def load_jobs(path: Path, out_dir: Path) -> list:
+    """Read a JSONL jobs file into (job_input, dest, name) tuples."""
+    jobs = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            job_input = json.loads(line)
+            name = job_input.pop("output", None) or f"job_{number:05d}.mp4"
+            jobs.append((job_input, out_dir / name, name))
+    return jobs
+
+
+async def run_cli(args) -> int:
+    out_dir = Path(args.out)
+    if args.jobs:
+        jobs = load_jobs(Path(args.jobs), out_dir)
+    else:
+        job_input = {"video_url": args.video_url, "photo_url": args.photo_url, "resolution": args.resolution}
+        jobs = [(job_input, out_dir / "faceswap_result.mp4", "faceswap_result.mp4")]
+    out_dir.mkdir(parents=True, exist_ok=True)
+    results_file = open(out_dir / "results.jsonl", "a")
+
+    def on_result(result):
+        results_file.write(json.dumps(result.as_dict()) + "\n")
+        results_file.flush()
+        detail = ", ".join(str(p) for p in result.output_paths) if result.status == "success" else result.error
+        print(f"[{result.status}] {result.name} in {result.latency:.1f}s: {detail}")
+
+    def on_event(result, event):
+        if len(jobs) == 1 and not args.quiet:
+            print(f"  {format_progress(event)}")
+
+    start = time.time()
+    try:
+        async with FaceSwapClient(args.endpoint, args.api_key, args.base_url, concurrency=args.concurrency,
+                                  use_stream=not args.poll, job_retries=args.job_retries) as client:
+            results = await client.run_many(jobs, on_result=on_result, on_event=on_event)
+            http_retries = client.http_retries
+    finally:
+        results_file.close()
+
+    summary = summarize(results, time.time() - start)
+    summary["http_retries"] = http_retries
+    print(json.dumps(summary, indent=2))
+    return 0 if summary["failed"] == 0 else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run face swap jobs against a RunPod endpoint")
+    parser.add_argument("jobs", nargs="?", help="JSONL file of job inputs")
+    parser.add_argument("--video-url", default=os.environ.get("VIDEO_URL"))
+    parser.add_argument("--photo-url", default=os.environ.get("PHOTO_URL"))
+    parser.add_argument("--resolution", type=int, nargs=2, default=[1280, 720])
+    parser.add_argument("--endpoint", default=os.environ.get("RUNPOD_ENDPOINT_ID"))
+    parser.add_argument("--api-key", default=os.environ.get("RUNPOD_API_KEY"))
+    parser.add_argument("--base-url", default=RUNPOD_API_BASE)
+    parser.add_argument("--concurrency", type=int, default=16, help="Jobs in flight at once")
+    parser.add_argument("--job-retries", type=int, default=0, help="Resubmit jobs that end FAILED or TIMED_OUT")
+    parser.add_argument("--poll", action="store_true", help="Poll /status instead of following /stream")
+    parser.add_argument("--out", default="outputs", help="Directory for outputs and results.jsonl")
+    parser.add_argument("--quiet", action="store_true", help="Don't print progress events")
+    args = parser.parse_args()
+
+    if not args.endpoint:
+        parser.error("set RUNPOD_ENDPOINT_ID or pass --endpoint")
+    if not args.jobs and not (args.video_url and args.photo_url):
+        parser.error("give a jobs file, or --video-url and --photo-url (or VIDEO_URL/PHOTO_URL)")
+    sys.exit(asyncio.run(run_cli(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""
+Generation engine for Wan2.2-Animate-14B.
+
+Keeps the Wan pipeline resident between jobs so a warm worker only pays for
+sampling. Backends are pluggable:
+
+    inprocess   - load wan.WanAnimate once and call it directly (default)
+    subprocess  - spawn generate.py per job (original behaviour, fallback)
+    stub        - copy an input clip to the output; for CPU-only test boxes
+
+Select one with the GENERATION_BACKEND environment variable. Each
+generation takes the job's memory selection (memory_policy.py): which of
+offload_model, t5_cpu and convert_model_dtype to use.
+"""
+
+import logging
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import progress
+from memory_policy import generate_args
+from metrics import run_process
+from scheduler import gpu_env, rendezvous_port
+
+GENERATION_BACKEND = os.environ.get("GENERATION_BACKEND", "inprocess")
+TASK = "animate-14B"
+
+# Generation settings shared by every backend (also part of the result cache key)
+GENERATION_PARAMS = {
+    "task": TASK,
+    "refert_num": 1,
+    "replace_flag": True,
+    "use_relighting_lora": True
+}
+
+
+def build_generate_cmd(model_dir: Path, processed_dir: Path, num_gpus: int = 1, save_file: Path = None,
+                       master_port: int = None, params: dict = GENERATION_PARAMS, memory: dict = None) -> list:
+    """Build the generate.py command line used by the subprocess backend."""
+    args = [
+        "generate.py",
+        "--task", params["task"],
+        "--ckpt_dir", str(model_dir),
+        "--src_root_path", str(processed_dir),
+        "--refert_num", str(params["refert_num"])
+    ]
+    if params["replace_flag"]:
+        args.append("--replace_flag")
+    if params["use_relighting_lora"]:
+        args.append("--use_relighting_lora")
+    if save_file is not None:
+        args += ["--save_file", str(save_file)]
+    args += generate_args(memory, num_gpus)
+    if num_gpus > 1:
+        # Multi-GPU inference
+        return [
+            "python", "-m", "torch.distributed.run",
+            "--nnodes", "1",
+            "--nproc_per_node", str(num_gpus),
+            *(["--master_port", str(master_port)] if master_port else []),
+            *args,
+            "--dit_fsdp",
+            "--t5_fsdp",
+            "--ulysses_size", str(num_gpus)
+        ]
+    return ["python", *args]
+
+
+class GenerationBackend:
+    """Base class for generation backends."""
+
+    name = "base"
+    # Whether jobs can run side by side on different GPUs (see scheduler.py)
+    supports_slots = False
+
+    def __init__(self, model_dir: Path, wan_dir: Path, memory: dict = None):
+        self.model_dir = Path(model_dir)
+        self.wan_dir = Path(wan_dir)
+        # Memory selection used when a job brings none (and for anything fixed at load)
+        self.memory = memory
+        self.loaded = False
+
+    def load(self):
+        """Load whatever the backend needs before serving jobs."""
+        self.loaded = True
+
+    def generate(self, processed_dir: Path, output_path: Path, gpus: list = None, memory: dict = None) -> Path:
+        """
+        Generate a video from a preprocessed directory into output_path,
+        on the given GPU indices if the backend supports slots, with the
+        job's memory selection.
+        """
+        raise NotImplementedError
+
+
+class SubprocessBackend(GenerationBackend):
+    """Spawn generate.py for every job (pays the full model load each time)."""
+
+    name = "subprocess"
+    supports_slots = True
+
+    def generate(self, processed_dir: Path, output_path: Path, gpus: list = None, memory: dict = None) -> Path:
+        gpus = gpus or [0]
+        # Each job writes straight to its own output path, so concurrent jobs never collide
+        cmd = build_generate_cmd(self.model_dir, processed_dir, len(gpus), save_file=output_path,
+                                 master_port=rendezvous_port(gpus), memory=memory or self.memory)
+
+        result = run_process(cmd, cwd=self.wan_dir, env=gpu_env(gpus), capture_output=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Generation failed: {result.stderr}")
+        if not Path(output_path).exists():
+            raise RuntimeError("No output file generated")
+        return output_path
+
+
+class InProcessBackend(GenerationBackend):
+    """
+    Hold a wan.WanAnimate pipeline in memory and reuse it for every job.
+
+    T5 placement and the weight dtype are fixed when the pipeline loads (from
+    the backend's memory selection); only offload_model follows each job.
+    There is no child output to parse, so the sampler's tqdm bar and its
+    module logger's records are fed to the job's progress directly.
+    """
+
+    name = "inprocess"
+
+    def __init__(self, model_dir: Path, wan_dir: Path, memory: dict = None):
+        super().__init__(model_dir, wan_dir, memory)
+        self.pipeline = None
+        self.cfg = None
+        self._save_video = None
+        # The pipeline owns the GPU; only one job may sample at a time.
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self.loaded:
+            return
+        if str(self.wan_dir) not in sys.path:
+            sys.path.insert(0, str(self.wan_dir))
+
+        import wan
+        from wan.configs import WAN_CONFIGS
+        from wan.utils.utils import save_video
+
+        self.cfg = WAN_CONFIGS[TASK]
+        self._save_video = save_video
+        memory = self.memory or {}
+        self.pipeline = wan.WanAnimate(
+            config=self.cfg,
+            checkpoint_dir=str(self.model_dir),
+            device_id=0,
+            rank=0,
+            t5_fsdp=False,
+            dit_fsdp=False,
+            use_sp=False,
+            t5_cpu=memory.get("t5_cpu", False),
+            convert_model_dtype=memory.get("convert_model_dtype", False),
+            use_relighting_lora=GENERATION_PARAMS["use_relighting_lora"]
+        )
+        self._track_progress()
+        self.loaded = True
+
+    def _track_progress(self):
+        """Feed the sampling loop's steps to whichever job is generating."""
+        sampler = sys.modules[type(self.pipeline).__module__]
+        if hasattr(sampler, "tqdm"):
+            sampler.tqdm = progress.tracked_tqdm(sampler.tqdm, "wan")
+        else:
+            print(f"No tqdm in {sampler.__name__}; sampling steps will not be reported")
+
+    @contextmanager
+    def _feed_logs(self):
+        """
+        Feed the sampler module's INFO logs to the generating job for the
+        duration of one run. Only that logger is touched, and its level is
+        restored afterwards; the rest of the process keeps its logging setup.
+        """
+        logger = logging.getLogger(type(self.pipeline).__module__)
+        handler = progress.LogFeed("wan")
+        level = logger.level
+        logger.addHandler(handler)
+        if logger.getEffectiveLevel() > logging.INFO:
+            logger.setLevel(logging.INFO)
+        try:
+            yield
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(level)
+
+    def generate(self, processed_dir: Path, output_path: Path, gpus: list = None, memory: dict = None) -> Path:
+        self.load()
+        cfg = self.cfg
+        memory = memory or self.memory or {}
+        loaded = self.memory or {}
+        if any(memory.get(name) and not loaded.get(name) for name in ("t5_cpu", "convert_model_dtype")):
+            print(f"Pipeline was loaded in {loaded.get('mode', 'max_speed')} memory mode; "
+                  f"only offload_model follows this job's {memory['mode']}")
+        with self._lock, self._feed_logs():
+            # Same defaults generate.py resolves for animate-14B
+            video = self.pipeline.generate(
+                src_root_path=str(processed_dir),
+                replace_flag=GENERATION_PARAMS["replace_flag"],
+                refert_num=GENERATION_PARAMS["refert_num"],
+                clip_len=cfg.frame_num,
+                shift=cfg.sample_shift,
+                sample_solver="unipc",
+                sampling_steps=cfg.sample_steps,
+                guide_scale=cfg.sample_guide_scale,
+                seed=random.randint(0, sys.maxsize),
+                offload_model=memory.get("offload_model", False)
+            )
+            self._save_video(
+                tensor=video[None],
+                save_file=str(output_path),
+                fps=cfg.sample_fps,
+                nrow=1,
+                normalize=True,
+                value_range=(-1, 1)
+            )
+            del video
+        return output_path
+
+
+class StubBackend(GenerationBackend):
+    """Stand-in for the model: sleeps, then copies an input clip to the output."""
+
+    name = "stub"
+    supports_slots = True
+
+    def load(self):
+        time.sleep(float(os.environ.get("STUB_LOAD_SECONDS", "0")))
+        self.loaded = True
+
+    def generate(self, processed_dir: Path, output_path: Path, gpus: list = None, memory: dict = None) -> Path:
+        time.sleep(float(os.environ.get("STUB_GENERATION_SECONDS", "0")))
+        clips = sorted(Path(processed_dir).glob("*.mp4"))
+        if clips:
+            shutil.copy(clips[0], output_path)
+        else:
+            Path(output_path).write_bytes(b"\x00" * 1024)
+        return output_path
+
+
+BACKENDS = {
+    InProcessBackend.name: InProcessBackend,
+    SubprocessBackend.name: SubprocessBackend,
+    StubBackend.name: StubBackend,
+}
+
+
+def register_backend(name: str, backend_cls):
+    """Register a custom backend class under name."""
+    BACKENDS[name] = backend_cls
+
+
+def create_backend(name: str, model_dir: Path, wan_dir: Path, memory: dict = None) -> GenerationBackend:
+    """Instantiate a backend by name."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown generation backend '{name}'. Choose from: {', '.join(BACKENDS)}")
+    return BACKENDS[name](model_dir, wan_dir, memory)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def loaded_engine():
+    """The process-wide generation backend if get_engine() has loaded it, else None."""
+    return _engine
+
+
+def get_engine(model_dir: Path, wan_dir: Path, backend: str = None, memory: dict = None) -> GenerationBackend:
+    """
+    Return the process-wide generation backend, loading it on first use
+    with memory as its load-time memory selection.
+
+    If the in-process backend cannot be loaded (missing CUDA, import error)
+    the worker falls back to the subprocess backend rather than failing jobs.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            return _engine
+
+        name = backend or GENERATION_BACKEND
+        engine = create_backend(name, model_dir, wan_dir, memory)
+        start = time.time()
+        try:
+            engine.load()
+        except Exception as e:
+            if name != InProcessBackend.name:
+                raise
+            print(f"In-process generation unavailable ({e}); falling back to subprocess backend.")
+            engine = create_backend(SubprocessBackend.name, model_dir, wan_dir, memory)
+            engine.load()
+        print(f"Generation backend '{engine.name}' ready in {time.time() - start:.1f}s")
+
+        _engine = engine
+        return _engine
@@ -0,0 +1,313 @@
+"""
+Face-region generation.
+
+A face swap only changes the person, yet generation normally runs over the
+whole frame at the job's resolution. With "region": "face" a job instead:
+
+    track      - finds the face in every frame: OpenCV's Haar detector on
+                 downscaled frames when cv2 is installed, otherwise the
+                 character mask (src_mask.mp4) of a low-resolution
+                 preprocessing pass
+    stabilize  - fills frames without a detection, smooths the centre over
+                 FACE_TRACK_SMOOTHING frames and fixes one crop size for the
+                 clip (the largest box plus FACE_REGION_MARGIN on each side)
+    crop       - cuts that moving window out of the normalized video, which
+                 is then preprocessed and generated at up to
+                 FACE_REGION_AREA pixels instead of the full resolution
+    composite  - scales the generated crop back up and blends it into the
+                 full frames under a feathered edge
+
+Frames go through ffmpeg as raw RGB and are cropped and blended with NumPy,
+one frame in memory at a time. A clip with no face, or whose crop would
+cover more than FACE_REGION_MAX_SHARE of the frame, is generated full frame.
+"""
+
+import math
+import os
+import subprocess
+from pathlib import Path
+
+import numpy as np
+
+from admission import probe_media
+
+FACE_TRACKER = os.environ.get("FACE_TRACKER", "auto")
+FACE_REGION_AREA = int(os.environ.get("FACE_REGION_AREA", str(512 * 512)))
+FACE_REGION_MARGIN = float(os.environ.get("FACE_REGION_MARGIN", "0.4"))
+FACE_REGION_MAX_SHARE = float(os.environ.get("FACE_REGION_MAX_SHARE", "0.5"))
+FACE_TRACK_SMOOTHING = int(os.environ.get("FACE_TRACK_SMOOTHING", "15"))
+FACE_TRACK_STRIDE = int(os.environ.get("FACE_TRACK_STRIDE", "2"))
+FACE_FEATHER = float(os.environ.get("FACE_FEATHER", "0.1"))
+
+# Resolution of the preprocessing pass used for mask tracking
+TRACK_RESOLUTION = (640, 360)
+DETECT_WIDTH = 480
+
+# Settings that change a face-region output (part of the result cache key)
+FACE_REGION_PARAMS = {
+    "area": FACE_REGION_AREA,
+    "margin": FACE_REGION_MARGIN,
+    "max_share": FACE_REGION_MAX_SHARE,
+    "smoothing": FACE_TRACK_SMOOTHING,
+    "feather": FACE_FEATHER
+}
+
+
+def read_frames(path: Path, width: int, height: int, fps: float = None):
+    """Yield a video's frames as writable (height, width, 3) uint8 arrays, scaled (and resampled to fps)."""
+    filters = [f"scale={width}:{height}"] + ([f"fps={fps}"] if fps else [])
+    process = subprocess.Popen([
+        "ffmpeg", "-v", "error", "-i", str(path),
+        "-vf", ",".join(filters),
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-"
+    ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    frame_bytes = width * height * 3
+    try:
+        while True:
+            buffer = bytearray(frame_bytes)
+            if process.stdout.readinto(buffer) < frame_bytes:
+                break
+            yield np.frombuffer(buffer, np.uint8).reshape(height, width, 3)
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
+
+class FrameWriter:
+    """Encode (height, width, 3) uint8 frames to an H.264 file through ffmpeg."""
+
+    def __init__(self, path: Path, width: int, height: int, fps: float):
+        self.path = Path(path)
+        self.process = subprocess.Popen([
+            "ffmpeg", "-y", "-v", "error",
+            "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", f"{fps:g}",
+            "-i", "-",
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", "16", "-pix_fmt", "yuv420p",
+            str(path)
+        ], stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def write(self, frame: np.ndarray):
+        self.process.stdin.write(np.ascontiguousarray(frame).tobytes())
+
+    def close(self):
+        self.process.stdin.close()
+        stderr = self.process.stderr.read().decode("utf-8", "replace")
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed writing {self.path.name}: {stderr}")
+
+    def abort(self):
+        self.process.kill()
+        self.process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def detect_boxes(video_path: Path, media: dict, stride: int = FACE_TRACK_STRIDE) -> np.ndarray:
+    """Largest face per frame as (frames, 4) x, y, w, h; NaN where none was found or the frame was skipped."""
+    import cv2
+
+    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+    scale = max(1.0, media["width"] / DETECT_WIDTH)
+    width = int(media["width"] / scale) // 2 * 2
+    height = int(media["height"] / scale) // 2 * 2
+    rows = []
+    for i, frame in enumerate(read_frames(video_path, width, height)):
+        faces = ()
+        if i % stride == 0:
+            gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+            faces = cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(24, 24))
+        if len(faces):
+            rows.append(max(faces, key=lambda box: box[2] * box[3]))
+        else:
+            rows.append([np.nan] * 4)
+    boxes = np.array(rows, dtype=np.float64).reshape(-1, 4)
+    return boxes * ([media["width"] / width, media["height"] / height] * 2)
+
+
+def mask_boxes(mask_path: Path, media: dict, threshold: int = 128) -> np.ndarray:
+    """Bounding box of a mask video's foreground per frame of the source (in source pixels), NaN where empty."""
+    mask = probe_media(mask_path)
+    rows = []
+    # Resample to the source's frame rate so row i lines up with source frame i
+    for frame in read_frames(mask_path, mask["width"], mask["height"], fps=media["fps"]):
+        on = frame[..., 0] >= threshold
+        ys = np.flatnonzero(on.any(axis=1))
+        xs = np.flatnonzero(on.any(axis=0))
+        if len(xs):
+            rows.append([xs[0], ys[0], xs[-1] - xs[0] + 1, ys[-1] - ys[0] + 1])
+        else:
+            rows.append([np.nan] * 4)
+    boxes = np.array(rows, dtype=np.float64).reshape(-1, 4)
+    return boxes * ([media["width"] / mask["width"], media["height"] / mask["height"]] * 2)
+
+
+def _smooth(values: np.ndarray, window: int) -> np.ndarray:
+    """Centered moving average, holding the ends."""
+    window = min(window, len(values))
+    if window <= 1:
+        return values
+    padded = np.pad(values, (window // 2, window - 1 - window // 2), mode="edge")
+    return np.convolve(padded, np.ones(window) / window, mode="valid")
+
+
+class CropTrack:
+    """A fixed-size crop window that moves from frame to frame."""
+
+    def __init__(self, width: int, height: int, x: np.ndarray, y: np.ndarray):
+        self.width = width
+        self.height = height
+        self.x = x
+        self.y = y
+
+    def position(self, frame: int) -> tuple:
+        frame = min(frame, len(self.x) - 1)
+        return int(self.x[frame]), int(self.y[frame])
+
+
+def stabilize(boxes: np.ndarray, frame_width: int, frame_height: int, margin: float = FACE_REGION_MARGIN,
+              smoothing: int = FACE_TRACK_SMOOTHING):
+    """Turn noisy per-frame boxes into a CropTrack, or None if no frame has a box."""
+    found = ~np.isnan(boxes[:, 0])
+    if not found.any():
+        return None
+    frames = np.arange(len(boxes))
+    filled = np.column_stack([np.interp(frames, frames[found], boxes[found, c]) for c in range(4)])
+    center_x = _smooth(filled[:, 0] + filled[:, 2] / 2, smoothing)
+    center_y = _smooth(filled[:, 1] + filled[:, 3] / 2, smoothing)
+
+    # One size for the whole clip: generation needs a constant frame size
+    width = min(frame_width // 2 * 2, math.ceil(_smooth(filled[:, 2], smoothing).max() * (1 + 2 * margin) / 2) * 2)
+    height = min(frame_height // 2 * 2, math.ceil(_smooth(filled[:, 3], smoothing).max() * (1 + 2 * margin) / 2) * 2)
+    x = np.clip(np.round(center_x - width / 2), 0, frame_width - width).astype(int)
+    y = np.clip(np.round(center_y - height / 2), 0, frame_height - height).astype(int)
+    return CropTrack(width, height, x, y)
+
+
+def region_resolution(track: CropTrack, area: int = FACE_REGION_AREA) -> tuple:
+    """Generation resolution for a crop: its own size, scaled down to fit area, in multiples of 16."""
+    factor = min(1.0, math.sqrt(area / (track.width * track.height)))
+    return max(16, int(track.width * factor) // 16 * 16), max(16, int(track.height * factor) // 16 * 16)
+
+
+def crop_video(video_path: Path, track: CropTrack, output_path: Path, media: dict) -> Path:
+    """Cut the track's window out of every frame of video_path."""
+    with FrameWriter(output_path, track.width, track.height, media["fps"]) as writer:
+        for i, frame in enumerate(read_frames(video_path, media["width"], media["height"])):
+            x, y = track.position(i)
+            writer.write(frame[y:y + track.height, x:x + track.width])
+    return Path(output_path)
+
+
+def feather_mask(width: int, height: int, feather: float = FACE_FEATHER) -> np.ndarray:
+    """(height, width, 1) blend weights: 1 inside, easing to 0 over the outer `feather` of the shorter side."""
+    ramp = max(1.0, feather * min(width, height))
+    ramp_x = np.clip(np.minimum(np.arange(width) + 0.5, width - np.arange(width) - 0.5) / ramp, 0, 1)
+    ramp_y = np.clip(np.minimum(np.arange(height) + 0.5, height - np.arange(height) - 0.5) / ramp, 0, 1)
+    alpha = np.minimum.outer(ramp_y, ramp_x)
+    # Smoothstep so the seam has no visible edge in its gradient
+    return (alpha * alpha * (3 - 2 * alpha))[..., None].astype(np.float32)
+
+
+def composite(base_video: Path, generated_video: Path, track: CropTrack, output_path: Path, media: dict,
+              feather: float = FACE_FEATHER) -> Path:
+    """
+    Blend the generated crop back into the full frames of base_video. Frames
+    past the end of the generated clip are passed through unchanged.
+    """
+    alpha = feather_mask(track.width, track.height, feather)
+    generated = read_frames(generated_video, track.width, track.height, fps=media["fps"])
+    with FrameWriter(output_path, media["width"], media["height"], media["fps"]) as writer:
+        for i, frame in enumerate(read_frames(base_video, media["width"], media["height"])):
+            crop = next(generated, None)
+            if crop is not None:
+                x, y = track.position(i)
+                region = frame[y:y + track.height, x:x + track.width]
+                blended = region + alpha * (crop.astype(np.float32) - region)
+                region[:] = np.clip(blended + 0.5, 0, 255).astype(np.uint8)
+            writer.write(frame)
+    generated.close()
+    return Path(output_path)
+
+
+class FaceRegion:
+    """A job's face crop, or the reason it is generated full frame instead."""
+
+    def __init__(self, base_video: Path, media: dict, track: CropTrack = None, crop_path: Path = None,
+                 tracker: str = None, reason: str = None):
+        self.base_video = Path(base_video)
+        self.media = media
+        self.track = track
+        self.crop_path = crop_path
+        self.tracker = tracker
+        self.reason = reason
+
+    @property
+    def active(self) -> bool:
+        return self.track is not None
+
+    @property
+    def resolution(self) -> tuple:
+        return region_resolution(self.track)
+
+    def composite(self, generated_video: Path, output_path: Path) -> Path:
+        return composite(self.base_video, generated_video, self.track, output_path, self.media)
+
+    def summary(self) -> dict:
+        if not self.active:
+            return {"mode": "full", "reason": self.reason}
+        return {
+            "mode": "face",
+            "tracker": self.tracker,
+            "crop": [self.track.width, self.track.height],
+            "resolution": list(self.resolution),
+            "frame_share": round(self.track.width * self.track.height / (self.media["width"] * self.media["height"]), 3)
+        }
+
+
+def _tracker() -> str:
+    if FACE_TRACKER != "auto":
+        return FACE_TRACKER
+    try:
+        import cv2  # noqa: F401
+        return "detector"
+    except ImportError:
+        return "mask"
+
+
+def track_faces(video_path: Path, media: dict, mask_source=None) -> tuple:
+    """
+    Face boxes for every frame of video_path (NaN rows where none was found)
+    and the tracker that found them. mask_source() is called for a character
+    mask video when the mask tracker is used.
+    """
+    tracker = _tracker()
+    if tracker == "detector":
+        return detect_boxes(video_path, media), tracker
+    if tracker == "mask" and mask_source is not None:
+        return mask_boxes(mask_source(), media), tracker
+    raise ValueError(f"Face tracker '{tracker}' is not available (use detector or mask)")
+
+
+def crop_region(video_path: Path, media: dict, boxes: np.ndarray, tracker: str, work_dir: Path) -> FaceRegion:
+    """Stabilize the face boxes of video_path into a crop and cut it out, unless full frame is the better choice."""
+    track = stabilize(boxes, media["width"], media["height"])
+    if track is None:
+        return FaceRegion(video_path, media, tracker=tracker, reason="no face found")
+    share = track.width * track.height / (media["width"] * media["height"])
+    if share > FACE_REGION_MAX_SHARE:
+        return FaceRegion(video_path, media, tracker=tracker,
+                          reason=f"face crop covers {share:.0%} of the frame")
+
+    work_dir = Path(work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    crop_path = crop_video(video_path, track, work_dir / "face_crop.mp4", media)
+    return FaceRegion(video_path, media, track, crop_path, tracker)
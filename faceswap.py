@@ -5,12 +5,26 @@ Wrapper script to easily swap faces in videos using a reference photo.
 """
 
 import argparse
+import csv
+import json
 import os
-import subprocess
+import shutil
 import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
+import metrics
+from engine import GENERATION_BACKEND, build_generate_cmd, get_engine
+from preprocess import attach_reference, preprocess_video, video_cache_key
+from preprocess_cache import get_cache
+from scheduler import GpuScheduler, gpu_env
+from segment import (SEGMENT_OVERLAP, SEGMENT_SECONDS, cut_segments, plan_segments, probe_duration,
+                     probe_frames, process_segments, remux_audio, stitch_segments)
+
 # Configuration
 HOME = os.path.expanduser("~")
 WORK_DIR = Path(HOME) / "faceswap"
@@ -20,6 +34,7 @@ INPUTS_VIDEO_DIR = WORK_DIR / "inputs" / "videos"
 INPUTS_PHOTO_DIR = WORK_DIR / "inputs" / "photos"
 OUTPUTS_DIR = WORK_DIR / "outputs"
 PROCESSED_DIR = WORK_DIR / "processed"
+CACHE_DIR = Path(os.environ.get("PREPROCESS_CACHE_DIR", WORK_DIR / "cache" / "preprocess"))
 
 
 def check_setup():
@@ -65,31 +80,24 @@ def find_file(name: str, directory: Path) -> Path:
 
 
 def run_preprocessing(video_path: Path, photo_path: Path, output_dir: Path, resolution: tuple):
-    """Run the preprocessing step."""
+    """Run the preprocessing step (the video stage is reused from the cache when possible)."""
     print("\n[Step 1/2] Preprocessing video and photo...")
     print(f"  Video: {video_path}")
     print(f"  Photo: {photo_path}")
     print(f"  Resolution: {resolution[0]}x{resolution[1]}")
 
-    cmd = [
-        "python", str(WAN_DIR / "wan" / "modules" / "animate" / "preprocess" / "preprocess_data.py"),
-        "--ckpt_path", str(MODEL_DIR / "process_checkpoint"),
-        "--video_path", str(video_path),
-        "--refer_path", str(photo_path),
-        "--save_path", str(output_dir),
-        "--resolution_area", str(resolution[0]), str(resolution[1]),
-        "--iterations", "3",
-        "--k", "7",
-        "--w_len", "1",
-        "--h_len", "1",
-        "--replace_flag"  # Use replacement mode for face swapping
-    ]
-
-    result = subprocess.run(cmd, cwd=WAN_DIR)
-    if result.returncode != 0:
-        print("ERROR: Preprocessing failed.")
-        sys.exit(1)
+    PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=PROCESSED_DIR) as video_dir:
+        try:
+            with metrics.stage("preprocess"):
+                cache_hit = preprocess_video(WAN_DIR, MODEL_DIR, video_path, photo_path, Path(video_dir),
+                                             resolution, cache=get_cache(CACHE_DIR), capture_output=False)
+        except RuntimeError as e:
+            raise RuntimeError(f"Preprocessing failed: {e}") from e
+        attach_reference(Path(video_dir), photo_path, output_dir)
 
+    if cache_hit:
+        print("  Reused cached video preprocessing.")
     print("  Preprocessing complete!")
 
 
@@ -97,49 +105,233 @@ def run_generation(processed_dir: Path, output_path: Path, num_gpus: int):
     """Run the video generation step."""
     print("\n[Step 2/2] Generating face-swapped video...")
 
-    if num_gpus > 1:
-        # Multi-GPU inference
-        cmd = [
-            "python", "-m", "torch.distributed.run",
-            "--nnodes", "1",
-            "--nproc_per_node", str(num_gpus),
-            "generate.py",
-            "--task", "animate-14B",
-            "--ckpt_dir", str(MODEL_DIR),
-            "--src_root_path", str(processed_dir),
-            "--refert_num", "1",
-            "--replace_flag",
-            "--use_relighting_lora",
-            "--dit_fsdp",
-            "--t5_fsdp",
-            "--ulysses_size", str(num_gpus)
-        ]
-    else:
-        # Single GPU inference
-        cmd = [
-            "python", "generate.py",
-            "--task", "animate-14B",
-            "--ckpt_dir", str(MODEL_DIR),
-            "--src_root_path", str(processed_dir),
-            "--refert_num", "1",
-            "--replace_flag",
-            "--use_relighting_lora"
-        ]
-
-    result = subprocess.run(cmd, cwd=WAN_DIR)
-    if result.returncode != 0:
-        print("ERROR: Generation failed.")
-        sys.exit(1)
+    # Single GPU, or multi-GPU inference via torch.distributed.run
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    cmd = build_generate_cmd(MODEL_DIR, processed_dir, num_gpus, save_file=output_path)
+
+    with metrics.stage("sampling"):
+        result = metrics.run_process(cmd, cwd=WAN_DIR)
+    if result.returncode != 0 or not output_path.exists():
+        raise RuntimeError(f"Generation failed (exit code {result.returncode})")
+    print(f"  Output saved to: {output_path}")
+
+
+def run_segmented(video_path: Path, photo_path: Path, process_dir: Path, output_path: Path,
+                  resolution: tuple, num_gpus: int, segments: list, overlap: float):
+    """
+    Process a long video as overlapping segments, one segment per GPU at a
+    time, then crossfade the results and restore the original audio.
+    """
+    print(f"\nSplitting into {len(segments)} segments ({overlap}s overlap) across {num_gpus} GPU(s)...")
+    clips = cut_segments(video_path, segments, process_dir / "segments")
+
+    # Each worker borrows one GPU for the duration of a segment
+    scheduler = GpuScheduler(num_gpus)
+
+    def process_segment(index, clip):
+        segment_dir = process_dir / f"segment_{index:03d}"
+        segment_output = process_dir / f"segment_{index:03d}.mp4"
+        run_preprocessing(clip, photo_path, segment_dir, resolution)
 
-    # Find and move output
-    output_files = list((WAN_DIR / "outputs").glob("*.mp4"))
-    if output_files:
-        latest = max(output_files, key=lambda p: p.stat().st_mtime)
-        import shutil
-        shutil.move(str(latest), str(output_path))
-        print(f"  Output saved to: {output_path}")
+        with scheduler.slot(width=1) as gpus:
+            print(f"  Generating segment {index + 1}/{len(segments)} on GPU {gpus[0]}...")
+            cmd = build_generate_cmd(MODEL_DIR, segment_dir, save_file=segment_output)
+            with metrics.stage("sampling"):
+                result = metrics.run_process(cmd, cwd=WAN_DIR, env=gpu_env(gpus))
+            if result.returncode != 0:
+                raise RuntimeError(f"generation exited with code {result.returncode}")
+        return segment_output
+
+    outputs = process_segments(process_segment, clips, workers=num_gpus)
+    with metrics.stage("stitch"):
+        stitched = stitch_segments(outputs, process_dir / "stitched.mp4", overlap)
+        remux_audio(stitched, video_path, output_path)
+    print(f"  Output saved to: {output_path}")
+
+
+def load_manifest(manifest_path: Path, default_resolution: tuple) -> list:
+    """
+    Read batch rows from a .jsonl or .csv manifest.
+
+    Each row has video and photo, and optionally resolution ([w, h] in JSONL,
+    "WxH" in CSV) and output. Relative inputs are looked up next to the
+    manifest, then in inputs/videos or inputs/photos; relative outputs go to
+    outputs/.
+    """
+    if manifest_path.suffix == ".csv":
+        with open(manifest_path, newline="") as f:
+            raw_rows = list(csv.DictReader(f))
     else:
-        print("  Generation complete! Check Wan2.2/outputs/ for the result.")
+        with open(manifest_path) as f:
+            raw_rows = [json.loads(line) for line in f if line.strip()]
+
+    def resolve_input(value: str, directory: Path) -> Path:
+        path = Path(value).expanduser()
+        if path.is_absolute():
+            return path
+        for base in (manifest_path.parent, directory):
+            if (base / path).exists():
+                return base / path
+        return manifest_path.parent / path
+
+    rows = []
+    for index, raw in enumerate(raw_rows):
+        video_path = resolve_input(raw["video"], INPUTS_VIDEO_DIR)
+        photo_path = resolve_input(raw["photo"], INPUTS_PHOTO_DIR)
+        resolution = raw.get("resolution") or default_resolution
+        if isinstance(resolution, str):
+            resolution = [int(n) for n in resolution.lower().split("x")]
+        output = raw.get("output") or f"{video_path.stem}_{photo_path.stem}_{resolution[0]}x{resolution[1]}.mp4"
+        rows.append({
+            "row": index,
+            "video": video_path,
+            "photo": photo_path,
+            "resolution": tuple(resolution),
+            "output": Path(output) if Path(output).is_absolute() else OUTPUTS_DIR / output
+        })
+    return rows
+
+
+def output_ok(path: Path) -> bool:
+    """True if path is a finished, readable video."""
+    if not path.exists() or path.stat().st_size == 0:
+        return False
+    try:
+        return probe_duration(path) > 0
+    except (RuntimeError, ValueError):
+        return False
+
+
+def run_batch(manifest_path: Path, resolution: tuple, workers: int, backend: str, results_path: Path,
+              num_gpus: int = 1):
+    """
+    Run every row of a manifest.
+
+    The model is loaded once for the whole batch. Video preprocessing is
+    shared between rows with the same (video, resolution) and reused from
+    the cache across runs. Rows run on a bounded worker pool, and each
+    result is appended to results_path as soon as it finishes. Rows whose
+    output already exists and probes as a valid video are skipped, so an
+    interrupted batch picks up where it stopped.
+    """
+    rows = load_manifest(manifest_path, resolution)
+    pending = []
+    results_path.parent.mkdir(parents=True, exist_ok=True)
+    results_lock = threading.Lock()
+
+    def record(row: dict, status: str, **fields):
+        entry = {"row": row["row"], "video": str(row["video"]), "photo": str(row["photo"]),
+                 "output": str(row["output"]), "status": status, **fields}
+        with results_lock, open(results_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        return entry
+
+    for row in rows:
+        if output_ok(row["output"]):
+            record(row, "skipped")
+        else:
+            pending.append(row)
+    print(f"Batch: {len(rows)} rows, {len(rows) - len(pending)} already done, {len(pending)} to run")
+    if not pending:
+        return
+
+    engine = get_engine(MODEL_DIR, WAN_DIR, backend=backend)
+    scheduler = GpuScheduler(num_gpus) if engine.supports_slots else None
+    # Preprocessing also runs on the GPU; at most one video per GPU at a time
+    preprocess_slots = threading.Semaphore(num_gpus)
+    batch_dir = PROCESSED_DIR / f"batch_{manifest_path.stem}"
+    batch_dir.mkdir(parents=True, exist_ok=True)
+    cache = get_cache(CACHE_DIR)
+
+    # One preprocessing run per (video, resolution); later rows wait on the first
+    video_futures = {}
+    video_users = {}
+    video_lock = threading.Lock()
+    entries = []
+    for row in list(pending):
+        try:
+            row["video_key"] = video_cache_key(row["video"], row["resolution"])
+        except OSError as e:
+            entries.append(record(row, "failed", error=str(e)))
+            pending.remove(row)
+            continue
+        video_users[row["video_key"]] = video_users.get(row["video_key"], 0) + 1
+
+    def video_dir_for(row: dict):
+        key = row["video_key"]
+        with video_lock:
+            future = video_futures.get(key)
+            owner = future is None
+            if owner:
+                future = video_futures[key] = Future()
+        if owner:
+            video_dir = batch_dir / f"video_{key[:16]}"
+            shutil.rmtree(video_dir, ignore_errors=True)
+            try:
+                with preprocess_slots:
+                    hit = preprocess_video(WAN_DIR, MODEL_DIR, row["video"], row["photo"], video_dir,
+                                           row["resolution"], cache=cache)
+                future.set_result((video_dir, hit))
+            except BaseException as e:
+                future.set_exception(e)
+        return future.result()
+
+    def release_video(row: dict):
+        key = row["video_key"]
+        with video_lock:
+            video_users[key] -= 1
+            done = video_users[key] == 0
+        if done:
+            shutil.rmtree(batch_dir / f"video_{key[:16]}", ignore_errors=True)
+
+    def run_row(row: dict):
+        start = time.time()
+        process_dir = batch_dir / f"row_{row['row']:05d}"
+        partial = row["output"].with_name(f".{row['output'].stem}.partial.mp4")
+        row_metrics = metrics.JobMetrics(f"{manifest_path.stem}-{row['row']}")
+        try:
+            with metrics.activate(row_metrics):
+                with row_metrics.stage("preprocess"):
+                    video_dir, cache_hit = video_dir_for(row)
+                    attach_reference(video_dir, row["photo"], process_dir)
+                preprocess_seconds = time.time() - start
+
+                row["output"].parent.mkdir(parents=True, exist_ok=True)
+                generate_start = time.time()
+                with row_metrics.stage("sampling"):
+                    if scheduler is None:
+                        engine.generate(process_dir, partial)
+                    else:
+                        scheduler.run(lambda gpus: engine.generate(process_dir, partial, gpus), width=1)
+                os.replace(partial, row["output"])
+                row_metrics.add_frames(probe_frames(row["output"]))
+                row_metrics.add_bytes_out(row["output"].stat().st_size)
+            entry = record(row, "done", video_cache_hit=cache_hit,
+                           preprocess_seconds=round(preprocess_seconds, 2),
+                           generate_seconds=round(time.time() - generate_start, 2),
+                           total_seconds=round(time.time() - start, 2),
+                           metrics=row_metrics.finish("success"))
+        except Exception as e:
+            partial.unlink(missing_ok=True)
+            entry = record(row, "failed", error=str(e), total_seconds=round(time.time() - start, 2),
+                           metrics=row_metrics.finish("failed"))
+        finally:
+            release_video(row)
+            shutil.rmtree(process_dir, ignore_errors=True)
+        print(f"  [{entry['status']}] row {row['row']}: {row['video'].name} + {row['photo'].name}"
+              f" -> {row['output'].name} ({entry['total_seconds']}s)")
+        return entry
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        entries += pool.map(run_row, pending)
+    shutil.rmtree(batch_dir, ignore_errors=True)
+
+    failed = sum(1 for entry in entries if entry["status"] == "failed")
+    print(f"Batch finished in {time.time() - start:.0f}s: {len(entries) - failed} done, {failed} failed")
+    print(f"Results: {results_path}")
+    if failed:
+        sys.exit(1)
 
 
 def main():
@@ -151,12 +343,14 @@ Examples:
   python faceswap.py --video dance.mp4 --photo myface.jpg
   python faceswap.py --video interview.mp4 --photo portrait.png --resolution 1920 1080
   python faceswap.py --video clip.mp4 --photo face.jpg --gpus 4
+  python faceswap.py --video long.mp4 --photo face.jpg --gpus 4 --segment-seconds 15
+  python faceswap.py --batch jobs.jsonl --workers 4
         """
     )
 
-    parser.add_argument("--video", "-v", required=True,
+    parser.add_argument("--video", "-v",
                         help="Input video filename (in inputs/videos/)")
-    parser.add_argument("--photo", "-p", required=True,
+    parser.add_argument("--photo", "-p",
                         help="Reference face photo filename (in inputs/photos/)")
     parser.add_argument("--resolution", "-r", nargs=2, type=int, default=[1280, 720],
                         metavar=("WIDTH", "HEIGHT"),
@@ -165,12 +359,35 @@ Examples:
                         help="Number of GPUs to use (default: 1)")
     parser.add_argument("--output", "-o", default=None,
                         help="Output filename (default: auto-generated)")
+    parser.add_argument("--segment-seconds", type=float, default=SEGMENT_SECONDS,
+                        help=f"Split longer videos into segments of this length, 0 to disable "
+                             f"(default: {SEGMENT_SECONDS:g})")
+    parser.add_argument("--overlap", type=float, default=SEGMENT_OVERLAP,
+                        help=f"Seconds of overlap blended between segments (default: {SEGMENT_OVERLAP:g})")
+
+    parser.add_argument("--batch", type=Path, default=None, metavar="MANIFEST",
+                        help="Run every row of a .jsonl or .csv manifest (video, photo, "
+                             "[resolution], [output]); rerunning resumes")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Rows processed at once in batch mode (default: --gpus + 1)")
+    parser.add_argument("--backend", default=GENERATION_BACKEND,
+                        help=f"Generation backend for batch mode (default: {GENERATION_BACKEND})")
+    parser.add_argument("--results", type=Path, default=None,
+                        help="Batch results manifest (default: outputs/<manifest>.results.jsonl)")
 
     args = parser.parse_args()
+    if not args.batch and not (args.video and args.photo):
+        parser.error("--video and --photo are required unless --batch is given")
 
     # Check setup
     check_setup()
 
+    if args.batch:
+        results_path = args.results or OUTPUTS_DIR / f"{args.batch.stem}.results.jsonl"
+        run_batch(args.batch, tuple(args.resolution), args.workers or args.gpus + 1,
+                  args.backend, results_path, args.gpus)
+        return
+
     # Find input files
     video_path = find_file(args.video, INPUTS_VIDEO_DIR)
     photo_path = find_file(args.photo, INPUTS_PHOTO_DIR)
@@ -198,13 +415,36 @@ Examples:
     print("=" * 50)
 
     # Run pipeline
-    run_preprocessing(video_path, photo_path, process_dir, tuple(args.resolution))
-    run_generation(process_dir, output_path, args.gpus)
+    job_metrics = metrics.JobMetrics(job_name)
+    job_metrics.add_bytes_in(video_path.stat().st_size + photo_path.stat().st_size)
+    status = "failed"
+    try:
+        with metrics.activate(job_metrics):
+            segments = plan_segments(probe_duration(video_path), args.segment_seconds, args.overlap)
+            if len(segments) > 1:
+                run_segmented(video_path, photo_path, process_dir, output_path, tuple(args.resolution),
+                              args.gpus, segments, args.overlap)
+            else:
+                run_preprocessing(video_path, photo_path, process_dir, tuple(args.resolution))
+                run_generation(process_dir, output_path, args.gpus)
+        job_metrics.add_frames(probe_frames(output_path))
+        job_metrics.add_bytes_out(output_path.stat().st_size)
+        status = "success"
+    except RuntimeError as e:
+        # Steps raise instead of exiting (they also run in worker threads); exit here
+        print(f"ERROR: {e}")
+        sys.exit(1)
+    finally:
+        summary = job_metrics.finish(status)
 
     print("\n" + "=" * 50)
     print("FACE SWAP COMPLETE!")
     print("=" * 50)
     print(f"Output: {output_path}")
+    stages = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in summary["stages"].items())
+    print(f"Time:   {summary['total_seconds']:.1f}s ({stages})")
+    if summary["fps"]:
+        print(f"Speed:  {summary['fps']:.2f} frames/s")
 
 
 if __name__ == "__main__":
@@ -3,13 +3,36 @@ RunPod Serverless Handler for Wan2.2-Animate-14B Face Swap
 """
 
 import os
+import asyncio
 import runpod
-import subprocess
 import tempfile
-import base64
-import requests
+import threading
+import time
+import uuid
 from pathlib import Path
 
+import checkpoint
+import metrics
+import presence
+import progress
+from admission import DEFAULT_FPS, AdmissionError, detect_vram_gb, engine_memory, load_cost_model, plan_job, probe_media
+from b64stream import decode_to_file, encode_file
+from engine import BACKENDS, GENERATION_BACKEND, GENERATION_PARAMS, get_engine, loaded_engine
+from face_region import FACE_REGION_PARAMS, TRACK_RESOLUTION, crop_region, track_faces
+from ingest import fetch_all
+from memory_policy import MEMORY_MODE, MEMORY_MODES, select_mode
+from normalize import extract_audio, normalize_video
+from pipeline import Stage, StagedPipeline
+from preprocess import PREPROCESS_PARAMS, attach_reference, preprocess_video
+from preprocess_cache import get_cache, link_or_copy
+from provision import ensure_model
+from result_cache import get_result_cache, request_key, result_key
+from scheduler import detect_gpu_count, get_scheduler
+from segment import (SEGMENT_OVERLAP, SEGMENT_SECONDS, cut_segments, plan_segments, probe_duration, probe_frames, process_segments,
+                     remux_audio, retime, stitch_segments)
+from staging import staged_model_dir, start_staging
+from storage import get_storage, output_key, upload_async
+
 # Debug: Print filesystem info at startup
 print("=" * 50)
 print("STARTUP DEBUG INFO")
@@ -50,122 +73,548 @@ def get_model_dir():
     return Path("/runpod-volume/Wan2.2-Animate-14B")  # default for download
 
 MODEL_DIR = get_model_dir()
-WAN_DIR = Path("/workspace/Wan2.2")
+WAN_DIR = Path(os.environ.get("WAN_DIR", "/workspace/Wan2.2"))
+
+GPU_COUNT = detect_gpu_count()
+
+# Jobs accepted at once (0: GPU slots + 1); ingest/preprocess of queued jobs overlaps generation
+MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", "0"))
+
+# An inline base64 result is held in memory about twice over (see b64stream.py), so
+# larger outputs are uploaded instead whenever storage is configured
+INLINE_OUTPUT_MAX_BYTES = int(float(os.environ.get("INLINE_OUTPUT_MAX_MB", "64")) * 1024**2)
+
+# Jobs currently held by this worker, used to size GPU groups
+_jobs_in_flight = 0
+
+# Segment runs queued by jobs generating their segments side by side, beyond
+# one per job, so GPU groups are sized for them too
+_extra_runs = 0
+_extra_runs_lock = threading.Lock()
+
+# Running jobs by request_key(), so identical requests share one execution
+_running = {}
+
+# Runs of a backend without slots go one at a time
+_serial_generate_lock = threading.Lock()
+
+def gpu_slots(engine=None) -> int:
+    """
+    Runs that can generate side by side. Backends that spawn a process per
+    run get one slot per GPU; the in-process engine holds a single pipeline
+    and takes one. Decided by the backend get_engine() actually loaded, which
+    is the subprocess one when the in-process engine fails to load, and by
+    the configured backend until then.
+    """
+    engine = engine or loaded_engine() or BACKENDS[GENERATION_BACKEND]
+    return GPU_COUNT if engine.supports_slots else 1
+
+def max_concurrent_jobs() -> int:
+    """Jobs this worker accepts at once: MAX_CONCURRENT_JOBS, or one more than the GPU slots."""
+    return MAX_CONCURRENT_JOBS or gpu_slots() + 1
+
+def load_engine():
+    """The warm generation engine; zero time on a warm worker, staging and model load on a cold one."""
+    with metrics.stage("model_load"):
+        return get_engine(staged_model_dir(MODEL_DIR), WAN_DIR, memory=engine_memory())
 
 def ensure_model_downloaded():
-    """Download model to network volume if not present."""
+    """
+    Provision the model on the network volume if it is not complete.
+
+    Concurrent cold workers share one download through a lock on the volume;
+    the directory only counts as complete once every file is verified.
+    """
     global MODEL_DIR
     MODEL_DIR = get_model_dir()  # Re-check at runtime
+    ensure_model(MODEL_DIR)
 
-    marker_file = MODEL_DIR / ".download_complete"
+def save_base64_file(data: str, dest: Path) -> Path:
+    """Save base64 encoded data to file, decoding in fixed-size chunks."""
+    return decode_to_file(data, dest)
+
+def run_preprocessing(video_path: Path, photo_paths: list, work_dir: Path, resolution: tuple,
+                      fps: int = DEFAULT_FPS):
+    """
+    Run the preprocessing step.
 
-    # Also check if key model files exist as backup check
-    key_files = [
-        MODEL_DIR / "diffusion_pytorch_model-00001-of-00004.safetensors",
-        MODEL_DIR / "Wan2.1_VAE.pth",
-        MODEL_DIR / "config.json"
+    The video is preprocessed once (or fetched from the cache) and then
+    combined with each photo. Returns one processed directory per photo and
+    whether the video stage was a cache hit.
+    """
+    video_dir = work_dir / "processed_video"
+    # Only the preprocessing checkpoints need to be staged before this can run
+    model_dir = staged_model_dir(MODEL_DIR, "process_checkpoint")
+    params = PREPROCESS_PARAMS if fps == DEFAULT_FPS else {**PREPROCESS_PARAMS, "fps": fps}
+    cache_hit = preprocess_video(WAN_DIR, model_dir, video_path, photo_paths[0], video_dir,
+                                 resolution, cache=get_cache(), params=params)
+    process_dirs = [
+        attach_reference(video_dir, photo_path, work_dir / f"processed_{i}")
+        for i, photo_path in enumerate(photo_paths)
     ]
+    return process_dirs, cache_hit
 
-    print(f"Checking model at: {MODEL_DIR}")
-    print(f"Marker file exists: {marker_file.exists()}")
-    print(f"Model dir exists: {MODEL_DIR.exists()}")
+def run_generation(processed_dir: Path, output_path: Path, fps: int = DEFAULT_FPS, memory: dict = None):
+    """
+    Run the video generation step on the warm generation engine.
 
-    if marker_file.exists():
-        print("Model already downloaded (marker file found).")
-        return
+    With a slot-capable backend the job borrows a group of GPUs: one GPU
+    each when several jobs are queued, all of them (Ulysses parallel) when
+    this is the only job. memory is the plan's memory selection (offload,
+    T5 on CPU, dtype conversion). Output generated from frames sampled below
+    the default fps is retimed to play at the original speed.
+    """
+    engine = load_engine()
 
-    # Check if model files exist even without marker
-    if all(f.exists() for f in key_files):
-        print("Model files found, creating marker file.")
-        marker_file.touch()
-        return
+    def generate(gpus=None):
+        with metrics.stage("sampling"):
+            return engine.generate(processed_dir, output_path, gpus, memory)
 
-    print("Model not found. Downloading to network volume...")
-    print("This will take 15-30 minutes on first run, but only happens once.")
+    if not engine.supports_slots:
+        with _serial_generate_lock:
+            generate()
+    else:
+        get_scheduler(pending=lambda: _jobs_in_flight + _extra_runs).run(generate)
+    if fps != DEFAULT_FPS:
+        retime(output_path, fps, DEFAULT_FPS)
+    return output_path
+
+def encode_output(output_path: Path) -> str:
+    """Base64 encode a generated video."""
+    return encode_file(output_path)
+
+def validate_input(job_input: dict):
+    """Return an error message if the job input is missing required fields."""
+    if "video_url" not in job_input and "video_base64" not in job_input:
+        return "No video provided. Use video_url or video_base64"
+    if not any(key in job_input for key in ("photo_urls", "photo_url", "photo_base64")):
+        return "No photo provided. Use photo_url, photo_urls or photo_base64"
+    photo_urls = job_input.get("photo_urls")
+    if "photo_urls" in job_input and (not isinstance(photo_urls, list) or not photo_urls
+                                      or not all(isinstance(url, str) for url in photo_urls)):
+        return "photo_urls must be a non-empty list of URLs"
+    for key in ("start", "end", "target_fps", "max_frames", "max_gpu_seconds"):
+        value = job_input.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0):
+            return f"{key} must be a non-negative number"
+    if job_input.get("target_fps") is not None and job_input["target_fps"] < 1:
+        return "target_fps must be at least 1"
+    max_frames = job_input.get("max_frames")
+    if max_frames is not None and (max_frames < 1 or max_frames != int(max_frames)):
+        return "max_frames must be a positive whole number"
+    if job_input.get("region", "full") not in ("full", "face"):
+        return "region must be 'full' or 'face'"
+    if not isinstance(job_input.get("skip_absent", False), bool):
+        return "skip_absent must be true or false"
+    if not isinstance(job_input.get("idempotency_key", ""), str):
+        return "idempotency_key must be a string"
+    if job_input.get("memory_mode", "auto") not in ("auto", *MEMORY_MODES):
+        return f"memory_mode must be one of: auto, {', '.join(MEMORY_MODES)}"
+    return None
+
+def admit_job(job_input: dict, temp_path: Path) -> dict:
+    """
+    Probe the video and plan the job within the admission budget (see
+    admission.py). A URL is probed in place, reading only the header; an
+    inline video is decoded into the job directory first.
+    """
+    if "video_url" in job_input:
+        source = job_input["video_url"]
+    else:
+        source = save_base64_file(job_input["video_base64"], temp_path / "input_video.mp4")
+    return plan_job(probe_media(source), job_input.get("resolution", [1280, 720]),
+                    max_gpu_seconds=job_input.get("max_gpu_seconds"), start=job_input.get("start"),
+                    end=job_input.get("end"), target_fps=job_input.get("target_fps"),
+                    max_frames=job_input.get("max_frames"), memory_mode=job_input.get("memory_mode"))
 
-    # Create directory
-    MODEL_DIR.mkdir(parents=True, exist_ok=True)
+def checkpoint_key(job_input: dict, key: str) -> str:
+    """
+    Jobs resume each other's checkpoints when they share an idempotency_key,
+    or else are identical (the same request_key(), passed in as key).
+    """
+    if job_input.get("idempotency_key"):
+        return request_key({"idempotency_key": job_input["idempotency_key"]})
+    return key
 
-    # Download using huggingface-cli
-    result = subprocess.run([
-        "huggingface-cli", "download",
-        "Wan-AI/Wan2.2-Animate-14B",
-        "--local-dir", str(MODEL_DIR)
-    ], capture_output=True, text=True)
+def resume(ctx: dict, unit: str):
+    """
+    Restore a unit of work an earlier attempt of this job checkpointed (see
+    checkpoint.py). Returns its saved state, or None if it has to be run.
+    """
+    job_checkpoint = ctx["checkpoint"]
+    if job_checkpoint is None or not job_checkpoint.done(unit):
+        return None
+    try:
+        with metrics.stage("checkpoint"):
+            state = job_checkpoint.restore(unit, ctx["temp_path"])
+    except OSError as e:
+        print(f"Could not restore {unit} from checkpoint: {e}")
+        return None
+    ctx["resumed"].append(unit)
+    return state
+
+def save_checkpoint(ctx: dict, unit: str, paths: list = (), state: dict = None):
+    """Checkpoint a finished unit of work and the files it produced in the job directory."""
+    job_checkpoint = ctx["checkpoint"]
+    if job_checkpoint is None:
+        return
+    try:
+        with metrics.stage("checkpoint"):
+            job_checkpoint.save(unit, ctx["temp_path"], paths, state)
+    except OSError as e:
+        print(f"Could not checkpoint {unit}: {e}")
+
+def ingest_stage(ctx: dict) -> dict:
+    """Fetch the video and photo(s) into the job directory, unless a checkpoint already has them."""
+    temp_path = ctx["temp_path"]
+    state = resume(ctx, "ingest")
+    if state is not None:
+        video_path = temp_path / "input_video.mp4"
+        photo_paths = [temp_path / name for name in state["photos"]]
+    else:
+        video_path, photo_paths = fetch_inputs(ctx)
+        save_checkpoint(ctx, "ingest", [video_path, *photo_paths], {"photos": [path.name for path in photo_paths]})
+
+    ctx["video_path"] = video_path
+    ctx["photo_paths"] = photo_paths
+    with metrics.stage("result_cache"):
+        lookup_result(ctx)
+    return ctx
+
+def fetch_inputs(ctx: dict) -> tuple:
+    """Download or decode the job's inputs; returns (video_path, photo_paths)."""
+    job_input = ctx["input"]
+    temp_path = ctx["temp_path"]
+    downloads = []
+
+    # Get video
+    video_path = temp_path / "input_video.mp4"
+    if "video_url" in job_input:
+        downloads.append((job_input["video_url"], video_path))
+    elif not video_path.exists():  # Normally already decoded by admission
+        save_base64_file(job_input["video_base64"], video_path)
+
+    # Get photo(s)
+    photo_paths = []
+    if job_input.get("photo_urls"):
+        for i, photo_url in enumerate(job_input["photo_urls"]):
+            photo_paths.append(temp_path / f"input_photo_{i}.jpg")
+            downloads.append((photo_url, photo_paths[-1]))
+    elif "photo_url" in job_input:
+        photo_paths.append(temp_path / "input_photo.jpg")
+        downloads.append((job_input["photo_url"], photo_paths[-1]))
+    else:
+        photo_paths.append(save_base64_file(job_input["photo_base64"], temp_path / "input_photo.jpg"))
 
-    if result.returncode != 0:
-        raise RuntimeError(f"Model download failed: {result.stderr}")
+    # Video and photos are fetched concurrently over pooled connections
+    fetch_all(downloads)
+    ctx["metrics"].add_bytes_in(sum(path.stat().st_size for path in [video_path, *photo_paths]))
+    return video_path, photo_paths
 
-    # Create marker file to indicate successful download
-    marker_file.touch()
-    print("Model download complete!")
+def lookup_result(ctx: dict):
+    """
+    Answer a repeat of a finished job from the result cache. On a hit the
+    outputs are fetched into the job directory and the GPU stages pass the
+    job straight through to encode.
+    """
+    ctx["result_cache_hit"] = False
+    ctx["result_cache_key"] = None
+    cache = get_result_cache()
+    if cache is None:
+        return
 
-def download_file(url: str, dest: Path) -> Path:
-    """Download a file from URL to destination."""
-    response = requests.get(url, stream=True)
-    response.raise_for_status()
-    with open(dest, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            f.write(chunk)
-    return dest
+    plan = ctx["plan"]
+    ctx["result_cache_key"] = result_key([ctx["video_path"], *ctx["photo_paths"]], {
+        "preprocess": PREPROCESS_PARAMS,
+        "generation": GENERATION_PARAMS,
+        "backend": GENERATION_BACKEND,
+        "window": plan["window"],
+        "resolution": plan["resolution"],
+        "fps": plan["fps"],
+        "segment_seconds": plan["segment_seconds"] or SEGMENT_SECONDS,
+        "segment_overlap": SEGMENT_OVERLAP,
+        "region": ctx["input"].get("region", "full"),
+        **({"face_region": FACE_REGION_PARAMS} if ctx["input"].get("region") == "face" else {}),
+        **({"skip_absent": presence.PRESENCE_PARAMS} if ctx["input"].get("skip_absent", presence.SKIP_ABSENT) else {})
+    })
+    cached_dir = ctx["temp_path"] / "cached_result"
+    if not cache.fetch(ctx["result_cache_key"], cached_dir):
+        return
 
-def save_base64_file(data: str, dest: Path) -> Path:
-    """Save base64 encoded data to file."""
-    file_data = base64.b64decode(data)
-    with open(dest, 'wb') as f:
-        f.write(file_data)
-    return dest
-
-def run_preprocessing(video_path: Path, photo_path: Path, output_dir: Path, resolution: tuple):
-    """Run the preprocessing step."""
-    cmd = [
-        "python", str(WAN_DIR / "wan" / "modules" / "animate" / "preprocess" / "preprocess_data.py"),
-        "--ckpt_path", str(MODEL_DIR / "process_checkpoint"),
-        "--video_path", str(video_path),
-        "--refer_path", str(photo_path),
-        "--save_path", str(output_dir),
-        "--resolution_area", str(resolution[0]), str(resolution[1]),
-        "--iterations", "3",
-        "--k", "7",
-        "--w_len", "1",
-        "--h_len", "1",
-        "--replace_flag"
-    ]
+    print(f"Result cache hit: {ctx['result_cache_key'][:12]}")
+    ctx["result_cache_hit"] = True
+    ctx["cache_hit"] = False
+    ctx["output_paths"] = [cached_dir / f"output_{i}.mp4" for i in range(len(ctx["photo_paths"]))]
+    if ctx["upload"]:
+        ctx["uploads"] = [upload_async(path, output_key(ctx["job_id"], path.name)) for path in ctx["output_paths"]]
+
+def publish_result(ctx: dict):
+    """Store a freshly generated job's outputs in the result cache."""
+    cache = get_result_cache()
+    if cache is None or ctx["result_cache_hit"] or not ctx["result_cache_key"]:
+        return
+    result_dir = ctx["temp_path"] / "result"
+    result_dir.mkdir(exist_ok=True)
+    for i, path in enumerate(ctx["output_paths"]):
+        link_or_copy(path, result_dir / f"output_{i}.mp4")
+    try:
+        cache.publish(ctx["result_cache_key"], result_dir)
+    except OSError as e:
+        print(f"Could not publish result cache entry: {e}")
+
+def normalize_stage(ctx: dict) -> dict:
+    """
+    Cut the video down to the plan's window, fps and working resolution so
+    preprocessing only sees frames that will be generated, and keep the
+    matching audio for the final remux. Jobs using region "face" or
+    skip_absent are face-tracked here, then cropped and/or split into spans.
+    """
+    temp_path = ctx["temp_path"]
+    ctx["audio_path"] = extract_audio(ctx["video_path"], temp_path / "input_audio.mka", ctx["plan"])
+    ctx["video_path"] = normalize_video(ctx["video_path"], temp_path / "normalized_video.mp4", ctx["plan"])
+    ctx["region"] = None
+    ctx["spans"] = None
+    ctx["presence"] = None
+    crop_face = ctx["input"].get("region") == "face"
+    skip_absent = ctx["input"].get("skip_absent", presence.SKIP_ABSENT)
+    if crop_face or skip_absent:
+        media = probe_media(ctx["video_path"])
+        with metrics.stage("face_track"):
+            boxes, tracker = track_faces(ctx["video_path"], media, lambda: track_mask(ctx))
+        if skip_absent:
+            spans = presence.presence_spans(boxes, media["fps"])
+            ctx["presence"] = presence.summary(spans, media["fps"])
+            # Only worth splitting when some span is passed through
+            if any(not present for *_, present in spans):
+                ctx["spans"] = spans
+        if crop_face:
+            with metrics.stage("face_crop"):
+                ctx["region"] = crop_region(ctx["video_path"], media, boxes, tracker, temp_path / "face_region")
+            if ctx["region"].active:
+                ctx["video_path"] = ctx["region"].crop_path
+            else:
+                print(f"Generating the full frame: {ctx['region'].reason}")
+
+    # Present spans are preprocessed and generated on their own, absent ones never are
+    ctx["piece_videos"] = [ctx["video_path"]]
+    if ctx["spans"] is not None:
+        with metrics.stage("presence_cut"):
+            ctx["piece_videos"] = presence.cut_spans(ctx["video_path"], ctx["spans"], temp_path / "spans",
+                                                     probe_media(ctx["video_path"]))
+        print(f"Skipping {ctx['presence']['skipped_fraction']:.0%} of frames without a face")
+    return ctx
+
+def track_mask(ctx: dict) -> Path:
+    """
+    Character mask of a low-resolution preprocessing pass over the first
+    photo, for face tracking without OpenCV (see face_region.py).
+    """
+    work_dir = ctx["temp_path"] / "face_track"
+    run_preprocessing(ctx["video_path"], ctx["photo_paths"][:1], work_dir, TRACK_RESOLUTION, ctx["plan"]["fps"])
+    return work_dir / "processed_video" / "src_mask.mp4"
 
-    result = subprocess.run(cmd, cwd=WAN_DIR, capture_output=True, text=True)
-    if result.returncode != 0:
-        raise RuntimeError(f"Preprocessing failed: {result.stderr}")
-    return output_dir
-
-def run_generation(processed_dir: Path, output_path: Path):
-    """Run the video generation step."""
-    cmd = [
-        "python", "generate.py",
-        "--task", "animate-14B",
-        "--ckpt_dir", str(MODEL_DIR),
-        "--src_root_path", str(processed_dir),
-        "--refert_num", "1",
-        "--replace_flag",
-        "--use_relighting_lora"
-    ]
+def preprocess_stage(ctx: dict) -> dict:
+    """
+    Cut long videos (or each face-present span) into overlapping segments
+    and preprocess every segment in parallel, attaching every photo to
+    every segment. A resumed job restores the segments' preprocessing from
+    its checkpoint instead.
+    """
+    plan = ctx["plan"]
+    # A face crop is generated at its own (much smaller) resolution
+    resolution = ctx["region"].resolution if ctx["region"] and ctx["region"].active else tuple(plan["resolution"])
+    temp_path = ctx["temp_path"]
+
+    state = resume(ctx, "preprocess")
+    if state is not None:
+        ctx["pieces"] = [{
+            "segments": [tuple(segment) for segment in piece["segments"]],
+            "process_dirs": [[attach_reference(temp_path / work_dir / "processed_video", photo_path,
+                                               temp_path / work_dir / f"processed_{i}")
+                              for i, photo_path in enumerate(ctx["photo_paths"])]
+                             for work_dir in piece["work_dirs"]]
+        } for piece in state["pieces"]]
+        ctx["cache_hit"] = state["cache_hit"]
+        return ctx
+
+    ctx["pieces"] = []
+    work = []
+    for p, piece_video in enumerate(ctx["piece_videos"]):
+        piece_dir = temp_path if ctx["spans"] is None else temp_path / f"span_{p:03d}"
+        segments = plan_segments(probe_duration(piece_video), plan["segment_seconds"] or SEGMENT_SECONDS)
+        ctx["pieces"].append({"segments": segments, "process_dirs": []})
+        for index, segment_video in enumerate(cut_segments(piece_video, segments, piece_dir / "segments")):
+            work.append((p, segment_video, piece_dir / f"segment_{index:03d}"))
+
+    def preprocess_segment(index, item):
+        _, segment_video, work_dir = item
+        return run_preprocessing(segment_video, ctx["photo_paths"], work_dir, resolution, plan["fps"])
+
+    results = process_segments(preprocess_segment, work)
+    # pieces[piece]["process_dirs"][segment][photo]
+    for (p, _, _), (process_dirs, _) in zip(work, results):
+        ctx["pieces"][p]["process_dirs"].append(process_dirs)
+    ctx["cache_hit"] = all(cache_hit for _, cache_hit in results)
+
+    # The photo-side directories are rebuilt on resume, only processed_video is kept
+    work_dirs = [[] for _ in ctx["pieces"]]
+    for p, _, work_dir in work:
+        work_dirs[p].append(str(work_dir.relative_to(temp_path)))
+    save_checkpoint(ctx, "preprocess", [work_dir / "processed_video" for _, _, work_dir in work], {
+        "pieces": [{"segments": piece["segments"], "work_dirs": dirs} for piece, dirs in zip(ctx["pieces"], work_dirs)],
+        "cache_hit": ctx["cache_hit"]
+    })
+    return ctx
+
+def generate_stage(ctx: dict) -> dict:
+    """
+    Run generation, one output per photo. Only this stage touches the GPU
+    model; segmented outputs are crossfaded together, a face crop is blended
+    back into the full frames, and every output gets the source audio back.
+    """
+    temp_path = ctx["temp_path"]
+    ctx["output_paths"] = []
+    ctx["progress"].set_runs(len(ctx["photo_paths"]) * sum(len(piece["process_dirs"]) for piece in ctx["pieces"]))
+    for i in range(len(ctx["photo_paths"])):
+        output_path = temp_path / f"output_{i}.mp4"
+        if ctx["spans"] is None:
+            generated = generate_piece(ctx, ctx["pieces"][0], i, str(i))
+        else:
+            clips = [generate_piece(ctx, piece, i, f"{i}_span_{p:03d}") for p, piece in enumerate(ctx["pieces"])]
+            with metrics.stage("splice"):
+                generated = presence.splice(ctx["video_path"], ctx["spans"], clips, temp_path / f"spliced_{i}.mp4",
+                                            probe_media(ctx["video_path"]))
+        if ctx["region"] and ctx["region"].active:
+            with metrics.stage("composite"):
+                generated = ctx["region"].composite(generated, temp_path / f"composited_{i}.mp4")
+        if ctx["audio_path"] is not None:
+            with metrics.stage("remux"):
+                remux_audio(generated, ctx["audio_path"], output_path)
+        else:
+            os.replace(generated, output_path)
+        ctx["output_paths"].append(output_path)
+        ctx["metrics"].add_frames(probe_frames(output_path))
+
+        # Start uploading each output as soon as it is final
+        if ctx["upload"]:
+            ctx["uploads"].append(upload_async(output_path, output_key(ctx["job_id"], output_path.name)))
+    return ctx
+
+def generate_piece(ctx: dict, piece: dict, photo: int, name: str) -> Path:
+    """
+    Generate one piece of the video for one photo, crossfading its segments
+    together. With a slot-capable backend the segments are generated side
+    by side, each on the GPU group the scheduler hands it.
+    """
+    temp_path = ctx["temp_path"]
+    if len(piece["segments"]) == 1:
+        return generate_clip(ctx, piece["process_dirs"][0][photo], temp_path / f"generated_{name}.mp4")
+
+    work = [(process_dirs[photo], temp_path / f"output_{name}_segment_{s:03d}.mp4")
+            for s, process_dirs in enumerate(piece["process_dirs"])]
+    # Without this the first segment to reach the scheduler would take every GPU
+    add_extra_runs(len(work) - 1)
+    try:
+        clips = process_segments(lambda index, item: generate_clip(ctx, *item), work,
+                                 workers=gpu_slots(load_engine()))
+    finally:
+        add_extra_runs(1 - len(work))
+    with metrics.stage("stitch"):
+        return stitch_segments(clips, temp_path / f"stitched_{name}.mp4")
+
+def add_extra_runs(count: int):
+    global _extra_runs
+    with _extra_runs_lock:
+        _extra_runs += count
+
+def generate_clip(ctx: dict, process_dir: Path, clip: Path) -> Path:
+    """Run one generation, checkpointing the clip; a resumed job reuses clips already generated."""
+    unit = f"clip/{clip.name}"
+    if resume(ctx, unit) is None:
+        with progress.run():
+            run_generation(process_dir, clip, ctx["plan"]["fps"], ctx["plan"].get("memory"))
+        save_checkpoint(ctx, unit, [clip])
+    return clip
+
+def encode_stage(ctx: dict) -> dict:
+    """Build the job result: uploaded URLs, or the outputs inlined as base64."""
+    job_input = ctx["input"]
+    if ctx["upload"]:
+        with metrics.stage("upload"):
+            outputs = [{"output_url": upload.result()} for upload in ctx["uploads"]]
+        ctx["metrics"].add_bytes_out(sum(path.stat().st_size for path in ctx["output_paths"]))
+    else:
+        outputs = [inline_output(ctx, path) for path in ctx["output_paths"]]
 
-    result = subprocess.run(cmd, cwd=WAN_DIR, capture_output=True, text=True)
-    if result.returncode != 0:
-        raise RuntimeError(f"Generation failed: {result.stderr}")
-
-    # Find output file
-    output_files = list((WAN_DIR / "outputs").glob("*.mp4"))
-    if output_files:
-        latest = max(output_files, key=lambda p: p.stat().st_mtime)
-        import shutil
-        shutil.move(str(latest), str(output_path))
-        return output_path
+    if job_input.get("photo_urls"):
+        result = {"outputs": outputs}
     else:
-        raise RuntimeError("No output file generated")
+        result = dict(outputs[0])
+    result["preprocess_cache_hit"] = ctx["cache_hit"]
+    result["result_cache_hit"] = ctx["result_cache_hit"]
+    result["plan"] = ctx["plan"]
+    if ctx.get("region"):
+        result["region"] = ctx["region"].summary()
+    if ctx.get("presence"):
+        result["presence"] = ctx["presence"]
+    if ctx["resumed"]:
+        result["resumed"] = ctx["resumed"]
+    result["status"] = "success"
+
+    if job_input.get("output_format", "base64") != "base64" and not ctx["upload"]:
+        result["note"] = "URL output requires storage configuration (BUCKET_* environment variables)"
+    elif any("output_url" in output for output in outputs) and not ctx["upload"]:
+        result["note"] = f"Outputs over {INLINE_OUTPUT_MAX_BYTES // 1024**2}MB are uploaded instead of inlined"
+    ctx["result"] = result
+
+    with metrics.stage("result_cache"):
+        publish_result(ctx)
+    return ctx
+
+def inline_output(ctx: dict, path: Path) -> dict:
+    """One output as base64, or uploaded when it is over INLINE_OUTPUT_MAX_BYTES and storage is configured."""
+    size = path.stat().st_size
+    if size > INLINE_OUTPUT_MAX_BYTES and get_storage() is not None:
+        with metrics.stage("upload"):
+            url = upload_async(path, output_key(ctx["job_id"], path.name)).result()
+        ctx["metrics"].add_bytes_out(size)
+        return {"output_url": url}
+    with metrics.stage("base64"):
+        encoded = encode_output(path)
+    ctx["metrics"].add_bytes_out(len(encoded))
+    return {"output_base64": encoded}
+
+_pipeline = None
+
+def get_pipeline() -> StagedPipeline:
+    """Create the staged worker on first use."""
+    global _pipeline
+    if _pipeline is None:
+        # Sized for a slot backend, which the engine may only turn out to be once
+        # loaded; runs without slots still go one at a time (generate_clip)
+        _pipeline = StagedPipeline([
+            Stage("ingest", _stage("ingest", ingest_stage), concurrency=MAX_CONCURRENT_JOBS or GPU_COUNT + 1),
+            Stage("normalize", _stage("normalize", normalize_stage, skip_cached=True), concurrency=1),
+            Stage("preprocess", _stage("preprocess", preprocess_stage, skip_cached=True), concurrency=1),
+            Stage("generate", _stage("generate", generate_stage, skip_cached=True), concurrency=GPU_COUNT),
+            Stage("encode", _stage("encode", encode_stage), concurrency=1),
+        ])
+    return _pipeline
+
+def _stage(name: str, fn, skip_cached: bool = False):
+    """
+    Time a stage into the job's metrics and announce it on the job's progress.
+    With skip_cached, jobs answered from the result cache pass straight through.
+    """
+    if skip_cached:
+        def run(ctx, stage_fn=fn):
+            return ctx if ctx["result_cache_hit"] else stage_fn(ctx)
+        fn = run
+    return metrics.timed_stage(name, progress.tracked_stage(name, fn))
 
-def handler(job):
+async def handler(job):
     """
-    RunPod serverless handler.
+    RunPod serverless handler (streaming).
 
     Input format:
     {
@@ -175,85 +624,184 @@ def handler(job):
             # OR use base64:
             "video_base64": "...",           # Base64 encoded video
             "photo_base64": "...",           # Base64 encoded photo
+            # OR several faces for the same video (one output per photo):
+            "photo_urls": ["https://...", ...],
 
             "resolution": [1280, 720],       # Optional, default 1280x720
-            "output_format": "url"           # "url" or "base64", default "url"
+            "start": 2.0, "end": 7.0,        # Optional, seconds of the video to use
+            "target_fps": 24,                # Optional, generate at most this fps (default 30)
+            "max_frames": 120,               # Optional, cap on frames generated
+            "max_gpu_seconds": 600,          # Optional, tighter than the worker's budget
+            "region": "face",                # Optional, generate only a crop around the face (default "full")
+            "skip_absent": true,             # Optional, pass through spans with no face instead of generating them
+            "idempotency_key": "order-1234", # Optional, retries with the same key resume from its checkpoint
+            "memory_mode": "balanced",       # Optional, max_speed, balanced or min_vram (default: fastest that fits)
+            "output_format": "url"           # "url" or "base64", default "base64"
         }
     }
 
-    Output format:
+    The job is probed and costed first (admission.py); the first event after
+    "queued" carries the plan: the resolution and fps it will be generated
+    at, the estimate (GPU seconds, peak VRAM) and any downscaling applied to
+    fit the budget. A job that cannot fit is rejected before any GPU work.
+
+    While the job runs it yields progress events (visible on /stream):
+    {
+        "status": "in_progress",
+        "stage": "generate",                 # queued, admission, ingest, normalize, preprocess, generate, encode
+        "elapsed_seconds": 42.0,
+        "step": 9, "steps": 20,              # Sampling step, once sampling reports one
+        "run": 1, "runs": 3,                 # Generation run (segments x photos), if several
+        "eta_seconds": 37.2                  # Seconds left in the stage, once it can be estimated
+    }
+
+    and finally the result:
     {
         "output_url": "https://...",         # If output_format is "url"
         # OR
         "output_base64": "...",              # If output_format is "base64"
-        "status": "success"
+        # With photo_urls, one entry per photo instead:
+        "outputs": [{"output_base64": "..."}, ...],
+        "status": "success",
+        "plan": {...},                       # Admission plan and estimate
+        "region": {...},                     # With region "face": crop size and resolution, or why it fell back
+        "presence": {"skipped_fraction": 0.3, "generated_spans": [[0.0, 4.2], ...]},  # With skip_absent
+        "resumed": ["ingest", "preprocess", "clip/..."],  # Work restored from an earlier attempt's checkpoint
+        "metrics": {...}                     # Per-stage seconds, bytes, child processes, fps
     }
-    """
-    job_input = job["input"]
 
-    # Ensure model is downloaded (first run only)
-    ensure_model_downloaded()
-
-    # Create temp directory for this job
-    with tempfile.TemporaryDirectory() as temp_dir:
-        temp_path = Path(temp_dir)
-        process_dir = temp_path / "processed"
-        process_dir.mkdir()
+    A failed job yields {"error": "...", "log_tail": [...]} with the last
+    lines the job's child processes (or the in-process engine) wrote.
 
-        # Get video
-        video_path = temp_path / "input_video.mp4"
-        if "video_url" in job_input:
-            download_file(job_input["video_url"], video_path)
-        elif "video_base64" in job_input:
-            save_base64_file(job_input["video_base64"], video_path)
-        else:
-            return {"error": "No video provided. Use video_url or video_base64"}
-
-        # Get photo
-        photo_path = temp_path / "input_photo.jpg"
-        if "photo_url" in job_input:
-            download_file(job_input["photo_url"], photo_path)
-        elif "photo_base64" in job_input:
-            save_base64_file(job_input["photo_base64"], photo_path)
-        else:
-            return {"error": "No photo provided. Use photo_url or photo_base64"}
+    A repeat of a finished job is answered from the result cache
+    ("result_cache_hit": true) once its inputs are fetched. A request
+    identical to one still running on this worker waits for that job and
+    returns its result with "coalesced": true.
 
-        # Get resolution
-        resolution = tuple(job_input.get("resolution", [1280, 720]))
+    Finished work (inputs, preprocessing, each generated clip) of jobs
+    estimated at CHECKPOINT_MIN_GPU_SECONDS or more is checkpointed to the
+    network volume under the idempotency_key, or the request itself when
+    there is none. If the worker is lost or the job times out, the retry
+    restores it and carries on from there (see checkpoint.py).
 
-        # Output path
-        output_path = temp_path / "output.mp4"
+    Up to max_concurrent_jobs() jobs are in flight at once: while one job
+    holds the GPU, the next is downloaded and preprocessed. On multi-GPU
+    hosts with a slot backend, one job per GPU generates side by side.
+    """
+    job_input = job["input"]
 
-        try:
-            # Run preprocessing
-            run_preprocessing(video_path, photo_path, process_dir, resolution)
-
-            # Run generation
-            run_generation(process_dir, output_path)
-
-            # Return output
-            output_format = job_input.get("output_format", "base64")
-
-            if output_format == "base64":
-                with open(output_path, "rb") as f:
-                    output_base64 = base64.b64encode(f.read()).decode("utf-8")
-                return {
-                    "output_base64": output_base64,
-                    "status": "success"
-                }
-            else:
-                # For URL output, you'd need to upload to cloud storage
-                # This is a placeholder - implement based on your storage choice
-                with open(output_path, "rb") as f:
-                    output_base64 = base64.b64encode(f.read()).decode("utf-8")
-                return {
-                    "output_base64": output_base64,
-                    "status": "success",
-                    "note": "URL output requires cloud storage configuration"
-                }
+    error = validate_input(job_input)
+    if error:
+        yield {"error": error}
+        return
 
-        except Exception as e:
-            return {"error": str(e), "status": "failed"}
+    # An identical request is already running here: share its result instead of running it again.
+    # Hashing inline base64 inputs takes a while, so it stays off the loop other jobs stream on
+    loop = asyncio.get_running_loop()
+    key = await loop.run_in_executor(None, request_key, job_input)
+    if key in _running:
+        yield {"status": "in_progress", "stage": "coalesced", "elapsed_seconds": 0.0, "stage_seconds": 0.0}
+        result = dict(await asyncio.shield(_running[key]))
+        result["coalesced"] = True
+        yield result
+        return
 
-# Start the serverless worker
-runpod.serverless.start({"handler": handler})
+    # Progress events come from pipeline threads; hand them to this loop
+    events = asyncio.Queue()
+    job_id = job.get("id") or uuid.uuid4().hex
+    job_progress = progress.JobProgress(job_id, lambda event: loop.call_soon_threadsafe(events.put_nowait, event))
+    job_progress.set_stage("queued")
+
+    async def run_job():
+        global _jobs_in_flight
+        # Ensure model is downloaded (first run only)
+        await loop.run_in_executor(None, ensure_model_downloaded)
+
+        # Job directory lives until the last stage is done; finished work of long jobs is also
+        # checkpointed to the volume. A retry picks up the checkpoint an earlier attempt left
+        temp_path = Path(tempfile.mkdtemp())
+        job_checkpoint_key = checkpoint_key(job_input, key)
+        ctx = {
+            "input": job_input,
+            "job_id": job_id,
+            "metrics": metrics.JobMetrics(job_id),
+            "progress": job_progress,
+            "temp_path": temp_path,
+            "checkpoint": await loop.run_in_executor(
+                None, lambda: checkpoint.open_checkpoint(job_checkpoint_key, create=False)),
+            "resumed": [],
+            # URL output needs configured storage; otherwise fall back to base64
+            "upload": job_input.get("output_format", "base64") == "url" and get_storage() is not None,
+            "uploads": []
+        }
+        _jobs_in_flight += 1
+        try:
+            try:
+                # Probe and cost the job before it can take any GPU time; the plan goes out first
+                job_progress.set_stage("admission")
+                with ctx["metrics"].stage("admission"):
+                    state = resume(ctx, "admission")
+                    if state is not None and "memory" in state["plan"]:
+                        ctx["plan"] = state["plan"]
+                        # The retry may have landed on a different GPU: keep the plan, re-pick the memory mode
+                        ctx["plan"]["memory"] = select_mode(detect_vram_gb(), ctx["plan"]["resolution"],
+                                                            ctx["plan"]["memory"]["run_frames"], load_cost_model(),
+                                                            job_input.get("memory_mode") or MEMORY_MODE)
+                    else:
+                        ctx["plan"] = await loop.run_in_executor(None, admit_job, job_input, temp_path)
+                        if ctx["checkpoint"] is None and checkpoint.worth_checkpointing(
+                                ctx["plan"]["estimate"]["gpu_seconds"]):
+                            ctx["checkpoint"] = await loop.run_in_executor(
+                                None, checkpoint.open_checkpoint, job_checkpoint_key)
+                        save_checkpoint(ctx, "admission", state={"plan": ctx["plan"]})
+                ctx["metrics"].labels.update(resolution=ctx["plan"]["resolution"], fps=ctx["plan"]["fps"])
+                ctx["metrics"].last_stage_end = time.time()
+                events.put_nowait({**job_progress.snapshot(), "plan": ctx["plan"]})
+
+                # submit() blocks while the pipeline is full, so keep it off the event loop
+                future = await loop.run_in_executor(None, get_pipeline().submit, ctx)
+                await asyncio.wrap_future(future)
+                result = ctx["result"]
+            except AdmissionError as e:
+                result = {"error": str(e), "status": "rejected", "plan": e.plan}
+            except Exception as e:
+                result = {"error": str(e), "status": "failed", "log_tail": list(job_progress.tail)}
+            result["metrics"] = ctx["metrics"].finish(result["status"])
+            # Only a failed job keeps its checkpoint, for the retry to resume from
+            if ctx["checkpoint"] is not None and result["status"] != "failed":
+                ctx["checkpoint"].discard()
+            return result
+        finally:
+            _jobs_in_flight -= 1
+            if ctx["checkpoint"] is not None:
+                ctx["checkpoint"].release()
+            checkpoint.collect_garbage_async()
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+    task = _running[key] = asyncio.ensure_future(run_job())
+    task.add_done_callback(lambda _: _running.pop(key, None))
+    task.add_done_callback(lambda _: events.put_nowait(None))
+    while (event := await events.get()) is not None:
+        yield event
+    yield await task
+
+def concurrency_modifier(current_concurrency: int) -> int:
+    """Let runpod hand this worker up to max_concurrent_jobs() jobs at once."""
+    return max_concurrent_jobs()
+
+if __name__ == "__main__":
+    # Copy the weights to local disk in the background, in loader order, and
+    # load the model once they are staged so every later job starts warm.
+    # Jobs accepted meanwhile can already be fetched and preprocessed.
+    ensure_model_downloaded()
+    start_staging(MODEL_DIR)
+    threading.Thread(target=lambda: get_engine(staged_model_dir(MODEL_DIR), WAN_DIR, memory=engine_memory()),
+                     daemon=True).start()
+
+    # Start the serverless worker
+    # Progress events stream on /stream; /status and /runsync get all of them, result last
+    runpod.serverless.start({
+        "handler": handler,
+        "concurrency_modifier": concurrency_modifier,
+        "return_aggregate_stream": True
+    })
@@ -5,89 +5,56 @@ Model is loaded from /runpod-volume/Wan2.2-Animate-14B
 
 import os
 import runpod
-import subprocess
 import tempfile
-import base64
-import requests
+import threading
 from pathlib import Path
 
+import metrics
+from b64stream import decode_to_file, encode_file
+from engine import get_engine
+from ingest import fetch_all
+from preprocess import attach_reference, preprocess_video
+from preprocess_cache import get_cache
+from provision import ensure_model
+from segment import probe_frames
+from staging import staged_model_dir, start_staging
+
 # Paths - Model on network volume
 MODEL_DIR = Path("/runpod-volume/Wan2.2-Animate-14B")
-WAN_DIR = Path("/workspace/Wan2.2")
+WAN_DIR = Path(os.environ.get("WAN_DIR", "/workspace/Wan2.2"))
 
 def download_model_if_needed():
-    """Download model to network volume if not present."""
-    if not MODEL_DIR.exists():
-        print("Model not found on network volume. Downloading...")
-        subprocess.run([
-            "huggingface-cli", "download",
-            "Wan-AI/Wan2.2-Animate-14B",
-            "--local-dir", str(MODEL_DIR)
-        ], check=True)
-        print("Model downloaded successfully.")
-
-def download_file(url: str, dest: Path) -> Path:
-    """Download a file from URL to destination."""
-    response = requests.get(url, stream=True)
-    response.raise_for_status()
-    with open(dest, 'wb') as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            f.write(chunk)
-    return dest
+    """Download model to network volume if not present (or only partially present)."""
+    ensure_model(MODEL_DIR)
 
 def save_base64_file(data: str, dest: Path) -> Path:
-    """Save base64 encoded data to file."""
-    file_data = base64.b64decode(data)
-    with open(dest, 'wb') as f:
-        f.write(file_data)
-    return dest
-
-def run_preprocessing(video_path: Path, photo_path: Path, output_dir: Path, resolution: tuple):
-    """Run the preprocessing step."""
-    cmd = [
-        "python", str(WAN_DIR / "wan" / "modules" / "animate" / "preprocess" / "preprocess_data.py"),
-        "--ckpt_path", str(MODEL_DIR / "process_checkpoint"),
-        "--video_path", str(video_path),
-        "--refer_path", str(photo_path),
-        "--save_path", str(output_dir),
-        "--resolution_area", str(resolution[0]), str(resolution[1]),
-        "--iterations", "3",
-        "--k", "7",
-        "--w_len", "1",
-        "--h_len", "1",
-        "--replace_flag"
-    ]
+    """Save base64 encoded data to file, decoding in fixed-size chunks."""
+    return decode_to_file(data, dest)
 
-    result = subprocess.run(cmd, cwd=WAN_DIR, capture_output=True, text=True)
-    if result.returncode != 0:
-        raise RuntimeError(f"Preprocessing failed: {result.stderr}")
-    return output_dir
+def run_preprocessing(video_path: Path, photo_paths: list, work_dir: Path, resolution: tuple):
+    """
+    Run the preprocessing step.
 
-def run_generation(processed_dir: Path, output_path: Path):
-    """Run the video generation step."""
-    cmd = [
-        "python", "generate.py",
-        "--task", "animate-14B",
-        "--ckpt_dir", str(MODEL_DIR),
-        "--src_root_path", str(processed_dir),
-        "--refert_num", "1",
-        "--replace_flag",
-        "--use_relighting_lora"
+    The video is preprocessed once (or fetched from the cache) and then
+    combined with each photo. Returns one processed directory per photo and
+    whether the video stage was a cache hit.
+    """
+    video_dir = work_dir / "processed_video"
+    model_dir = staged_model_dir(MODEL_DIR, "process_checkpoint")
+    cache_hit = preprocess_video(WAN_DIR, model_dir, video_path, photo_paths[0], video_dir,
+                                 resolution, cache=get_cache())
+    process_dirs = [
+        attach_reference(video_dir, photo_path, work_dir / f"processed_{i}")
+        for i, photo_path in enumerate(photo_paths)
     ]
+    return process_dirs, cache_hit
 
-    result = subprocess.run(cmd, cwd=WAN_DIR, capture_output=True, text=True)
-    if result.returncode != 0:
-        raise RuntimeError(f"Generation failed: {result.stderr}")
-
-    # Find output file
-    output_files = list((WAN_DIR / "outputs").glob("*.mp4"))
-    if output_files:
-        latest = max(output_files, key=lambda p: p.stat().st_mtime)
-        import shutil
-        shutil.move(str(latest), str(output_path))
-        return output_path
-    else:
-        raise RuntimeError("No output file generated")
+def run_generation(processed_dir: Path, output_path: Path):
+    """Run the video generation step on the warm generation engine."""
+    with metrics.stage("model_load"):
+        engine = get_engine(staged_model_dir(MODEL_DIR), WAN_DIR)
+    with metrics.stage("sampling"):
+        return engine.generate(processed_dir, output_path)
 
 def handler(job):
     """
@@ -101,12 +68,18 @@ def handler(job):
             # OR use base64:
             "video_base64": "...",           # Base64 encoded video
             "photo_base64": "...",           # Base64 encoded photo
+            # OR several faces for the same video (one output per photo):
+            "photo_urls": ["https://...", ...],
 
             "resolution": [1280, 720],       # Optional, default 1280x720
         }
     }
+
+    The result carries a "metrics" field with per-stage seconds, bytes,
+    child-process usage and fps.
     """
     job_input = job["input"]
+    job_metrics = metrics.JobMetrics(job.get("id"))
 
     # Ensure model is available
     download_model_if_needed()
@@ -114,51 +87,77 @@ def handler(job):
     # Create temp directory for this job
     with tempfile.TemporaryDirectory() as temp_dir:
         temp_path = Path(temp_dir)
-        process_dir = temp_path / "processed"
-        process_dir.mkdir()
+
+        downloads = []
 
         # Get video
         video_path = temp_path / "input_video.mp4"
         if "video_url" in job_input:
-            download_file(job_input["video_url"], video_path)
+            downloads.append((job_input["video_url"], video_path))
         elif "video_base64" in job_input:
             save_base64_file(job_input["video_base64"], video_path)
         else:
             return {"error": "No video provided. Use video_url or video_base64"}
 
-        # Get photo
-        photo_path = temp_path / "input_photo.jpg"
-        if "photo_url" in job_input:
-            download_file(job_input["photo_url"], photo_path)
+        # Get photo(s)
+        photo_paths = []
+        if job_input.get("photo_urls"):
+            for i, photo_url in enumerate(job_input["photo_urls"]):
+                photo_paths.append(temp_path / f"input_photo_{i}.jpg")
+                downloads.append((photo_url, photo_paths[-1]))
+        elif "photo_url" in job_input:
+            photo_paths.append(temp_path / "input_photo.jpg")
+            downloads.append((job_input["photo_url"], photo_paths[-1]))
         elif "photo_base64" in job_input:
-            save_base64_file(job_input["photo_base64"], photo_path)
+            photo_paths.append(save_base64_file(job_input["photo_base64"], temp_path / "input_photo.jpg"))
         else:
-            return {"error": "No photo provided. Use photo_url or photo_base64"}
+            return {"error": "No photo provided. Use photo_url, photo_urls or photo_base64"}
 
         # Get resolution
         resolution = tuple(job_input.get("resolution", [1280, 720]))
 
-        # Output path
-        output_path = temp_path / "output.mp4"
-
         try:
-            # Run preprocessing
-            run_preprocessing(video_path, photo_path, process_dir, resolution)
-
-            # Run generation
-            run_generation(process_dir, output_path)
-
-            # Return output as base64
-            with open(output_path, "rb") as f:
-                output_base64 = base64.b64encode(f.read()).decode("utf-8")
-
-            return {
-                "output_base64": output_base64,
-                "status": "success"
-            }
+            with metrics.activate(job_metrics):
+                # Video and photos are fetched concurrently over pooled connections
+                with metrics.stage("ingest"):
+                    fetch_all(downloads)
+                job_metrics.add_bytes_in(sum(path.stat().st_size for path in [video_path, *photo_paths]))
+
+                # Run preprocessing once for the video, then attach each photo
+                with metrics.stage("preprocess"):
+                    process_dirs, cache_hit = run_preprocessing(video_path, photo_paths, temp_path, resolution)
+
+                # Run generation, one output per photo
+                outputs = []
+                for i, process_dir in enumerate(process_dirs):
+                    output_path = temp_path / f"output_{i}.mp4"
+                    with metrics.stage("generate"):
+                        run_generation(process_dir, output_path)
+                    job_metrics.add_frames(probe_frames(output_path))
+
+                    # Return output as base64
+                    with metrics.stage("base64"):
+                        outputs.append({"output_base64": encode_file(output_path)})
+                    job_metrics.add_bytes_out(len(outputs[-1]["output_base64"]))
+
+            if job_input.get("photo_urls"):
+                result = {"outputs": outputs}
+            else:
+                result = dict(outputs[0])
+            result["preprocess_cache_hit"] = cache_hit
+            result["status"] = "success"
 
         except Exception as e:
-            return {"error": str(e), "status": "failed"}
+            result = {"error": str(e), "status": "failed"}
+        result["metrics"] = job_metrics.finish(result["status"])
+        return result
+
+if __name__ == "__main__":
+    # Stage the weights to local disk and load the model in the background;
+    # the first job's download and preprocessing overlap with it
+    download_model_if_needed()
+    start_staging(MODEL_DIR)
+    threading.Thread(target=lambda: get_engine(staged_model_dir(MODEL_DIR), WAN_DIR), daemon=True).start()
 
-# Start the serverless worker
-runpod.serverless.start({"handler": handler})
+    # Start the serverless worker
+    runpod.serverless.start({"handler": handler})
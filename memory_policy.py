@@ -0,0 +1,122 @@
+"""
+Memory modes for generation.
+
+generate.py (and wan.WanAnimate) has three switches that trade speed for VRAM:
+
+    --offload_model        park the DiT on the CPU while it is not sampling
+    --t5_cpu               keep the T5 text encoder on the CPU
+    --convert_model_dtype  cast the weights to the param dtype (bf16) on load
+
+A memory mode is one combination, fastest first:
+
+    max_speed  - everything stays on the GPU
+    balanced   - T5 on the CPU, bf16 weights; slightly slower prompt encoding
+    min_vram   - balanced plus model offload; sampling is noticeably slower
+
+Peak VRAM is estimated from admission's cost model (vram_base_gb for the
+resident weights, vram_gb_per_mp for activations) less what the mode
+saves, plus the decoded frames a generation run holds until it is saved:
+
+    peak = vram_base_gb - saved_gb[mode]
+           + megapixels x vram_gb_per_mp
+           + megapixels x run frames x GB_PER_MP_FRAME
+
+select_mode() returns the fastest mode that fits the GPU with
+MEMORY_HEADROOM_GB to spare, or the one a job asked for ("memory_mode").
+It only does arithmetic on what it is given, so it can be checked for any
+card without one:
+
+    python memory_policy.py --vram 24 48 80 --resolution 1280 720 --frames 600
+"""
+
+import argparse
+import json
+import os
+
+MEMORY_MODE = os.environ.get("MEMORY_MODE", "auto")
+MEMORY_HEADROOM_GB = float(os.environ.get("MEMORY_HEADROOM_GB", "2"))
+
+MEMORY_MODES = {
+    "max_speed": {"offload_model": False, "t5_cpu": False, "convert_model_dtype": False},
+    "balanced": {"offload_model": False, "t5_cpu": True, "convert_model_dtype": True},
+    "min_vram": {"offload_model": True, "t5_cpu": True, "convert_model_dtype": True},
+}
+
+# VRAM each mode saves against max_speed (T5-XXL is ~11 GB in bf16), and its sampling slowdown
+SAVED_GB = {"max_speed": 0.0, "balanced": 12.0, "min_vram": 16.0}
+SAMPLING_FACTOR = {"max_speed": 1.0, "balanced": 1.02, "min_vram": 1.35}
+
+# Decoded float32 RGB output frames kept on the GPU until a run is saved
+GB_PER_MP_FRAME = 0.012
+
+
+def peak_vram_gb(mode: str, resolution: tuple, frames: int, model: dict) -> float:
+    """Estimated peak VRAM of one generation run of `frames` frames at resolution in mode."""
+    megapixels = resolution[0] * resolution[1] / 1e6
+    return (model["vram_base_gb"] - SAVED_GB[mode] + megapixels * model["vram_gb_per_mp"]
+            + megapixels * frames * GB_PER_MP_FRAME)
+
+
+def select_mode(vram_gb: float, resolution: tuple, frames: int, model: dict, requested: str = MEMORY_MODE,
+                headroom: float = MEMORY_HEADROOM_GB) -> dict:
+    """
+    Pick the memory mode for a run of `frames` frames at resolution on a GPU
+    with vram_gb. requested is a mode name, or "auto" for the fastest that
+    fits (min_vram if none does). The result carries the generation switches,
+    the estimate and whether it fits.
+    """
+    if requested in MEMORY_MODES:
+        mode = requested
+    else:
+        fitting = [name for name in MEMORY_MODES
+                   if peak_vram_gb(name, resolution, frames, model) + headroom <= vram_gb]
+        mode = fitting[0] if fitting else "min_vram"
+    peak = peak_vram_gb(mode, resolution, frames, model)
+    return {
+        "mode": mode,
+        **MEMORY_MODES[mode],
+        "peak_vram_gb": round(peak, 1),
+        "vram_gb": round(vram_gb, 1),
+        "run_frames": frames,
+        "fits": peak + headroom <= vram_gb
+    }
+
+
+def describe(memory: dict) -> str:
+    """The switches a memory selection turns on, for admission's actions."""
+    switches = [name for name in ("t5_cpu", "convert_model_dtype", "offload_model") if memory[name]]
+    return f"{memory['mode']} memory mode ({', '.join(switches) or 'all on GPU'})"
+
+
+def generate_args(memory: dict, num_gpus: int = 1) -> list:
+    """
+    generate.py arguments for a memory selection. Multi-GPU runs shard the
+    DiT and T5 with FSDP instead, so the switches only apply to one GPU.
+    """
+    if memory is None or num_gpus > 1:
+        return []
+    args = ["--offload_model", str(memory["offload_model"])]
+    if memory["t5_cpu"]:
+        args.append("--t5_cpu")
+    if memory["convert_model_dtype"]:
+        args.append("--convert_model_dtype")
+    return args
+
+
+def main():
+    from admission import load_cost_model
+
+    parser = argparse.ArgumentParser(description="Show the memory mode chosen per GPU size")
+    parser.add_argument("--vram", type=float, nargs="+", default=[24, 32, 40, 48, 80], help="GPU memory in GB")
+    parser.add_argument("--resolution", type=int, nargs=2, default=[1280, 720])
+    parser.add_argument("--frames", type=int, default=600, help="Frames per generation run")
+    parser.add_argument("--mode", default=MEMORY_MODE, help="Requested mode, or auto")
+    args = parser.parse_args()
+
+    model = load_cost_model()
+    for vram_gb in args.vram:
+        print(json.dumps(select_mode(vram_gb, tuple(args.resolution), args.frames, model, args.mode)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""
+Per-job instrumentation.
+
+A JobMetrics collects, for one job:
+
+    stages    - wall seconds per named stage (repeated stages add up)
+    bytes     - bytes fetched/decoded in and returned/uploaded out
+    children  - wall time and CPU time of every child process, read from
+                wait4() so concurrent children don't mix, and its peak RSS,
+                sampled from the child's own VmHWM while it runs
+    frames    - output frames, for frames per second of sampling
+
+Code that spawns children calls run_process(), which records into the
+job's metrics set with activate(). Finished jobs are appended to a JSONL
+log (METRICS_LOG, empty to disable) and, if METRICS_TEXTFILE is set,
+folded into a Prometheus textfile for the node exporter.
+"""
+
+import json
+import os
+import subprocess
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from pathlib import Path
+
+import progress
+
+METRICS_LOG = os.environ.get("METRICS_LOG", "/tmp/faceswap_metrics.jsonl")
+METRICS_TEXTFILE = os.environ.get("METRICS_TEXTFILE", "")
+# How often a running child's VmHWM is read; growth in the last interval before it exits is missed
+RSS_SAMPLE_INTERVAL = float(os.environ.get("METRICS_RSS_INTERVAL", "0.2"))
+
+_current = ContextVar("job_metrics", default=None)
+
+
+class JobMetrics:
+    """Timings, byte counts and child-process usage for one job."""
+
+    def __init__(self, job_id: str = None):
+        self.job_id = job_id
+        self.started_at = time.time()
+        self.finished_at = None
+        self.status = None
+        self.stages = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.frames = 0
+        self.children = []
+        # Job parameters worth keeping with the numbers (resolution, fps)
+        self.labels = {}
+        self.last_stage_end = self.started_at
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a block under name."""
+        start = time.time()
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + time.time() - start
+
+    def add_bytes_in(self, count: int):
+        with self._lock:
+            self.bytes_in += count
+
+    def add_bytes_out(self, count: int):
+        with self._lock:
+            self.bytes_out += count
+
+    def add_frames(self, count: int):
+        with self._lock:
+            self.frames += count
+
+    def record_child(self, name: str, seconds: float, rusage, peak_rss_bytes: int):
+        with self._lock:
+            self.children.append({
+                "name": name,
+                "seconds": seconds,
+                "cpu_seconds": rusage.ru_utime + rusage.ru_stime,
+                # Not rusage.ru_maxrss: it keeps the parent's high-water RSS across fork and exec
+                "peak_rss_bytes": peak_rss_bytes
+            })
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            total = (self.finished_at or time.time()) - self.started_at
+            processes = {}
+            for child in self.children:
+                entry = processes.setdefault(child["name"], {"count": 0, "seconds": 0.0, "cpu_seconds": 0.0,
+                                                             "peak_rss_mb": 0.0})
+                entry["count"] += 1
+                entry["seconds"] = round(entry["seconds"] + child["seconds"], 3)
+                entry["cpu_seconds"] = round(entry["cpu_seconds"] + child["cpu_seconds"], 3)
+                entry["peak_rss_mb"] = max(entry["peak_rss_mb"], round(child["peak_rss_bytes"] / 1024**2, 1))
+            sampling = self.stages.get("sampling")
+            return {
+                "job_id": self.job_id,
+                "status": self.status,
+                "total_seconds": round(total, 3),
+                "stages": {name: round(seconds, 3) for name, seconds in self.stages.items()},
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "frames": self.frames,
+                "fps": round(self.frames / sampling, 3) if self.frames and sampling else None,
+                "processes": processes,
+                "labels": dict(self.labels)
+            }
+
+    def finish(self, status: str) -> dict:
+        """Close the job, write it to the log and textfile, and return the summary."""
+        self.finished_at = time.time()
+        self.status = status
+        summary = self.as_dict()
+        _registry.observe(summary)
+        if METRICS_LOG:
+            try:
+                Path(METRICS_LOG).parent.mkdir(parents=True, exist_ok=True)
+                with _log_lock, open(METRICS_LOG, "a") as f:
+                    f.write(json.dumps({"timestamp": self.finished_at, **summary}) + "\n")
+            except OSError as e:
+                print(f"Could not write metrics log: {e}")
+        if METRICS_TEXTFILE:
+            try:
+                _registry.write_textfile(METRICS_TEXTFILE)
+            except OSError as e:
+                print(f"Could not write metrics textfile: {e}")
+        return summary
+
+
+_log_lock = threading.Lock()
+
+
+@contextmanager
+def activate(metrics: JobMetrics):
+    """Make metrics the target of run_process() and current() in this context."""
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+
+
+def current():
+    """The JobMetrics active in this context, or None."""
+    return _current.get()
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block into the active JobMetrics, if there is one."""
+    metrics = current()
+    if metrics is None:
+        yield None
+    else:
+        with metrics.stage(name):
+            yield metrics
+
+
+def timed_stage(name: str, fn):
+    """
+    Wrap a pipeline stage fn(ctx) so it runs with ctx["metrics"] active and
+    timed. Time spent waiting in the queue before the stage is added to
+    "queue_wait".
+    """
+    def run(ctx):
+        metrics = ctx["metrics"]
+        start = time.time()
+        with metrics._lock:
+            metrics.stages["queue_wait"] = metrics.stages.get("queue_wait", 0.0) + start - metrics.last_stage_end
+        try:
+            with activate(metrics), metrics.stage(name):
+                return fn(ctx)
+        finally:
+            metrics.last_stage_end = time.time()
+    return run
+
+
+def _process_name(cmd: list) -> str:
+    for arg in cmd:
+        if str(arg).endswith(".py"):
+            return Path(arg).name
+    return Path(str(cmd[0])).name
+
+
+def run_process(cmd: list, capture_output: bool = False, text: bool = True, **kwargs) -> subprocess.CompletedProcess:
+    """
+    subprocess.run() replacement that reaps the child with wait4() and
+    records its wall time, CPU time and peak RSS in the active JobMetrics.
+
+    Captured output is read line by line as it is written: each line goes to
+    the active JobProgress (progress.py), and only the last LOG_TAIL_LINES
+    lines of each stream are kept and returned.
+    """
+    pipe = subprocess.PIPE if capture_output else None
+    name = _process_name(cmd)
+    start = time.time()
+    proc = subprocess.Popen(cmd, stdout=pipe, stderr=pipe, text=text, **kwargs)
+
+    # Drain pipes on threads so the child never blocks on a full pipe
+    tails = {}
+    readers = []
+    for stream_name in ("stdout", "stderr"):
+        stream = getattr(proc, stream_name)
+        if stream is not None:
+            tail = tails[stream_name] = deque(maxlen=progress.LOG_TAIL_LINES)
+            # Readers run in a copy of this context so feed() reaches the job's progress
+            reader = threading.Thread(target=copy_context().run, args=(_read_lines, name, stream, tail, text))
+            reader.start()
+            readers.append(reader)
+
+    # Sample the child's peak RSS until it exits; it stays unreaped (so its pid can't be reused) until then
+    peak_rss = [0]
+    exited = threading.Event()
+    sampler = threading.Thread(target=_sample_peak_rss, args=(proc.pid, exited, peak_rss), daemon=True)
+    sampler.start()
+    os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+    exited.set()
+    sampler.join()
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    for reader in readers:
+        reader.join()
+    for stream in (proc.stdout, proc.stderr):
+        if stream is not None:
+            stream.close()
+
+    metrics = current()
+    if metrics is not None:
+        metrics.record_child(name, time.time() - start, rusage, peak_rss[0])
+    captured = {key: ("" if text else b"").join(tail) for key, tail in tails.items()}
+    return subprocess.CompletedProcess(cmd, proc.returncode, captured.get("stdout"), captured.get("stderr"))
+
+
+def _read_vm_hwm(pid: int) -> int:
+    """A process's own peak RSS in bytes (VmHWM), or 0 once it has exited or without /proc."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _sample_peak_rss(pid: int, exited: threading.Event, peak_rss: list):
+    # Popen returns after the exec, so every sample is of the child's own image, not the parent's
+    while True:
+        peak_rss[0] = max(peak_rss[0], _read_vm_hwm(pid))
+        if exited.wait(RSS_SAMPLE_INTERVAL):
+            return
+
+
+def _read_lines(name: str, stream, tail: deque, text: bool):
+    # Text mode uses universal newlines, so tqdm's carriage returns end lines too
+    for line in stream:
+        tail.append(line)
+        if text:
+            progress.feed(name, line)
+
+
+class _Registry:
+    """Process-wide totals rendered as Prometheus text format."""
+
+    def __init__(self):
+        self.jobs = {}
+        self.job_seconds = 0.0
+        self.stage_seconds = {}
+        self.bytes = {"in": 0, "out": 0}
+        self.frames = 0
+        self.process_cpu = {}
+        self.process_peak_rss = {}
+        self._lock = threading.Lock()
+
+    def observe(self, summary: dict):
+        with self._lock:
+            self.jobs[summary["status"]] = self.jobs.get(summary["status"], 0) + 1
+            self.job_seconds += summary["total_seconds"]
+            for name, seconds in summary["stages"].items():
+                self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+            self.bytes["in"] += summary["bytes_in"]
+            self.bytes["out"] += summary["bytes_out"]
+            self.frames += summary["frames"]
+            for name, process in summary["processes"].items():
+                self.process_cpu[name] = self.process_cpu.get(name, 0.0) + process["cpu_seconds"]
+                self.process_peak_rss[name] = max(self.process_peak_rss.get(name, 0.0), process["peak_rss_mb"])
+
+    def render(self) -> str:
+        with self._lock:
+            lines = []
+
+            def metric(name, kind, help_text, samples):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+                    lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+            metric("faceswap_jobs_total", "counter", "Jobs finished, by status.",
+                   [({"status": status}, count) for status, count in sorted(self.jobs.items())])
+            metric("faceswap_job_seconds_total", "counter", "Wall time of finished jobs.",
+                   [({}, round(self.job_seconds, 3))])
+            metric("faceswap_stage_seconds_total", "counter", "Wall time spent per stage.",
+                   [({"stage": name}, round(seconds, 3)) for name, seconds in sorted(self.stage_seconds.items())])
+            metric("faceswap_bytes_total", "counter", "Payload bytes in and out.",
+                   [({"direction": direction}, count) for direction, count in self.bytes.items()])
+            metric("faceswap_frames_total", "counter", "Output frames generated.", [({}, self.frames)])
+            metric("faceswap_process_cpu_seconds_total", "counter", "CPU time of child processes.",
+                   [({"process": name}, round(seconds, 3)) for name, seconds in sorted(self.process_cpu.items())])
+            metric("faceswap_process_peak_rss_megabytes", "gauge", "Largest peak RSS seen per child process.",
+                   [({"process": name}, mb) for name, mb in sorted(self.process_peak_rss.items())])
+            return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str):
+        """Write atomically so the node exporter never reads a partial file."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}")
+        partial.write_text(self.render())
+        os.replace(partial, path)
+
+
+_registry = _Registry()
@@ -0,0 +1,89 @@
+"""
+Input normalization.
+
+preprocess_data.py does per-frame work on every frame it is given, so the
+video is first cut down to what the job's admission plan needs:
+
+    trim   - only the planned window (request start/end, max_frames)
+    fps    - frames above the working fps are dropped
+    scale  - sources larger than the working resolution are scaled down
+
+A trim from the start of the video is a stream copy; anything else is one
+frame-accurate re-encode. The normalized video carries no audio: the source
+audio is cut to the same window separately so the final remux keeps the
+original track and timing.
+"""
+
+import math
+from pathlib import Path
+
+from segment import run_ffmpeg
+
+
+def working_size(width: int, height: int, area: int):
+    """Even size with the source's aspect ratio whose area fits area, or None if the source already fits."""
+    if width * height <= area:
+        return None
+    factor = math.sqrt(area / (width * height))
+    return max(2, int(width * factor) // 2 * 2), max(2, int(height * factor) // 2 * 2)
+
+
+def normalize_video(video_path: Path, output_path: Path, plan: dict) -> Path:
+    """Return the video preprocessing should see: video_path itself if nothing needs doing, else output_path."""
+    media = plan["source"]
+    start, end = plan["window"] or (0.0, media["duration"])
+    size = working_size(media["width"], media["height"], plan["resolution"][0] * plan["resolution"][1])
+    drop_frames = media["fps"] > plan["fps"] + 0.01
+
+    if plan["window"] is None and size is None and not drop_frames:
+        return Path(video_path)
+
+    if size is None and not drop_frames and start == 0:
+        # Trim only: cut the tail without touching a frame
+        run_ffmpeg([
+            "-i", str(video_path),
+            "-t", f"{end:.3f}",
+            "-map", "0:v:0",
+            "-c", "copy",
+            str(output_path)
+        ])
+        return Path(output_path)
+
+    filters = []
+    if drop_frames:
+        filters.append(f"fps={plan['fps']}")
+    if size is not None:
+        filters.append(f"scale={size[0]}:{size[1]}")
+    run_ffmpeg([
+        *(["-ss", f"{start:.3f}"] if start else []),
+        "-i", str(video_path),
+        "-t", f"{end - start:.3f}",
+        "-map", "0:v:0",
+        *(["-vf", ",".join(filters)] if filters else []),
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "16",
+        "-pix_fmt", "yuv420p",
+        str(output_path)
+    ])
+    return Path(output_path)
+
+
+def extract_audio(video_path: Path, output_path: Path, plan: dict):
+    """
+    Audio source for the final remux: video_path itself when the whole video
+    is used, the planned window of its audio (stream copy) otherwise, or None
+    if it has no audio.
+    """
+    if not plan["source"].get("audio"):
+        return None
+    if plan["window"] is None:
+        return Path(video_path)
+    start, end = plan["window"]
+    run_ffmpeg([
+        *(["-ss", f"{start:.3f}"] if start else []),
+        "-i", str(video_path),
+        "-t", f"{end - start:.3f}",
+        "-map", "0:a:0",
+        "-c:a", "copy",
+        str(output_path)
+    ])
+    return Path(output_path)
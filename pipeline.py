@@ -0,0 +1,90 @@
+"""
+Staged job pipeline.
+
+Jobs flow through a fixed list of stages connected by bounded queues. Every
+stage has its own worker threads, so downloading and preprocessing the next
+job overlaps GPU generation of the current one. A stage's `concurrency`
+caps how many jobs it works on at once (1 for the GPU stage), and a full
+queue blocks the stage feeding it, which is what provides backpressure.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class Stage:
+    """One pipeline step: fn(ctx) -> ctx, run by `concurrency` threads."""
+
+    def __init__(self, name: str, fn, concurrency: int = 1, queue_size: int = 1):
+        self.name = name
+        self.fn = fn
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.busy_seconds = 0.0
+        self.jobs = 0
+
+
+class StagedPipeline:
+    """Run contexts through stages in order; submit() returns a Future of the final ctx."""
+
+    def __init__(self, stages: list):
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=stage.queue_size) for stage in stages]
+        self._stats_lock = threading.Lock()
+        self._threads = []
+        for index, stage in enumerate(stages):
+            workers = []
+            for n in range(stage.concurrency):
+                thread = threading.Thread(target=self._run_stage, args=(index,),
+                                          name=f"{stage.name}-{n}", daemon=True)
+                thread.start()
+                workers.append(thread)
+            self._threads.append(workers)
+
+    def submit(self, ctx) -> Future:
+        """Queue a job; blocks while the first stage's queue is full."""
+        future = Future()
+        self.queues[0].put((ctx, future))
+        return future
+
+    def _run_stage(self, index: int):
+        stage = self.stages[index]
+        inbox = self.queues[index]
+        while True:
+            item = inbox.get()
+            if item is None:
+                return
+            ctx, future = item
+
+            start = time.time()
+            try:
+                ctx = stage.fn(ctx)
+            except BaseException as e:
+                future.set_exception(e)
+                continue
+            finally:
+                with self._stats_lock:
+                    stage.busy_seconds += time.time() - start
+                    stage.jobs += 1
+
+            if index + 1 < len(self.stages):
+                # Blocks while the next stage is saturated (backpressure)
+                self.queues[index + 1].put((ctx, future))
+            else:
+                future.set_result(ctx)
+
+    def stats(self) -> dict:
+        """Per-stage job counts and busy time."""
+        with self._stats_lock:
+            return {stage.name: {"jobs": stage.jobs, "busy_seconds": round(stage.busy_seconds, 3)}
+                    for stage in self.stages}
+
+    def shutdown(self):
+        """Drain the pipeline stage by stage and stop all worker threads."""
+        for inbox, workers in zip(self.queues, self._threads):
+            for _ in workers:
+                inbox.put(None)
+            for thread in workers:
+                thread.join()
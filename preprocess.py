@@ -0,0 +1,117 @@
+"""
+Preprocessing stages for Wan2.2-Animate replacement mode.
+
+preprocess_data.py derives the pose, face, background and mask clips from the
+video. With --replace_flag (and no --retarget_flag) the reference photo only
+contributes src_ref.png, so the work is split in two:
+
+    video stage  - run preprocess_data.py once per (video, resolution, params)
+    photo stage  - link the video artifacts next to a copy of each photo
+
+Several faces can then be swapped into the same video for the price of one
+preprocessing run. The video stage is cached by content hash when a
+PreprocessCache is supplied, and a long video stage can be split across
+several preprocess_data.py processes by frame range (see shard.py).
+"""
+
+import shutil
+from pathlib import Path
+
+from metrics import run_process
+from preprocess_cache import cache_key, link_or_copy
+from shard import preprocess_sharded
+
+# Preprocessing parameters (also part of the preprocessing cache key)
+PREPROCESS_PARAMS = {
+    "iterations": 3,
+    "k": 7,
+    "w_len": 1,
+    "h_len": 1,
+    "replace_flag": True
+}
+
+PREPROCESS_SCRIPT = Path("wan") / "modules" / "animate" / "preprocess" / "preprocess_data.py"
+REFERENCE_NAME = "src_ref.png"
+
+
+def build_preprocess_cmd(wan_dir: Path, model_dir: Path, video_path: Path, photo_path: Path,
+                         output_dir: Path, resolution: tuple, params: dict = PREPROCESS_PARAMS) -> list:
+    """Build the preprocess_data.py command line."""
+    cmd = [
+        "python", str(Path(wan_dir) / PREPROCESS_SCRIPT),
+        "--ckpt_path", str(Path(model_dir) / "process_checkpoint"),
+        "--video_path", str(video_path),
+        "--refer_path", str(photo_path),
+        "--save_path", str(output_dir),
+        "--resolution_area", str(resolution[0]), str(resolution[1]),
+        "--iterations", str(params["iterations"]),
+        "--k", str(params["k"]),
+        "--w_len", str(params["w_len"]),
+        "--h_len", str(params["h_len"])
+    ]
+    if params.get("fps"):
+        cmd += ["--fps", str(params["fps"])]
+    if params["replace_flag"]:
+        cmd.append("--replace_flag")  # Use replacement mode for face swapping
+    return cmd
+
+
+def run_preprocessing(wan_dir: Path, model_dir: Path, video_path: Path, photo_path: Path,
+                      output_dir: Path, resolution: tuple, capture_output: bool = True,
+                      params: dict = PREPROCESS_PARAMS) -> Path:
+    """Run preprocess_data.py over one video/photo pair."""
+    cmd = build_preprocess_cmd(wan_dir, model_dir, video_path, photo_path, output_dir, resolution, params)
+
+    result = run_process(cmd, cwd=wan_dir, capture_output=capture_output)
+    if result.returncode != 0:
+        raise RuntimeError(f"Preprocessing failed: {result.stderr}")
+    return output_dir
+
+
+def video_cache_key(video_path: Path, resolution: tuple, params: dict = PREPROCESS_PARAMS) -> str:
+    """Cache key for the video-side artifacts (independent of the photo)."""
+    return cache_key([video_path], {**params, "resolution": list(resolution), "stage": "video"})
+
+
+def preprocess_video(wan_dir: Path, model_dir: Path, video_path: Path, photo_path: Path,
+                     video_dir: Path, resolution: tuple, cache=None, capture_output: bool = True,
+                     params: dict = PREPROCESS_PARAMS) -> bool:
+    """
+    Produce the photo-independent artifacts for a video in video_dir.
+
+    preprocess_data.py insists on a reference, so any one of the job's photos
+    is passed; its src_ref.png is dropped afterwards. Returns True on a cache hit.
+    """
+    key = video_cache_key(video_path, resolution, params) if cache is not None else None
+    if cache is not None and cache.fetch(key, video_dir):
+        print(f"Preprocessing cache hit: {key[:12]}")
+        return True
+
+    def run(clip, output_dir):
+        return run_preprocessing(wan_dir, model_dir, clip, photo_path, output_dir, resolution, capture_output, params)
+
+    video_dir = Path(video_dir)
+    if not preprocess_sharded(run, video_path, video_dir, video_dir.with_name(f"{video_dir.name}_shards")):
+        run(video_path, video_dir)
+    (Path(video_dir) / REFERENCE_NAME).unlink(missing_ok=True)
+
+    if cache is not None:
+        try:
+            cache.publish(key, video_dir)
+        except OSError as e:
+            print(f"Could not publish preprocessing cache entry: {e}")
+    return False
+
+
+def attach_reference(video_dir: Path, photo_path: Path, output_dir: Path) -> Path:
+    """Combine video artifacts with one reference photo into a generate.py src_root_path."""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for src in Path(video_dir).iterdir():
+        if src.is_dir():
+            shutil.copytree(src, output_dir / src.name, copy_function=link_or_copy, dirs_exist_ok=True)
+        else:
+            link_or_copy(src, output_dir / src.name)
+    # Same as the replace-mode pipeline: the reference is the photo itself
+    shutil.copy(photo_path, output_dir / REFERENCE_NAME)
+    return output_dir
@@ -0,0 +1,177 @@
+"""
+Content-addressed cache for preprocessing artifacts.
+
+Entries are keyed by a hash of the input file contents plus the preprocessing
+parameters, so repeated (video, photo, resolution) requests skip straight to
+generation. The cache lives on the network volume and is shared by every
+worker mounting it:
+
+    <root>/entries/<key>/   published entries (never modified in place)
+    <root>/tmp/             entries being built or removed
+    <root>/.lock            flock: shared while reading, exclusive to evict
+
+Entries are built in tmp/ and published with a single rename, so readers
+never see a partial directory. Each hit refreshes the entry mtime, and the
+least recently used entries are evicted once the byte budget is exceeded.
+With a ttl, entries older than ttl seconds are misses and evicted too. The
+same class backs the whole-result cache (result_cache.py).
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+CACHE_ROOT = os.environ.get("PREPROCESS_CACHE_DIR", "/runpod-volume/cache/preprocess")
+CACHE_MAX_BYTES = int(os.environ.get("PREPROCESS_CACHE_MAX_GB", "50")) * 1024**3
+HASH_CHUNK_SIZE = 1024 * 1024
+META_FILE = ".cache_meta.json"
+
+
+def hash_file(path: Path, digest=None):
+    """Feed a file's contents into a hashlib digest (a new sha256 by default)."""
+    digest = digest or hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest
+
+
+def cache_key(files: list, params: dict) -> str:
+    """Hash input file contents and parameters into a cache key."""
+    digest = hashlib.sha256()
+    for path in files:
+        hash_file(path, digest)
+        digest.update(b"\0")
+    digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def link_or_copy(src, dst):
+    """Hard link when on the same filesystem, copy otherwise."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class PreprocessCache:
+    """Shared, size-bounded LRU cache of preprocessing output directories."""
+
+    def __init__(self, root: Path = CACHE_ROOT, max_bytes: int = CACHE_MAX_BYTES, ttl: float = 0):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries_dir = self.root / "entries"
+        self.tmp_dir = self.root / "tmp"
+        self.entries_dir.mkdir(parents=True, exist_ok=True)
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.lock_path = self.root / ".lock"
+
+    @contextmanager
+    def _lock(self, exclusive: bool):
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def fetch(self, key: str, dest: Path) -> bool:
+        """Materialize a cached entry into dest. Returns False on a miss."""
+        entry = self.entries_dir / key
+        with self._lock(exclusive=False):
+            if not entry.is_dir() or self._expired(entry):
+                return False
+            dest = Path(dest)
+            dest.mkdir(parents=True, exist_ok=True)
+            for src in entry.iterdir():
+                if src.name == META_FILE:
+                    continue
+                if src.is_dir():
+                    shutil.copytree(src, dest / src.name, copy_function=link_or_copy, dirs_exist_ok=True)
+                else:
+                    link_or_copy(src, dest / src.name)
+            os.utime(entry)
+        return True
+
+    def publish(self, key: str, src_dir: Path):
+        """Copy a finished preprocessing directory into the cache atomically."""
+        entry = self.entries_dir / key
+        if entry.exists():
+            if not self._expired(entry):
+                return
+            # fetch() already misses on it; clear it out so this entry can take its place
+            self.evict()
+
+        staging = self.tmp_dir / f"{key}.{uuid.uuid4().hex}"
+        shutil.copytree(src_dir, staging)
+        meta = {"key": key, "bytes": _dir_size(staging), "created": time.time()}
+        (staging / META_FILE).write_text(json.dumps(meta))
+
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            # Another worker published the same key first
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        self.evict()
+
+    def _entry_meta(self, entry: Path) -> dict:
+        try:
+            return json.loads((entry / META_FILE).read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _entry_bytes(self, entry: Path) -> int:
+        return self._entry_meta(entry).get("bytes") or _dir_size(entry)
+
+    def _expired(self, entry: Path) -> bool:
+        if not self.ttl:
+            return False
+        created = self._entry_meta(entry).get("created") or entry.stat().st_mtime
+        return time.time() - created > self.ttl
+
+    def evict(self):
+        """Remove expired entries, then least recently used ones until the cache fits its budget."""
+        with self._lock(exclusive=True):
+            entries = []
+            for entry in self.entries_dir.iterdir():
+                try:
+                    entries.append((entry.stat().st_mtime, self._entry_bytes(entry), entry))
+                except FileNotFoundError:
+                    continue
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in sorted(entries):
+                if total <= self.max_bytes and not self._expired(entry):
+                    continue
+                # Unpublish with a rename first so nobody reads a half-deleted entry
+                trash = self.tmp_dir / f"evict.{entry.name}.{uuid.uuid4().hex}"
+                try:
+                    os.rename(entry, trash)
+                except OSError:
+                    continue
+                shutil.rmtree(trash, ignore_errors=True)
+                total -= size
+                print(f"Evicted {self.root.name} cache entry {entry.name[:12]} ({size // (1024**2)}MB)")
+
+
+def get_cache(root: Path = None):
+    """Return the preprocessing cache, or None when disabled or unavailable."""
+    if os.environ.get("PREPROCESS_CACHE", "1") == "0":
+        return None
+    try:
+        return PreprocessCache(Path(root or CACHE_ROOT))
+    except OSError as e:
+        print(f"Preprocessing cache unavailable: {e}")
+        return None
@@ -0,0 +1,138 @@
+"""
+Face-presence spans.
+
+Cutaways, B-roll and intros with nobody on screen gain nothing from
+generation. With "skip_absent": true the per-frame face boxes
+(face_region.track_faces) split the working video into spans:
+
+    present  - frames with a face, padded by PRESENCE_PAD_SECONDS on each
+               side; each span is cut out frame-accurately, preprocessed and
+               generated on its own
+    absent   - runs without a face lasting at least PRESENCE_MIN_SKIP_SECONDS;
+               shorter gaps (detector misses, frames between detections)
+               are generated with their neighbours
+
+splice() rebuilds the whole timeline frame by frame: generated frames for
+present spans, the untouched frames for absent ones. The frame count never
+changes, so the original audio still lines up in the final remux.
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+
+from face_region import FrameWriter, read_frames
+
+SKIP_ABSENT = os.environ.get("SKIP_ABSENT", "0") == "1"
+PRESENCE_MIN_SKIP_SECONDS = float(os.environ.get("PRESENCE_MIN_SKIP_SECONDS", "1.0"))
+PRESENCE_PAD_SECONDS = float(os.environ.get("PRESENCE_PAD_SECONDS", "0.25"))
+
+# Settings that change a skip_absent output (part of the result cache key)
+PRESENCE_PARAMS = {
+    "min_skip_seconds": PRESENCE_MIN_SKIP_SECONDS,
+    "pad_seconds": PRESENCE_PAD_SECONDS
+}
+
+
+def presence_spans(boxes: np.ndarray, fps: float, min_skip: float = PRESENCE_MIN_SKIP_SECONDS,
+                   pad: float = PRESENCE_PAD_SECONDS) -> list:
+    """Split frames into (start, end, present) spans, end exclusive, from per-frame boxes (NaN = no face)."""
+    present = ~np.isnan(boxes[:, 0])
+    frames = len(present)
+    if frames == 0:
+        return []
+    if not present.any():
+        return [(0, frames, False)]
+
+    pad_frames = int(round(pad * fps))
+    if pad_frames:
+        present = np.convolve(present.astype(int), np.ones(2 * pad_frames + 1, dtype=int), mode="same") > 0
+
+    edges = np.flatnonzero(np.diff(present.astype(np.int8))) + 1
+    starts = np.concatenate([[0], edges])
+    ends = np.concatenate([edges, [frames]])
+
+    # An absent run too short to be worth a cut is generated with its neighbours
+    min_frames = max(1, int(round(min_skip * fps)))
+    spans = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        is_present = bool(present[start]) or end - start < min_frames
+        if spans and spans[-1][2] == is_present:
+            spans[-1] = (spans[-1][0], end, is_present)
+        else:
+            spans.append((start, end, is_present))
+    return spans
+
+
+def skipped_fraction(spans: list) -> float:
+    frames = sum(end - start for start, end, _ in spans)
+    return sum(end - start for start, end, present in spans if not present) / frames if frames else 0.0
+
+
+def summary(spans: list, fps: float) -> dict:
+    """What the result reports: the share of frames passed through and the spans that were generated."""
+    return {
+        "skipped_fraction": round(skipped_fraction(spans), 3),
+        "generated_spans": [[round(start / fps, 3), round(end / fps, 3)] for start, end, present in spans if present]
+    }
+
+
+def _span_index(spans: list) -> np.ndarray:
+    """Per frame: the index of its present span, or -1 for absent frames."""
+    owner = np.full(spans[-1][1] if spans else 0, -1)
+    for index, (start, end, _) in enumerate([span for span in spans if span[2]]):
+        owner[start:end] = index
+    return owner
+
+
+def cut_spans(video_path: Path, spans: list, out_dir: Path, media: dict) -> list:
+    """Write each present span of video_path to its own clip in one decoding pass; returns the clips in order."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    owner = _span_index(spans)
+    clips = [out_dir / f"span_{index:03d}.mp4" for index in range(owner.max(initial=-1) + 1)]
+    writer, current = None, -1
+    try:
+        for i, frame in enumerate(read_frames(video_path, media["width"], media["height"])):
+            index = owner[i] if i < len(owner) else -1
+            if index != current:
+                if writer is not None:
+                    writer.close()
+                writer = FrameWriter(clips[index], media["width"], media["height"], media["fps"]) if index >= 0 else None
+                current = index
+            if writer is not None:
+                writer.write(frame)
+        if writer is not None:
+            writer.close()
+    except Exception:
+        if writer is not None:
+            writer.abort()
+        raise
+    return clips
+
+
+def splice(video_path: Path, spans: list, clips: list, output_path: Path, media: dict) -> Path:
+    """
+    Rebuild the full timeline of video_path: frames of present spans come
+    from their generated clips (scaled and resampled to match), all others
+    from video_path itself. A clip that runs short is filled from the source.
+    """
+    owner = _span_index(spans)
+    generated, current = None, -1
+    with FrameWriter(output_path, media["width"], media["height"], media["fps"]) as writer:
+        for i, frame in enumerate(read_frames(video_path, media["width"], media["height"])):
+            index = owner[i] if i < len(owner) else -1
+            if index != current:
+                if generated is not None:
+                    generated.close()
+                generated = None
+                if index >= 0:
+                    generated = read_frames(clips[index], media["width"], media["height"], fps=media["fps"])
+                current = index
+            if generated is not None:
+                frame = next(generated, frame)
+            writer.write(frame)
+    if generated is not None:
+        generated.close()
+    return Path(output_path)
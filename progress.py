@@ -0,0 +1,234 @@
+"""
+Live job progress.
+
+A JobProgress follows one job through its stages and turns child process
+output into progress events:
+
+    stage     - the pipeline stage the job is in (queued, ingest, ...)
+    step      - sampling step and total, parsed from tqdm bars
+    eta       - seconds left in the current stage, from the step rate and
+                the durations of the generation runs already finished
+
+run_process() (metrics.py) hands every output line to feed(), which reaches
+the JobProgress set with activate() in the calling context. Work done in
+this process (the in-process engine) reaches it the same way, through
+tracked_tqdm() bars and a LogFeed logging handler. Only the last
+LOG_TAIL_LINES lines are kept, for error reports. Events go to the
+on_event callback, at most one step event per PROGRESS_INTERVAL seconds.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+LOG_TAIL_LINES = int(os.environ.get("LOG_TAIL_LINES", "200"))
+PROGRESS_INTERVAL = float(os.environ.get("PROGRESS_INTERVAL", "1.0"))
+
+# tqdm: " 45%|████▌     | 9/20 [00:30<00:37,  3.41s/it]"
+_TQDM = re.compile(r"(\d+)/(\d+) \[")
+
+_current = ContextVar("job_progress", default=None)
+
+
+class JobProgress:
+    """Stage, sampling step and ETA of one job, reported through on_event(dict)."""
+
+    def __init__(self, job_id: str = None, on_event=None, tail_lines: int = LOG_TAIL_LINES):
+        self.job_id = job_id
+        self.on_event = on_event
+        self.started_at = time.time()
+        self.stage = None
+        self.stage_started_at = self.started_at
+        self.step = 0
+        self.total = 0
+        self.runs_done = 0
+        self.runs_total = 0
+        self.tail = deque(maxlen=tail_lines)
+        self._run_seconds = []
+        self._run_started_at = None
+        self._runs_active = 0
+        self._step_seconds = None
+        self._last_step_at = None
+        self._last_emit = 0.0
+        self._lock = threading.Lock()
+
+    def set_stage(self, name: str):
+        with self._lock:
+            self.stage = name
+            self.stage_started_at = time.time()
+            self.step = self.total = 0
+            self.runs_done = self.runs_total = 0
+            self._run_seconds = []
+            self._run_started_at = None
+            self._runs_active = 0
+            self._step_seconds = self._last_step_at = None
+        self._emit(force=True)
+
+    def set_runs(self, total: int):
+        """Declare how many generation runs (segments x photos) the stage will make."""
+        with self._lock:
+            self.runs_total = total
+
+    @contextmanager
+    def run(self):
+        """Mark one generation run, so later runs can be estimated from it. Runs may overlap."""
+        started = time.time()
+        with self._lock:
+            self._run_started_at = started
+            self._runs_active += 1
+            self.step = self.total = 0
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._run_seconds.append(time.time() - started)
+                self._runs_active -= 1
+                if not self._runs_active:
+                    self._run_started_at = None
+                self.runs_done += 1
+            self._emit(force=True)
+
+    def feed(self, process: str, line: str):
+        """Take one line of child output: keep it in the tail and parse progress from it."""
+        line = line.rstrip()
+        if not line:
+            return
+        self.tail.append(f"[{process}] {line}")
+        match = _TQDM.search(line)
+        if match is None:
+            return
+        step, total = int(match.group(1)), int(match.group(2))
+        now = time.time()
+        with self._lock:
+            if step > self.step and self._last_step_at is not None:
+                per_step = (now - self._last_step_at) / (step - self.step)
+                # Smooth the rate; the first steps include warm-up
+                self._step_seconds = per_step if self._step_seconds is None else \
+                    0.7 * self._step_seconds + 0.3 * per_step
+            if step != self.step or total != self.total:
+                self._last_step_at = now
+            self.step, self.total = step, total
+        self._emit()
+
+    def eta(self):
+        """Seconds left in the current stage, or None if there is nothing to go on yet."""
+        with self._lock:
+            remaining = 0.0
+            known = False
+            if self.total and self._step_seconds is not None:
+                remaining += (self.total - self.step) * self._step_seconds
+                known = True
+            elif self._runs_active and self._run_seconds:
+                # No step rate (runs overlapping, or silent): the running ones take an average run
+                average = sum(self._run_seconds) / len(self._run_seconds)
+                remaining += max(0.0, average - (time.time() - self._run_started_at))
+            runs_left = self.runs_total - self.runs_done - self._runs_active
+            if runs_left > 0:
+                if self._run_seconds:
+                    remaining += runs_left * sum(self._run_seconds) / len(self._run_seconds)
+                elif self._run_started_at and known:
+                    # Assume the other runs take as long as this one will
+                    remaining += runs_left * (time.time() - self._run_started_at + remaining)
+                else:
+                    return None
+            return round(remaining, 1) if known or self._run_seconds else None
+
+    def snapshot(self) -> dict:
+        eta = self.eta()
+        with self._lock:
+            event = {
+                "status": "in_progress",
+                "stage": self.stage,
+                "elapsed_seconds": round(time.time() - self.started_at, 1),
+                "stage_seconds": round(time.time() - self.stage_started_at, 1)
+            }
+            if self.runs_total > 1:
+                event["run"] = min(self.runs_done + 1, self.runs_total)
+                event["runs"] = self.runs_total
+            if self.total:
+                event["step"] = self.step
+                event["steps"] = self.total
+            if eta is not None:
+                event["eta_seconds"] = eta
+            return event
+
+    def _emit(self, force: bool = False):
+        if self.on_event is None:
+            return
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_emit < PROGRESS_INTERVAL:
+                return
+            self._last_emit = now
+        self.on_event(self.snapshot())
+
+
+@contextmanager
+def activate(progress: JobProgress):
+    """Make progress the target of feed() in this context."""
+    token = _current.set(progress)
+    try:
+        yield progress
+    finally:
+        _current.reset(token)
+
+
+def current():
+    """The JobProgress active in this context, or None."""
+    return _current.get()
+
+
+def feed(process: str, line: str):
+    """Pass a line of child output to the active JobProgress, if there is one."""
+    progress = current()
+    if progress is not None:
+        progress.feed(process, line)
+
+
+def tracked_tqdm(tqdm_cls, process: str):
+    """A tqdm subclass that also feeds every redraw of its bar to the active JobProgress."""
+    class TrackedTqdm(tqdm_cls):
+        def display(self, msg=None, pos=None):
+            feed(process, str(self))
+            return super().display(msg, pos)
+    return TrackedTqdm
+
+
+class LogFeed(logging.Handler):
+    """Logging handler that feeds each record to the JobProgress active where it is logged."""
+
+    def __init__(self, process: str, level: int = logging.INFO):
+        super().__init__(level)
+        self.process = process
+
+    def emit(self, record):
+        try:
+            feed(self.process, self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+@contextmanager
+def run():
+    """Mark a generation run on the active JobProgress, if there is one."""
+    progress = current()
+    if progress is None:
+        yield None
+    else:
+        with progress.run():
+            yield progress
+
+
+def tracked_stage(name: str, fn):
+    """Wrap a pipeline stage fn(ctx) so it runs with ctx["progress"] active and announced."""
+    def stage(ctx):
+        progress = ctx["progress"]
+        progress.set_stage(name)
+        with activate(progress):
+            return fn(ctx)
+    return stage
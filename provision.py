@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Model provisioning on the network volume.
+
+Cold workers that start together coordinate through a lock file next to the
+model directory: one downloads, the others wait on the lock and then find
+the model complete. Downloading is parallel across files, each file resumes
+from its .part file, and every file is verified against the size and hash
+published by the hub (sha256 for LFS files, git blob sha1 otherwise) before
+being moved into place. The .download_complete marker is written only after
+every file has been verified, so a partial directory is never used.
+
+HF_ENDPOINT points at the hub (or a local stand-in), HF_TOKEN authenticates.
+
+    python provision.py /runpod-volume/Wan2.2-Animate-14B
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+from ingest import CHUNK_SIZE, TIMEOUT, get_session
+
+HF_ENDPOINT = os.environ.get("HF_ENDPOINT", "https://huggingface.co").rstrip("/")
+MODEL_REPO = os.environ.get("MODEL_REPO", "Wan-AI/Wan2.2-Animate-14B")
+PROVISION_WORKERS = int(os.environ.get("PROVISION_WORKERS", "8"))
+MARKER = ".download_complete"
+ATTEMPTS = 5
+
+
+def _headers() -> dict:
+    token = os.environ.get("HF_TOKEN")
+    return {"Authorization": f"Bearer {token}"} if token else {}
+
+
+def list_repo_files(repo: str = MODEL_REPO, revision: str = "main") -> list:
+    """List the repo's files with size and expected hash."""
+    url = f"{HF_ENDPOINT}/api/models/{repo}/tree/{revision}?recursive=true"
+    files = []
+    while url:
+        response = get_session().get(url, headers=_headers(), timeout=TIMEOUT)
+        response.raise_for_status()
+        for item in response.json():
+            if item.get("type") != "file":
+                continue
+            lfs = item.get("lfs")
+            files.append({
+                "path": item["path"],
+                "size": lfs["size"] if lfs else item["size"],
+                "sha256": lfs["oid"] if lfs else None,
+                "git_sha1": None if lfs else item.get("oid")
+            })
+        url = response.links.get("next", {}).get("url")
+    return files
+
+
+def _new_digest(entry: dict):
+    if entry["sha256"]:
+        return hashlib.sha256()
+    if entry["git_sha1"]:
+        digest = hashlib.sha1()
+        digest.update(f"blob {entry['size']}\0".encode())
+        return digest
+    return None
+
+
+def _expected_hex(entry: dict):
+    return entry["sha256"] or entry["git_sha1"]
+
+
+def download_repo_file(entry: dict, model_dir: Path, repo: str = MODEL_REPO, revision: str = "main"):
+    """Download one file to <path>.part (resuming if present), verify it, then move it into place."""
+    dest = Path(model_dir) / entry["path"]
+    if dest.exists() and dest.stat().st_size == entry["size"]:
+        # Only verified files are ever renamed into place
+        return
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    part = dest.with_name(dest.name + ".part")
+    url = f"{HF_ENDPOINT}/{repo}/resolve/{revision}/{entry['path']}"
+
+    digest = _new_digest(entry)
+    written = part.stat().st_size if part.exists() else 0
+    if written > entry["size"]:
+        written = 0
+
+    part.touch()
+    with open(part, "r+b") as f:
+        f.truncate(written)
+        # Hash what a previous attempt already wrote
+        if digest is not None:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+
+        for attempt in range(ATTEMPTS):
+            if written >= entry["size"]:
+                break
+            headers = {**_headers(), "Range": f"bytes={written}-"}
+            try:
+                with get_session().get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+                    response.raise_for_status()
+                    if written and response.status_code != 206:
+                        # Server ignored the range; start this file over
+                        f.seek(0)
+                        f.truncate()
+                        written = 0
+                        digest = _new_digest(entry)
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        f.write(chunk)
+                        written += len(chunk)
+                        if digest is not None:
+                            digest.update(chunk)
+            except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                    requests.Timeout) as e:
+                if attempt == ATTEMPTS - 1:
+                    raise
+                print(f"  {entry['path']}: interrupted at {written} bytes ({e}), resuming...")
+                time.sleep(2 ** attempt)
+
+    if written != entry["size"]:
+        raise RuntimeError(f"{entry['path']}: expected {entry['size']} bytes, got {written}")
+    if digest is not None and digest.hexdigest() != _expected_hex(entry):
+        part.unlink()
+        raise RuntimeError(f"{entry['path']}: checksum mismatch")
+    os.replace(part, dest)
+    print(f"  {entry['path']}: {entry['size'] / 1024**2:.1f}MB verified")
+
+
+def is_complete(model_dir: Path) -> bool:
+    """True once every file has been downloaded and verified."""
+    return (Path(model_dir) / MARKER).exists()
+
+
+def ensure_model(model_dir: Path, repo: str = MODEL_REPO, workers: int = PROVISION_WORKERS) -> Path:
+    """
+    Make sure model_dir holds a complete, verified copy of repo.
+
+    Takes an exclusive lock on the volume first; workers that lose the race
+    block on the lock and return as soon as the winner has finished.
+    """
+    model_dir = Path(model_dir)
+    if is_complete(model_dir):
+        return model_dir
+
+    model_dir.parent.mkdir(parents=True, exist_ok=True)
+    lock_path = model_dir.parent / f".{model_dir.name}.lock"
+    with open(lock_path, "a") as lock_file:
+        try:
+            fcntl.lockf(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            print("Another worker is provisioning the model, waiting...")
+            fcntl.lockf(lock_file, fcntl.LOCK_EX)
+        try:
+            if is_complete(model_dir):
+                print("Model provisioned by another worker.")
+                return model_dir
+
+            start = time.time()
+            entries = list_repo_files(repo)
+            total = sum(entry["size"] for entry in entries)
+            print(f"Provisioning {repo}: {len(entries)} files, {total / 1024**3:.1f}GB "
+                  f"({workers} parallel downloads)")
+            model_dir.mkdir(parents=True, exist_ok=True)
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(download_repo_file, entry, model_dir, repo) for entry in entries]
+                for future in futures:
+                    future.result()
+
+            elapsed = time.time() - start
+            (model_dir / MARKER).write_text(json.dumps({
+                "repo": repo,
+                "files": len(entries),
+                "bytes": total,
+                "seconds": round(elapsed, 1),
+                "completed": time.time()
+            }))
+            print(f"Model provisioned in {elapsed:.0f}s ({total / max(elapsed, 1e-6) / 1024**2:.0f}MB/s)")
+        finally:
+            fcntl.lockf(lock_file, fcntl.LOCK_UN)
+    return model_dir
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python provision.py MODEL_DIR")
+        sys.exit(1)
+    ensure_model(Path(sys.argv[1]))
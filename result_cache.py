@@ -0,0 +1,63 @@
+"""
+Whole-result cache.
+
+Retries, double submits and client timeouts send the same job again; each
+repeat would otherwise pay for a full generation. Finished outputs are
+stored on the network volume in a PreprocessCache (same publish, locking
+and LRU eviction) keyed by:
+
+    result_key()   - input file contents + every preprocessing and generation
+                     parameter + the admission plan (window, resolution, fps,
+                     segmenting), so any change that alters the output misses
+
+Entries expire after RESULT_CACHE_TTL_HOURS. A repeat is only detected once
+its inputs are fetched; identical requests that arrive while the first is
+still running are coalesced earlier, on request_key() (see handler.py).
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from preprocess_cache import HASH_CHUNK_SIZE, PreprocessCache, cache_key
+
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "/runpod-volume/cache/results")
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_GB", "50")) * 1024**3
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL_HOURS", "24")) * 3600
+
+
+def result_key(input_paths: list, params: dict) -> str:
+    """Cache key for a job's outputs: input contents plus everything that shapes the result."""
+    return cache_key(input_paths, {**params, "stage": "result"})
+
+
+def request_key(job_input: dict) -> str:
+    """
+    Hash of a request as sent, for spotting identical requests before any
+    input is fetched. Inline *_base64 inputs can run to tens of MB, so they
+    are hashed in chunks straight from the string instead of through the
+    JSON of the rest; it is still too slow to run on the event loop.
+    """
+    digest = hashlib.sha256()
+    params = {}
+    for name, value in sorted(job_input.items()):
+        if not (name.endswith("_base64") and isinstance(value, str)):
+            params[name] = value
+            continue
+        digest.update(f"{name}:{len(value)}:".encode("utf-8"))
+        for start in range(0, len(value), HASH_CHUNK_SIZE):
+            digest.update(value[start:start + HASH_CHUNK_SIZE].encode("utf-8"))
+    digest.update(json.dumps(params, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_result_cache(root: Path = None):
+    """Return the result cache, or None when disabled or unavailable."""
+    if os.environ.get("RESULT_CACHE", "1") == "0":
+        return None
+    try:
+        return PreprocessCache(Path(root or RESULT_CACHE_DIR), RESULT_CACHE_MAX_BYTES, ttl=RESULT_CACHE_TTL)
+    except OSError as e:
+        print(f"Result cache unavailable: {e}")
+        return None
@@ -0,0 +1,147 @@
+"""
+GPU slot scheduler.
+
+Treats the GPUs on a host as slots that generation jobs borrow. A job runs
+on a group of GPUs pinned with CUDA_VISIBLE_DEVICES: one GPU when there is
+enough work to keep every GPU busy with its own job (throughput), or several
+GPUs with Ulysses sequence parallelism when the queue is short and a single
+job should finish as fast as possible (latency).
+
+GPU_COUNT overrides device detection, which is also how tests mock a
+multi-GPU host.
+"""
+
+import os
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+
+# Group sizes generate.py accepts for --ulysses_size (must divide the 40 attention heads)
+SLOT_WIDTHS = (1, 2, 4, 8)
+MASTER_PORT_BASE = int(os.environ.get("MASTER_PORT_BASE", "29500"))
+
+
+def detect_gpu_count() -> int:
+    """Number of GPUs visible to this process (GPU_COUNT overrides)."""
+    if os.environ.get("GPU_COUNT"):
+        return int(os.environ["GPU_COUNT"])
+    visible = os.environ.get("CUDA_VISIBLE_DEVICES")
+    if visible is not None:
+        return len([device for device in visible.split(",") if device.strip()])
+    try:
+        result = subprocess.run(["nvidia-smi", "-L"], capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        return 1
+    count = sum(1 for line in result.stdout.splitlines() if line.startswith("GPU "))
+    return max(count, 1)
+
+
+class GpuScheduler:
+    """
+    Hand out groups of GPUs to jobs.
+
+    `pending` is an optional callable returning how many jobs the worker
+    currently holds (including ones still downloading or preprocessing);
+    together with the jobs already waiting here it decides the group size.
+    """
+
+    def __init__(self, num_gpus: int = None, pending=None, max_width: int = None):
+        self.num_gpus = num_gpus or detect_gpu_count()
+        self.max_width = min(max_width or self.num_gpus, self.num_gpus)
+        self.pending = pending
+        self.free = list(range(self.num_gpus))
+        self.active = 0
+        self.waiting = 0
+        self.jobs = 0
+        self.busy_gpu_seconds = 0.0
+        self.started_at = time.time()
+        self._cond = threading.Condition()
+
+    def choose_width(self, demand: int) -> int:
+        """GPUs per job for `demand` jobs competing for this host."""
+        share = self.num_gpus // max(demand, 1)
+        return max(w for w in SLOT_WIDTHS if w <= max(min(share, self.max_width), 1))
+
+    def _demand(self) -> int:
+        demand = self.active + self.waiting
+        if self.pending is not None:
+            demand = max(demand, self.pending())
+        return demand
+
+    def acquire(self, width: int = None) -> list:
+        """Block until a group of GPUs is free and return their indices."""
+        with self._cond:
+            self.waiting += 1
+            try:
+                while True:
+                    wanted = width or self.choose_width(self._demand())
+                    wanted = min(wanted, self.num_gpus)
+                    if len(self.free) >= wanted:
+                        gpus, self.free = self.free[:wanted], self.free[wanted:]
+                        self.active += 1
+                        return gpus
+                    self._cond.wait()
+            finally:
+                self.waiting -= 1
+
+    def release(self, gpus: list, seconds: float = 0.0):
+        with self._cond:
+            self.free = sorted(self.free + list(gpus))
+            self.active -= 1
+            self.jobs += 1
+            self.busy_gpu_seconds += seconds * len(gpus)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, width: int = None):
+        """Context manager form of acquire/release."""
+        gpus = self.acquire(width)
+        start = time.time()
+        try:
+            yield gpus
+        finally:
+            self.release(gpus, time.time() - start)
+
+    def run(self, fn, width: int = None):
+        """Call fn(gpus) on a free group of GPUs."""
+        with self.slot(width) as gpus:
+            return fn(gpus)
+
+    def stats(self) -> dict:
+        with self._cond:
+            elapsed = time.time() - self.started_at
+            return {
+                "gpus": self.num_gpus,
+                "free": len(self.free),
+                "active": self.active,
+                "waiting": self.waiting,
+                "jobs": self.jobs,
+                "utilization": round(self.busy_gpu_seconds / (elapsed * self.num_gpus), 3) if elapsed > 0 else 0.0
+            }
+
+
+def gpu_env(gpus: list, env: dict = None) -> dict:
+    """Environment for a child process pinned to gpus (indices into this process's visible GPUs)."""
+    env = dict(os.environ if env is None else env)
+    visible = [device.strip() for device in env.get("CUDA_VISIBLE_DEVICES", "").split(",") if device.strip()]
+    env["CUDA_VISIBLE_DEVICES"] = ",".join(visible[gpu] if gpu < len(visible) else str(gpu) for gpu in gpus)
+    return env
+
+
+def rendezvous_port(gpus: list) -> int:
+    """Rendezvous port for a torch.distributed group; unique per concurrent group."""
+    return MASTER_PORT_BASE + min(gpus)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(pending=None) -> GpuScheduler:
+    """Process-wide scheduler over all visible GPUs."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = GpuScheduler(pending=pending)
+        return _scheduler
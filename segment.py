@@ -0,0 +1,200 @@
+"""
+Temporal segmentation for long videos.
+
+A long clip is cut into overlapping segments with ffmpeg, each segment is
+preprocessed and generated independently, and the generated clips are
+stitched back together with a crossfade over each overlap. The original
+audio track is remuxed onto the result.
+
+    plan_segments()   -> [(start, end), ...] in seconds
+    cut_segments()    -> one re-encoded clip per segment (frame accurate)
+    process_segments()-> run a per-segment function on a worker pool
+    stitch_segments() -> crossfade the generated clips into one video
+    retime()          -> restore real speed to a clip generated at reduced fps
+    remux_audio()     -> copy the source audio onto the stitched video
+"""
+
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from pathlib import Path
+
+from metrics import run_process
+
+SEGMENT_SECONDS = float(os.environ.get("SEGMENT_SECONDS", "20"))
+SEGMENT_OVERLAP = float(os.environ.get("SEGMENT_OVERLAP", "1.0"))
+SEGMENT_WORKERS = int(os.environ.get("SEGMENT_WORKERS", "2"))
+SEGMENT_RETRIES = int(os.environ.get("SEGMENT_RETRIES", "1"))
+
+
+def run_ffmpeg(args: list):
+    """Run ffmpeg quietly, raising RuntimeError with its stderr on failure."""
+    cmd = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", *args]
+    result = run_process(cmd, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr}")
+
+
+def probe_duration(path: Path) -> float:
+    """Return a media file's duration in seconds."""
+    result = subprocess.run([
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        str(path)
+    ], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {result.stderr}")
+    return float(result.stdout.strip())
+
+
+def probe_frames(path: Path) -> int:
+    """Return the number of frames in a video's first video stream."""
+    result = subprocess.run([
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-count_packets",
+        "-show_entries", "stream=nb_read_packets",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        str(path)
+    ], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed: {result.stderr}")
+    return int(result.stdout.strip() or 0)
+
+
+def plan_segments(duration: float, segment_seconds: float = SEGMENT_SECONDS,
+                  overlap: float = SEGMENT_OVERLAP) -> list:
+    """Split [0, duration] into segments of at most segment_seconds that overlap by `overlap`."""
+    if segment_seconds <= 0 or duration <= segment_seconds:
+        return [(0.0, duration)]
+
+    step = segment_seconds - overlap
+    segments = []
+    start = 0.0
+    while True:
+        end = min(start + segment_seconds, duration)
+        segments.append((round(start, 3), round(end, 3)))
+        if end >= duration:
+            break
+        start += step
+
+    # Fold a sliver tail into the previous segment rather than generating it alone
+    if len(segments) > 1 and segments[-1][1] - segments[-1][0] < 2 * overlap:
+        segments[-2] = (segments[-2][0], segments[-1][1])
+        segments.pop()
+    return segments
+
+
+def cut_segments(video_path: Path, segments: list, out_dir: Path) -> list:
+    """Cut the video into the planned segments (video only, re-encoded for exact boundaries)."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if len(segments) == 1:
+        return [Path(video_path)]
+
+    clips = []
+    for i, (start, end) in enumerate(segments):
+        clip = out_dir / f"segment_{i:03d}.mp4"
+        run_ffmpeg([
+            "-ss", f"{start:.3f}",
+            "-i", str(video_path),
+            "-t", f"{end - start:.3f}",
+            "-an",
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", "16",
+            "-pix_fmt", "yuv420p",
+            str(clip)
+        ])
+        clips.append(clip)
+    return clips
+
+
+def process_segments(fn, items: list, workers: int = SEGMENT_WORKERS, retries: int = SEGMENT_RETRIES) -> list:
+    """
+    Run fn(index, item) for every segment on a thread pool and return the
+    results in order. A failing segment is retried on its own so one bad
+    segment does not throw away the others.
+    """
+    def run(index):
+        for attempt in range(retries + 1):
+            try:
+                return fn(index, items[index])
+            except Exception as e:
+                if attempt == retries:
+                    raise RuntimeError(f"Segment {index} failed: {e}") from e
+                print(f"Segment {index} failed ({e}), retrying...")
+
+    # Each worker runs in a copy of the caller's context (keeps the job's metrics active)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(copy_context().run, run, index) for index in range(len(items))]
+        return [future.result() for future in futures]
+
+
+def stitch_segments(clips: list, output_path: Path, overlap: float = SEGMENT_OVERLAP) -> Path:
+    """Join generated clips, crossfading across each overlap."""
+    if len(clips) == 1:
+        shutil.copy(clips[0], output_path)
+        return output_path
+
+    inputs = []
+    for clip in clips:
+        inputs += ["-i", str(clip)]
+
+    if overlap > 0:
+        durations = [probe_duration(clip) for clip in clips]
+        filters = []
+        previous = "[0:v]"
+        offset = 0.0
+        for i in range(1, len(clips)):
+            offset += durations[i - 1] - overlap
+            label = f"[v{i}]"
+            filters.append(f"{previous}[{i}:v]xfade=transition=fade:duration={overlap}:offset={offset:.3f}{label}")
+            previous = label
+        graph = ";".join(filters)
+    else:
+        previous = "[v]"
+        graph = "".join(f"[{i}:v]" for i in range(len(clips))) + f"concat=n={len(clips)}:v=1:a=0{previous}"
+
+    run_ffmpeg([
+        *inputs,
+        "-filter_complex", graph,
+        "-map", previous,
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "16",
+        "-pix_fmt", "yuv420p",
+        str(output_path)
+    ])
+    return output_path
+
+
+def retime(video_path: Path, fps: float, saved_fps: float) -> Path:
+    """
+    Fix the timestamps of a video whose frames were sampled at fps but saved
+    at saved_fps, so it plays at the original speed (stream copy, in place).
+    """
+    video_path = Path(video_path)
+    retimed = video_path.with_name(f"{video_path.stem}.retimed{video_path.suffix}")
+    run_ffmpeg([
+        "-itsscale", f"{saved_fps / fps:.6f}",
+        "-i", str(video_path),
+        "-c", "copy",
+        str(retimed)
+    ])
+    os.replace(retimed, video_path)
+    return video_path
+
+
+def remux_audio(video_path: Path, audio_source: Path, output_path: Path) -> Path:
+    """Copy video_path's picture and audio_source's audio (if any) into output_path."""
+    run_ffmpeg([
+        "-i", str(video_path),
+        "-i", str(audio_source),
+        "-map", "0:v:0",
+        "-map", "1:a:0?",
+        "-c:v", "copy",
+        "-c:a", "aac",
+        "-shortest",
+        str(output_path)
+    ])
+    return output_path
@@ -0,0 +1,168 @@
+"""
+Frame-sharded preprocessing.
+
+preprocess_data.py runs pose, face and mask extraction over the whole video
+in a single process, so a long clip leaves most of the host's cores idle. With
+PREPROCESS_SHARDS the video stage instead:
+
+    plan_shards()  - splits the frames into contiguous ranges, each widened by
+                     PREPROCESS_SHARD_OVERLAP frames on both sides so pose and
+                     mask smoothing have context at the cut
+    cut_shards()   - writes every shard clip in one ffmpeg decoding pass
+    pool_size()    - how many shards run side by side, one preprocess_data.py
+                     process each, given the cores and memory free
+    merge_shards() - drops the overlap frames again and concatenates each
+                     output clip, leaving the single directory generate.py
+                     --src_root_path expects
+
+PREPROCESS_SHARDS is a shard count or "auto"; the default of 1 keeps the
+single-process path.
+"""
+
+import os
+import shutil
+from pathlib import Path
+
+from segment import probe_frames, process_segments, run_ffmpeg
+
+PREPROCESS_SHARDS = os.environ.get("PREPROCESS_SHARDS", "1")
+PREPROCESS_SHARD_OVERLAP = int(os.environ.get("PREPROCESS_SHARD_OVERLAP", "8"))
+PREPROCESS_SHARD_MIN_FRAMES = int(os.environ.get("PREPROCESS_SHARD_MIN_FRAMES", "64"))
+PREPROCESS_SHARD_CPUS = int(os.environ.get("PREPROCESS_SHARD_CPUS", "4"))
+PREPROCESS_SHARD_MEMORY_GB = float(os.environ.get("PREPROCESS_SHARD_MEMORY_GB", "6"))
+
+
+def available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def available_memory_gb() -> float:
+    """MemAvailable from /proc/meminfo, or free physical pages where that is missing."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024 ** 2
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 1024 ** 3
+
+
+def pool_size(shards: int, cpus_per_shard: int = PREPROCESS_SHARD_CPUS,
+              memory_per_shard: float = PREPROCESS_SHARD_MEMORY_GB) -> int:
+    """How many shards fit side by side in the cores and memory free right now."""
+    by_cpu = available_cpus() // max(1, cpus_per_shard)
+    by_memory = int(available_memory_gb() // memory_per_shard) if memory_per_shard > 0 else shards
+    return max(1, min(shards, by_cpu, by_memory))
+
+
+def shard_count(frames: int, setting: str = PREPROCESS_SHARDS,
+                min_frames: int = PREPROCESS_SHARD_MIN_FRAMES) -> int:
+    """Shards for a video of `frames` frames; none shorter than min_frames."""
+    most = max(1, frames // max(1, min_frames))
+    if setting == "auto":
+        return min(most, pool_size(most))
+    return max(1, min(int(setting), most))
+
+
+def plan_shards(frames: int, shards: int, overlap: int = PREPROCESS_SHARD_OVERLAP) -> list:
+    """
+    Split [0, frames) into `shards` ranges. Each shard is (start, end,
+    keep_start, keep_end), end exclusive: it is preprocessed over
+    [start, end) and contributes [keep_start, keep_end) to the merge.
+    """
+    bounds = [round(i * frames / shards) for i in range(shards + 1)]
+    return [(max(0, keep_start - overlap), min(frames, keep_end + overlap), keep_start, keep_end)
+            for keep_start, keep_end in zip(bounds, bounds[1:])]
+
+
+def cut_shards(video_path: Path, shards: list, out_dir: Path) -> list:
+    """Write each shard's frame range to its own clip (video only, re-encoded for exact boundaries)."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    clips = [out_dir / f"shard_{i:03d}.mp4" for i in range(len(shards))]
+
+    # One decode feeding every shard's trim, rather than a full decode per shard
+    graph = [f"[0:v]split={len(shards)}" + "".join(f"[s{i}]" for i in range(len(shards)))]
+    args = []
+    for i, ((start, end, _, _), clip) in enumerate(zip(shards, clips)):
+        graph.append(f"[s{i}]trim=start_frame={start}:end_frame={end},setpts=PTS-STARTPTS[o{i}]")
+        args += ["-map", f"[o{i}]", "-c:v", "libx264", "-preset", "veryfast", "-crf", "16",
+                 "-pix_fmt", "yuv420p", str(clip)]
+    run_ffmpeg(["-i", str(video_path), "-filter_complex", ";".join(graph), *args])
+    return clips
+
+
+def merge_shards(shards: list, shard_dirs: list, output_dir: Path) -> Path:
+    """
+    Combine the shards' preprocess outputs into output_dir. Every video is
+    trimmed back to its shard's keep range and the pieces are concatenated;
+    anything else (src_ref.png) is taken from the first shard.
+
+    preprocess_data.py may resample to --fps, so keep ranges are converted
+    through each output's own frame count rather than assumed 1:1.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    for src in Path(shard_dirs[0]).iterdir():
+        if src.suffix != ".mp4":
+            if src.is_dir():
+                shutil.copytree(src, output_dir / src.name, dirs_exist_ok=True)
+            else:
+                shutil.copy(src, output_dir / src.name)
+            continue
+
+        inputs, graph = [], []
+        for i, ((start, end, keep_start, keep_end), shard_dir) in enumerate(zip(shards, shard_dirs)):
+            part = Path(shard_dir) / src.name
+            if not part.exists():
+                raise RuntimeError(f"Shard {i} produced no {src.name}")
+            ratio = probe_frames(part) / (end - start)
+            first = round((keep_start - start) * ratio)
+            last = round((keep_end - start) * ratio)
+            inputs += ["-i", str(part)]
+            graph.append(f"[{i}:v]trim=start_frame={first}:end_frame={last},setpts=PTS-STARTPTS[v{i}]")
+        graph.append("".join(f"[v{i}]" for i in range(len(shard_dirs))) + f"concat=n={len(shard_dirs)}:v=1:a=0[v]")
+
+        run_ffmpeg([
+            *inputs,
+            "-filter_complex", ";".join(graph),
+            "-map", "[v]",
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", "16",
+            "-pix_fmt", "yuv420p",
+            str(output_dir / src.name)
+        ])
+    return output_dir
+
+
+def preprocess_sharded(preprocess, video_path: Path, output_dir: Path, work_dir: Path,
+                       setting: str = PREPROCESS_SHARDS) -> bool:
+    """
+    Preprocess video_path into output_dir across shards, where
+    preprocess(clip, shard_dir) runs preprocess_data.py over one clip.
+    Returns False without doing anything when the video is too short to shard.
+    """
+    if setting != "auto" and int(setting) < 2:
+        return False
+    frames = probe_frames(video_path)
+    count = shard_count(frames, setting)
+    if count < 2:
+        return False
+
+    shards = plan_shards(frames, count)
+    workers = pool_size(count)
+    print(f"Preprocessing {frames} frames in {count} shards, {workers} at a time")
+    work_dir = Path(work_dir)
+    try:
+        clips = cut_shards(video_path, shards, work_dir)
+        # A failed shard is retried on its own (process_segments), not the whole video
+        shard_dirs = process_segments(lambda i, clip: preprocess(clip, work_dir / f"shard_{i:03d}"),
+                                      clips, workers=workers)
+        merge_shards(shards, shard_dirs, output_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return True
@@ -0,0 +1,254 @@
+"""
+Local weight staging to cut cold start.
+
+The model lives on the network volume, which is slow to read. At worker
+start a background thread walks the model files in the order they are
+needed (preprocessing checkpoints, then T5, VAE, CLIP, the DiT shards and
+the LoRA) and either
+
+    copy      - copies them to local disk (LOCAL_MODEL_DIR), symlinking
+                whatever does not fit in the free space budget
+    prefetch  - reads them once so they sit in the page cache, up to the
+                available memory
+    off       - does nothing
+
+Callers wait only for the files they need: preprocessing can start as soon
+as process_checkpoint is staged, while the generation engine waits for the
+whole model. Per-file throughput is recorded in a JSON report so cold starts
+can be compared with and without staging.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+STAGING_MODE = os.environ.get("STAGING_MODE", "copy")
+LOCAL_MODEL_DIR = Path(os.environ.get("LOCAL_MODEL_DIR", "/tmp/model-staging/Wan2.2-Animate-14B"))
+RESERVE_BYTES = int(os.environ.get("STAGING_RESERVE_GB", "10")) * 1024**3
+COPY_BUFFER = 16 * 1024 * 1024
+
+# Loader order: first match wins, unmatched files go last
+LOAD_ORDER = [
+    "config.json",
+    "*.json",
+    "google/*",
+    "xlm-roberta-large/*",
+    "process_checkpoint/*",
+    "models_t5_*",
+    "Wan2.1_VAE.pth",
+    "models_clip_*",
+    "diffusion_pytorch_model*",
+    "relighting_lora*",
+]
+
+
+def _load_rank(relpath: Path) -> int:
+    for rank, pattern in enumerate(LOAD_ORDER):
+        if relpath.match(pattern) or (pattern.endswith("/*") and relpath.parts[0] == pattern[:-2]):
+            return rank
+    return len(LOAD_ORDER)
+
+
+def list_model_files(model_dir: Path) -> list:
+    """Model files (relative paths) in the order the loaders read them."""
+    model_dir = Path(model_dir)
+    files = [
+        path.relative_to(model_dir) for path in model_dir.rglob("*")
+        if path.is_file() and not path.name.startswith(".") and not path.name.endswith(".part")
+    ]
+    return sorted(files, key=lambda relpath: (_load_rank(relpath), str(relpath)))
+
+
+def _available_memory() -> int:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class ModelStager:
+    """Stage a model directory in the background and gate readers on it."""
+
+    def __init__(self, source_dir: Path, local_dir: Path = LOCAL_MODEL_DIR, mode: str = STAGING_MODE):
+        self.source_dir = Path(source_dir)
+        self.local_dir = Path(local_dir)
+        self.mode = mode
+        self.files = []
+        self.staged = set()
+        self.records = []
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._done = threading.Event()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name="model-staging", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            self.files = list_model_files(self.source_dir)
+            if self.mode == "copy":
+                self._copy_all()
+            elif self.mode == "prefetch":
+                self._prefetch_all()
+        except Exception as e:
+            # Staging is an optimisation; fall back to reading from the volume
+            print(f"Model staging failed ({e}); loading from {self.source_dir}")
+            self.error = str(e)
+            self.mode = "off"
+        finally:
+            self.finished_at = time.time()
+            with self._cond:
+                self._done.set()
+                self._cond.notify_all()
+            self._write_report()
+
+    def _mark(self, relpath: Path, action: str, size: int, seconds: float):
+        self.records.append({
+            "file": str(relpath),
+            "action": action,
+            "bytes": size,
+            "seconds": round(seconds, 3),
+            "mb_per_second": round(size / 1024**2 / seconds, 1) if seconds > 0 else None
+        })
+        with self._cond:
+            self.staged.add(relpath)
+            self._cond.notify_all()
+
+    def _copy_all(self):
+        self.local_dir.mkdir(parents=True, exist_ok=True)
+        budget = shutil.disk_usage(self.local_dir).free - RESERVE_BYTES
+        # Files already staged by an earlier start of this container count as free
+        for relpath in self.files:
+            dest = self.local_dir / relpath
+            if dest.is_file() and not dest.is_symlink():
+                budget += dest.stat().st_size
+
+        sizes = [(self.source_dir / relpath).stat().st_size for relpath in self.files]
+        if not sizes or budget < sizes[0]:
+            print(f"Not enough local disk to stage the model ({max(budget, 0) // 1024**3}GB usable); skipping")
+            self.mode = "off"
+            return
+        print(f"Staging {len(self.files)} model files ({sum(sizes) / 1024**3:.1f}GB) to {self.local_dir}")
+
+        for relpath, size in zip(self.files, sizes):
+            src = self.source_dir / relpath
+            dest = self.local_dir / relpath
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            start = time.time()
+
+            if dest.is_file() and not dest.is_symlink() and dest.stat().st_size == size:
+                self._mark(relpath, "cached", size, 0.0)
+                budget -= size
+            elif size <= budget:
+                partial = dest.with_name(dest.name + ".staging")
+                with open(src, "rb") as fin, open(partial, "wb") as fout:
+                    shutil.copyfileobj(fin, fout, COPY_BUFFER)
+                os.replace(partial, dest)
+                budget -= size
+                self._mark(relpath, "copied", size, time.time() - start)
+            else:
+                # Out of local space: read this one (and the rest) from the volume
+                if dest.is_symlink() or dest.exists():
+                    dest.unlink()
+                dest.symlink_to(src)
+                self._mark(relpath, "linked", 0, 0.0)
+
+    def _prefetch_all(self):
+        budget = int(_available_memory() * 0.8)
+        print(f"Prefetching model files into the page cache ({budget / 1024**3:.1f}GB budget)")
+        for relpath in self.files:
+            src = self.source_dir / relpath
+            size = src.stat().st_size
+            start = time.time()
+            if size > budget:
+                self._mark(relpath, "skipped", 0, 0.0)
+                continue
+            fd = os.open(src, os.O_RDONLY)
+            try:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                # Network filesystems may ignore the hint, so read it through
+                while os.read(fd, COPY_BUFFER):
+                    pass
+            finally:
+                os.close(fd)
+            budget -= size
+            self._mark(relpath, "prefetched", size, time.time() - start)
+
+    @property
+    def model_dir(self) -> Path:
+        """Directory loaders should read from."""
+        return self.local_dir if self.mode == "copy" else self.source_dir
+
+    def wait(self, relpath: str = None, timeout: float = None) -> Path:
+        """
+        Block until relpath (a file or directory, relative to the model) or,
+        with no argument, the whole model is staged. Returns the directory to
+        load from.
+        """
+        with self._cond:
+            def ready():
+                if self._done.is_set():
+                    return True
+                if relpath is None or not self.files:
+                    return False
+                prefix = Path(relpath)
+                needed = [f for f in self.files if f == prefix or prefix in f.parents]
+                return bool(needed) and all(f in self.staged for f in needed)
+            self._cond.wait_for(ready, timeout=timeout)
+        return self.model_dir
+
+    def report(self) -> dict:
+        staged_bytes = sum(record["bytes"] for record in self.records)
+        elapsed = (self.finished_at or time.time()) - (self.started_at or time.time())
+        return {
+            "mode": self.mode,
+            "source": str(self.source_dir),
+            "target": str(self.model_dir),
+            "seconds": round(elapsed, 1),
+            "bytes": staged_bytes,
+            "mb_per_second": round(staged_bytes / 1024**2 / elapsed, 1) if elapsed > 0 else None,
+            "error": self.error,
+            "files": self.records
+        }
+
+    def _write_report(self):
+        report = self.report()
+        print(f"Model staging ({report['mode']}) finished in {report['seconds']}s, "
+              f"{report['bytes'] / 1024**3:.1f}GB at {report['mb_per_second']}MB/s")
+        if self.mode == "copy":
+            try:
+                (self.local_dir / ".staging_report.json").write_text(json.dumps(report, indent=2))
+            except OSError:
+                pass
+
+
+_stager = None
+
+
+def start_staging(source_dir: Path, mode: str = STAGING_MODE) -> ModelStager:
+    """Start staging source_dir in the background (once per process)."""
+    global _stager
+    if _stager is None:
+        _stager = ModelStager(source_dir, mode=mode).start()
+    return _stager
+
+
+def staged_model_dir(source_dir: Path, relpath: str = None) -> Path:
+    """Directory to read the model from, waiting for relpath (or everything) to be staged."""
+    if _stager is None:
+        return Path(source_dir)
+    return _stager.wait(relpath)
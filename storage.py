@@ -0,0 +1,177 @@
+"""
+Output storage for output_format "url".
+
+Uploads finished videos to S3-compatible storage (AWS S3, R2, MinIO, ...)
+and returns a URL instead of inlining the file as base64. Large files go up
+as a multipart upload whose parts are sent concurrently, each with its own
+retries. Configuration follows the RunPod bucket variables:
+
+    BUCKET_ENDPOINT_URL, BUCKET_ACCESS_KEY_ID, BUCKET_SECRET_ACCESS_KEY,
+    BUCKET_NAME, BUCKET_REGION
+
+STORAGE_BACKEND=file writes into STORAGE_ROOT instead, as a local stand-in
+for tests.
+"""
+
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    import boto3
+    from botocore.config import Config as BotoConfig
+except ImportError:  # only needed for the s3 backend
+    boto3 = None
+
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "s3")
+STORAGE_PREFIX = os.environ.get("STORAGE_PREFIX", "faceswap")
+PART_BYTES = max(5, int(os.environ.get("STORAGE_PART_MB", "16"))) * 1024**2
+UPLOAD_CONCURRENCY = int(os.environ.get("STORAGE_UPLOAD_CONCURRENCY", "4"))
+PART_RETRIES = 3
+PRESIGN = os.environ.get("STORAGE_PRESIGN", "1") != "0"
+PRESIGN_SECONDS = int(os.environ.get("STORAGE_PRESIGN_SECONDS", str(7 * 24 * 3600)))
+
+
+class StorageBackend:
+    """Base class for output storage."""
+
+    def upload(self, path: Path, key: str) -> str:
+        """Upload a file under key and return a URL for it."""
+        raise NotImplementedError
+
+
+class S3Storage(StorageBackend):
+    """S3-compatible storage with concurrent multipart uploads."""
+
+    def __init__(self, bucket: str, endpoint_url: str = None, access_key: str = None,
+                 secret_key: str = None, region: str = None, public_url: str = None):
+        if boto3 is None:
+            raise RuntimeError("boto3 is required for S3 output storage")
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.public_url = public_url
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            aws_access_key_id=access_key,
+            aws_secret_access_key=secret_key,
+            region_name=region,
+            config=BotoConfig(max_pool_connections=UPLOAD_CONCURRENCY * 2,
+                              retries={"max_attempts": 3, "mode": "standard"})
+        )
+        # As resolved by boto3 (BUCKET_REGION, then the AWS config), for plain AWS URLs
+        self.region = self.client.meta.region_name or "us-east-1"
+
+    def _upload_part(self, path: Path, key: str, upload_id: str, number: int, offset: int, length: int) -> dict:
+        with open(path, "rb") as f:
+            body = os.pread(f.fileno(), length, offset)
+        for attempt in range(PART_RETRIES):
+            try:
+                response = self.client.upload_part(
+                    Bucket=self.bucket, Key=key, UploadId=upload_id,
+                    PartNumber=number, Body=body
+                )
+                return {"PartNumber": number, "ETag": response["ETag"]}
+            except Exception as e:
+                if attempt == PART_RETRIES - 1:
+                    raise
+                print(f"Upload of part {number} failed ({e}), retrying...")
+                time.sleep(2 ** attempt)
+
+    def upload(self, path: Path, key: str) -> str:
+        size = Path(path).stat().st_size
+        if size <= PART_BYTES:
+            with open(path, "rb") as f:
+                self.client.put_object(Bucket=self.bucket, Key=key, Body=f, ContentType="video/mp4")
+        else:
+            upload_id = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=key, ContentType="video/mp4"
+            )["UploadId"]
+            offsets = range(0, size, PART_BYTES)
+            try:
+                with ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY) as pool:
+                    futures = [
+                        pool.submit(self._upload_part, path, key, upload_id, number,
+                                    offset, min(PART_BYTES, size - offset))
+                        for number, offset in enumerate(offsets, start=1)
+                    ]
+                    parts = [future.result() for future in futures]
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket, Key=key, UploadId=upload_id,
+                    MultipartUpload={"Parts": parts}
+                )
+            except Exception:
+                self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+                raise
+        return self.url(key)
+
+    def url(self, key: str) -> str:
+        if PRESIGN:
+            return self.client.generate_presigned_url(
+                "get_object", Params={"Bucket": self.bucket, "Key": key}, ExpiresIn=PRESIGN_SECONDS
+            )
+        if self.public_url:
+            return f"{self.public_url.rstrip('/')}/{key}"
+        if self.endpoint_url:
+            return f"{self.endpoint_url.rstrip('/')}/{self.bucket}/{key}"
+        # No endpoint: plain AWS S3, virtual-hosted style
+        return f"https://{self.bucket}.s3.{self.region}.amazonaws.com/{key}"
+
+
+class FileStorage(StorageBackend):
+    """Copy outputs into a local directory (test stand-in for a bucket)."""
+
+    def __init__(self, root: Path, base_url: str = None):
+        self.root = Path(root)
+        self.base_url = base_url
+
+    def upload(self, path: Path, key: str) -> str:
+        dest = self.root / key
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        partial = dest.with_name(f".{dest.name}.{uuid.uuid4().hex}")
+        shutil.copyfile(path, partial)
+        os.replace(partial, dest)
+        if self.base_url:
+            return f"{self.base_url.rstrip('/')}/{key}"
+        return dest.resolve().as_uri()
+
+
+_storage = None
+_storage_lock = threading.Lock()
+_upload_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="upload")
+
+
+def get_storage():
+    """Return the configured storage backend, or None if none is configured."""
+    global _storage
+    with _storage_lock:
+        if _storage is not None:
+            return _storage
+        if STORAGE_BACKEND == "file":
+            if not os.environ.get("STORAGE_ROOT"):
+                return None
+            _storage = FileStorage(os.environ["STORAGE_ROOT"], os.environ.get("STORAGE_BASE_URL"))
+        elif os.environ.get("BUCKET_NAME"):
+            _storage = S3Storage(
+                bucket=os.environ["BUCKET_NAME"],
+                endpoint_url=os.environ.get("BUCKET_ENDPOINT_URL"),
+                access_key=os.environ.get("BUCKET_ACCESS_KEY_ID"),
+                secret_key=os.environ.get("BUCKET_SECRET_ACCESS_KEY"),
+                region=os.environ.get("BUCKET_REGION"),
+                public_url=os.environ.get("BUCKET_PUBLIC_URL")
+            )
+        return _storage
+
+
+def output_key(job_id: str, name: str) -> str:
+    """Object key for one job output."""
+    return f"{STORAGE_PREFIX}/{job_id}/{name}"
+
+
+def upload_async(path: Path, key: str):
+    """Start uploading a finished file in the background; returns a Future of its URL."""
+    return _upload_pool.submit(get_storage().upload, path, key)
@@ -3,12 +3,12 @@
 Test script for Face Swap RunPod Serverless API
 """
 
-import requests
-import base64
-import json
+import asyncio
 import sys
-import time
 import os
+from pathlib import Path
+
+from client import FaceSwapClient, format_progress
 
 # Load .env file if present
 from dotenv import load_dotenv
@@ -21,22 +21,14 @@ ENDPOINT_ID = os.environ.get("RUNPOD_ENDPOINT_ID")
 VIDEO_URL = os.environ.get("VIDEO_URL", "")
 PHOTO_URL = os.environ.get("PHOTO_URL", "")
 
-def run_faceswap(video_url: str, photo_url: str, resolution: list = [1280, 720]):
-    """Run face swap via RunPod API."""
-
-    endpoint_url = f"https://api.runpod.ai/v2/{ENDPOINT_ID}/run"
-
-    headers = {
-        "Authorization": f"Bearer {RUNPOD_API_KEY}",
-        "Content-Type": "application/json"
-    }
+def run_faceswap(video_url: str, photo_url: str, resolution: list = [1280, 720],
+                 output_path: str = "faceswap_result.mp4"):
+    """Run face swap via RunPod API, printing progress and saving the output video."""
 
-    payload = {
-        "input": {
-            "video_url": video_url,
-            "photo_url": photo_url,
-            "resolution": resolution
-        }
+    job_input = {
+        "video_url": video_url,
+        "photo_url": photo_url,
+        "resolution": resolution
     }
 
     print(f"Submitting job to RunPod...")
@@ -44,47 +36,12 @@ def run_faceswap(video_url: str, photo_url: str, resolution: list = [1280, 720])
     print(f"  Photo: {photo_url}")
     print(f"  Resolution: {resolution}")
 
-    # Submit job
-    response = requests.post(endpoint_url, headers=headers, json=payload)
-    response.raise_for_status()
-    result = response.json()
-
-    job_id = result.get("id")
-    print(f"\nJob submitted! ID: {job_id}")
-
-    # Poll for status
-    status_url = f"https://api.runpod.ai/v2/{ENDPOINT_ID}/status/{job_id}"
-
-    print("Waiting for completion...")
-    while True:
-        status_response = requests.get(status_url, headers=headers)
-        status_data = status_response.json()
-
-        status = status_data.get("status")
-        print(f"  Status: {status}")
-
-        if status == "COMPLETED":
-            return status_data.get("output")
-        elif status == "FAILED":
-            print(f"Error: {status_data.get('error')}")
-            return None
-        elif status in ["IN_QUEUE", "IN_PROGRESS"]:
-            time.sleep(10)  # Poll every 10 seconds
-        else:
-            print(f"Unknown status: {status}")
-            time.sleep(5)
-
-def save_output(output_data: dict, output_path: str = "output.mp4"):
-    """Save the output video."""
-    if "output_base64" in output_data:
-        video_bytes = base64.b64decode(output_data["output_base64"])
-        with open(output_path, "wb") as f:
-            f.write(video_bytes)
-        print(f"\nSaved to: {output_path}")
-        return True
-    else:
-        print("No output_base64 in response")
-        return False
+    async def run():
+        async with FaceSwapClient(ENDPOINT_ID, RUNPOD_API_KEY) as client:
+            return await client.run(job_input, Path(output_path),
+                                    on_event=lambda result, event: print(f"  {format_progress(event)}"))
+
+    return asyncio.run(run())
 
 def main():
     if not RUNPOD_API_KEY:
@@ -105,13 +62,14 @@ def main():
         sys.exit(1)
 
     # Run face swap
-    output = run_faceswap(VIDEO_URL, PHOTO_URL)
+    result = run_faceswap(VIDEO_URL, PHOTO_URL)
+    print(f"\nJob {result.job_id} finished in {result.latency:.1f}s")
 
-    if output and output.get("status") == "success":
-        save_output(output, "faceswap_result.mp4")
+    if result.status == "success":
+        print(f"Saved to: {', '.join(str(p) for p in result.output_paths)}")
         print("\nFace swap completed successfully!")
     else:
-        print(f"\nFace swap failed: {output}")
+        print(f"\nFace swap failed: {result.status}: {result.error}")
 
 if __name__ == "__main__":
     main()
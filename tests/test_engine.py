@@ -0,0 +1,93 @@
+import logging
+import sys
+import types
+
+import pytest
+
+import engine
+import progress
+from engine import InProcessBackend, StubBackend, SubprocessBackend, create_backend, get_engine
+
+
+@pytest.fixture
+def backend(monkeypatch, tmp_path):
+    """An in-process backend holding a pipeline from a fake sampler module."""
+    sampler = types.ModuleType("fake_wan_animate")
+    sampler.Pipeline = type("Pipeline", (), {"__module__": sampler.__name__})
+    monkeypatch.setitem(sys.modules, sampler.__name__, sampler)
+    engine = InProcessBackend(tmp_path, tmp_path)
+    engine.pipeline = sampler.Pipeline()
+    return engine
+
+
+def test_feed_logs_reaches_the_job(backend):
+    job = progress.JobProgress()
+    with progress.activate(job), backend._feed_logs():
+        logging.getLogger("fake_wan_animate").info("Sampling 9 clips")
+    assert list(job.tail) == ["[wan] Sampling 9 clips"]
+
+
+def test_feed_logs_leaves_other_loggers_alone(backend):
+    root = logging.getLogger()
+    sampler_logger = logging.getLogger("fake_wan_animate")
+    root_level, root_handlers = root.level, list(root.handlers)
+    sampler_logger.setLevel(logging.WARNING)
+
+    with backend._feed_logs():
+        assert root.level == root_level
+        assert sampler_logger.level == logging.INFO
+
+    assert root.level == root_level
+    assert root.handlers == root_handlers
+    assert sampler_logger.level == logging.WARNING
+    assert not sampler_logger.handlers
+
+
+@pytest.fixture
+def no_engine(monkeypatch):
+    """Start without a process-wide engine."""
+    monkeypatch.setattr(engine, "_engine", None)
+
+
+@pytest.mark.parametrize("name, backend_cls", [
+    ("inprocess", InProcessBackend), ("subprocess", SubprocessBackend), ("stub", StubBackend)])
+def test_create_backend_by_name(tmp_path, name, backend_cls):
+    assert type(create_backend(name, tmp_path, tmp_path)) is backend_cls
+
+
+def test_unknown_backend(tmp_path):
+    with pytest.raises(ValueError, match="Unknown generation backend 'tensorrt'"):
+        create_backend("tensorrt", tmp_path, tmp_path)
+
+
+def test_get_engine_loads_once(no_engine, tmp_path):
+    stub = get_engine(tmp_path, tmp_path, backend="stub")
+    assert isinstance(stub, StubBackend) and stub.loaded
+    assert get_engine(tmp_path, tmp_path, backend="subprocess") is stub
+    assert engine.loaded_engine() is stub
+
+
+def test_inprocess_falls_back_to_subprocess(no_engine, monkeypatch, tmp_path):
+    # No wan package under this WAN_DIR, so the in-process pipeline cannot load
+    monkeypatch.setitem(sys.modules, "wan", None)
+    loaded = get_engine(tmp_path, tmp_path, backend="inprocess")
+    assert isinstance(loaded, SubprocessBackend)
+    assert loaded.supports_slots
+
+
+def test_other_backends_do_not_fall_back(no_engine, monkeypatch, tmp_path):
+    def fail(self):
+        raise RuntimeError("no GPU")
+    monkeypatch.setattr(StubBackend, "load", fail)
+    with pytest.raises(RuntimeError, match="no GPU"):
+        get_engine(tmp_path, tmp_path, backend="stub")
+    assert engine.loaded_engine() is None
+
+
+def test_stub_copies_first_clip(tmp_path):
+    processed = tmp_path / "processed"
+    processed.mkdir()
+    (processed / "src_pose.mp4").write_bytes(b"pose")
+    (processed / "src_face.mp4").write_bytes(b"face")
+    output = StubBackend(tmp_path, tmp_path).generate(processed, tmp_path / "out.mp4")
+    assert output.read_bytes() == b"face"
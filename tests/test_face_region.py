@@ -0,0 +1,189 @@
+import math
+
+import numpy as np
+import pytest
+
+import face_region
+from admission import probe_media
+from engine import StubBackend
+from face_region import (CropTrack, FrameWriter, crop_region, feather_mask, read_frames, region_resolution,
+                         stabilize, track_faces)
+
+WIDTH, HEIGHT, FPS, FRAMES = 320, 240, 10, 30
+FACE = 48
+ABSENT = range(10, 20)
+GRAY = 100
+RED = (230, 20, 20)
+
+nan = math.nan
+
+
+def face_x(i: int) -> int:
+    """The face moves right 4 pixels a frame."""
+    return 40 + 4 * i
+
+
+def write_video(path, frames, width=WIDTH, height=HEIGHT):
+    with FrameWriter(path, width, height, FPS) as writer:
+        for frame in frames:
+            writer.write(frame)
+    return path
+
+
+def base_frames():
+    for _ in range(FRAMES):
+        yield np.full((HEIGHT, WIDTH, 3), GRAY, np.uint8)
+
+
+def mask_frames():
+    """White face box on black, gone for the ABSENT frames."""
+    for i in range(FRAMES):
+        frame = np.zeros((HEIGHT, WIDTH, 3), np.uint8)
+        if i not in ABSENT:
+            frame[80:80 + FACE, face_x(i):face_x(i) + FACE] = 255
+        yield frame
+
+
+@pytest.fixture
+def clip(tmp_path):
+    """A plain gray video, its media info and the character mask of a face crossing it."""
+    video = write_video(tmp_path / "video.mp4", base_frames())
+    mask = write_video(tmp_path / "src_mask.mp4", mask_frames())
+    return video, probe_media(video), mask
+
+
+@pytest.fixture
+def mask_tracker(monkeypatch):
+    # cv2 is optional; the mask tracker needs nothing beyond ffmpeg
+    monkeypatch.setattr(face_region, "FACE_TRACKER", "mask")
+
+
+def test_mask_tracker_finds_the_face(clip, mask_tracker):
+    video, media, mask = clip
+    boxes, tracker = track_faces(video, media, mask_source=lambda: mask)
+
+    assert tracker == "mask"
+    assert boxes.shape == (FRAMES, 4)
+    for i, box in enumerate(boxes):
+        if i in ABSENT:
+            assert np.isnan(box).all()
+        else:
+            assert np.allclose(box, [face_x(i), 80, FACE, FACE], atol=2)
+
+
+def test_tracker_without_mask_source_is_an_error(clip, mask_tracker):
+    video, media, _ = clip
+    with pytest.raises(ValueError, match="not available"):
+        track_faces(video, media)
+
+
+def test_stabilize_interpolates_across_absent_span():
+    boxes = np.array([[nan] * 4, [10, 20, 40, 40], [nan] * 4, [nan] * 4, [nan] * 4, [90, 20, 40, 40],
+                      [nan] * 4])
+    track = stabilize(boxes, WIDTH, HEIGHT, margin=0, smoothing=1)
+
+    assert (track.width, track.height) == (40, 40)
+    # Linear between the detections, held before the first and after the last
+    assert list(track.x) == [10, 10, 30, 50, 70, 90, 90]
+    assert list(track.y) == [20] * 7
+
+
+def test_stabilize_fixes_one_even_size_with_margin():
+    boxes = np.array([[100, 100, 30, 30], [100, 100, 45, 35], [100, 100, 31, 31]], dtype=float)
+    track = stabilize(boxes, WIDTH, HEIGHT, margin=0.25, smoothing=1)
+
+    # The largest box plus a quarter on each side, rounded up to even
+    assert (track.width, track.height) == (68, 54)
+    assert len(track.x) == len(boxes)
+
+
+def test_stabilize_keeps_the_window_in_frame():
+    boxes = np.array([[0, 0, 40, 40], [WIDTH - 40, HEIGHT - 40, 40, 40]], dtype=float)
+    track = stabilize(boxes, WIDTH, HEIGHT, margin=0.5, smoothing=1)
+
+    assert track.position(0) == (0, 0)
+    assert track.position(1) == (WIDTH - track.width, HEIGHT - track.height)
+    # Past the end the last position is held
+    assert track.position(5) == track.position(1)
+
+
+def test_stabilize_smooths_jitter():
+    x = np.array([100, 110] * 10, dtype=float)
+    boxes = np.column_stack([x, np.full(20, 50.0), np.full(20, 40.0), np.full(20, 40.0)])
+    track = stabilize(boxes, WIDTH, HEIGHT, margin=0, smoothing=4)
+
+    assert np.ptp(track.x[2:-2]) <= 1
+
+
+def test_stabilize_without_any_face():
+    assert stabilize(np.full((5, 4), nan), WIDTH, HEIGHT) is None
+
+
+def test_region_resolution():
+    assert region_resolution(CropTrack(88, 88, None, None)) == (80, 80)
+    width, height = region_resolution(CropTrack(1200, 900, None, None), area=512 * 512)
+    assert width % 16 == 0 and height % 16 == 0
+    assert width * height <= 512 * 512
+
+
+def test_feather_mask():
+    alpha = feather_mask(100, 60, feather=0.1)
+
+    assert alpha.shape == (60, 100, 1)
+    # Fully the generated crop inside, easing out over the outer 6 pixels
+    assert (alpha[6:-6, 6:-6] == 1).all()
+    assert alpha[0, 0] < 0.05
+    assert alpha[30, 0] < alpha[30, 2] < alpha[30, 4] < 1
+    assert np.allclose(alpha, alpha[::-1, ::-1])
+
+
+def test_crop_region_falls_back_to_full_frame(clip, tmp_path):
+    video, media, _ = clip
+    region = crop_region(video, media, np.full((FRAMES, 4), nan), "mask", tmp_path / "region")
+    assert not region.active
+    assert region.summary() == {"mode": "full", "reason": "no face found"}
+
+    whole = np.tile([10.0, 10.0, WIDTH - 20, HEIGHT - 20], (FRAMES, 1))
+    region = crop_region(video, media, whole, "mask", tmp_path / "region")
+    assert not region.active
+    assert "of the frame" in region.reason
+
+
+def test_crop_generate_composite_with_stub_generator(clip, mask_tracker, tmp_path):
+    video, media, mask = clip
+    boxes, tracker = track_faces(video, media, mask_source=lambda: mask)
+    region = crop_region(video, media, boxes, tracker, tmp_path / "region")
+
+    assert region.active
+    track = region.track
+    crop = probe_media(region.crop_path)
+    assert (crop["width"], crop["height"], crop["frames"]) == (track.width, track.height, FRAMES)
+    summary = region.summary()
+    assert summary["mode"] == "face" and summary["crop"] == [track.width, track.height]
+    assert summary["resolution"] == list(region_resolution(track))
+
+    # The stub "generates" by copying the clip it finds in the processed directory
+    processed = tmp_path / "processed"
+    processed.mkdir()
+    red = np.zeros((track.height, track.width, 3), np.uint8)
+    red[:] = RED
+    write_video(processed / "generated.mp4", (red for _ in range(FRAMES)), track.width, track.height)
+    generated = StubBackend(tmp_path, tmp_path).generate(processed, tmp_path / "generated.mp4")
+
+    output = region.composite(generated, tmp_path / "composited.mp4")
+
+    frames = list(read_frames(output, WIDTH, HEIGHT))
+    assert len(frames) == FRAMES
+    for i in (0, 15, FRAMES - 1):
+        frame = frames[i].astype(int)
+        x, y = track.position(i)
+        center = frame[y + track.height // 2, x + track.width // 2]
+        edge = frame[y + track.height // 2, x if x > 0 else x + track.width - 1]
+        assert np.abs(center - RED).max() <= 12
+        # The feathered border blends into the untouched frame around it
+        assert np.abs(edge - GRAY).max() <= 12
+        outside = np.ones((HEIGHT, WIDTH), bool)
+        outside[max(0, y - 4):y + track.height + 4, max(0, x - 4):x + track.width + 4] = False
+        assert np.abs(frame[outside] - GRAY).max() <= 6
+    # Across the absent span the window keeps moving between the face's positions either side
+    assert track.position(ABSENT[0] - 1)[0] < track.position(15)[0] < track.position(ABSENT[-1] + 1)[0]
@@ -0,0 +1,162 @@
+import base64
+import json
+import os
+import subprocess
+import sys
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+import engine
+import handler
+from admission import probe_media
+from engine import StubBackend, SubprocessBackend
+from handler import validate_input
+
+ROOT = Path(__file__).resolve().parent.parent
+
+VIDEO = {"video_url": "https://example.com/video.mp4"}
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.mark.parametrize("photo_urls", [
+    ["https://example.com/a.jpg"],
+    ["https://example.com/a.jpg", "https://example.com/b.jpg"],
+])
+def test_photo_urls_accepts_list_of_urls(photo_urls):
+    assert validate_input({**VIDEO, "photo_urls": photo_urls}) is None
+
+
+@pytest.mark.parametrize("photo_urls", [
+    [],
+    "https://example.com/a.jpg",
+    ["https://example.com/a.jpg", 3],
+    [None],
+    {"url": "https://example.com/a.jpg"},
+    None,
+])
+def test_photo_urls_rejects_anything_else(photo_urls):
+    assert validate_input({**VIDEO, "photo_urls": photo_urls}) == "photo_urls must be a non-empty list of URLs"
+
+
+def test_empty_photo_urls_is_rejected_even_with_photo_url():
+    job_input = {**VIDEO, "photo_url": "https://example.com/a.jpg", "photo_urls": []}
+    assert validate_input(job_input) is not None
+
+
+def test_gpu_slots_follow_the_loaded_backend(monkeypatch, tmp_path):
+    monkeypatch.setattr(handler, "GPU_COUNT", 4)
+    monkeypatch.setattr(handler, "GENERATION_BACKEND", "inprocess")
+    monkeypatch.setattr(handler, "MAX_CONCURRENT_JOBS", 0)
+    monkeypatch.setattr(engine, "_engine", None)
+    assert handler.gpu_slots() == 1
+    assert handler.max_concurrent_jobs() == 2
+
+    # The in-process engine failed to load and the subprocess backend took over
+    monkeypatch.setattr(engine, "_engine", SubprocessBackend(tmp_path, tmp_path))
+    assert handler.gpu_slots() == 4
+    assert handler.max_concurrent_jobs() == 5
+    assert handler.gpu_slots(StubBackend(tmp_path, tmp_path)) == 4
+
+
+# Runs in a fresh interpreter: handler reads its settings from the environment at import
+STUB_JOBS = '''
+import asyncio, base64, json, sys
+import handler
+
+async def run(i, job_input):
+    events = []
+    async for event in handler.handler({"id": f"stub-{i}", "input": job_input}):
+        events.append(event)
+    return events
+
+for i, job_input in enumerate(json.loads(sys.argv[1])):
+    events = asyncio.run(run(i, job_input))
+    result = events[-1]
+    outputs = result.get("outputs") or [result]
+    for n, output in enumerate(outputs):
+        if "output_base64" in output:
+            with open(f"{sys.argv[2]}/job{i}_{n}.mp4", "wb") as f:
+                f.write(base64.b64decode(output.pop("output_base64")))
+    print("EVENTS " + json.dumps(events))
+'''
+
+
+@pytest.fixture
+def stub_worker(tmp_path):
+    """Run job inputs through handler() on the stub backend in a child process; returns each job's events."""
+    from benchmarks.bench_handler import make_video, make_wan_dir
+
+    wan_dir, model_dir = make_wan_dir(tmp_path)
+    video = tmp_path / "video.mp4"
+    make_video(video, 0)
+    photos = []
+    for i, color in enumerate(["red", "blue"]):
+        photos.append(tmp_path / f"photo_{i}.png")
+        subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i", f"color={color}:size=64x64",
+                        "-frames:v", "1", str(photos[-1])], check=True)
+    env = {
+        "PATH": os.environ["PATH"],
+        "WAN_DIR": str(wan_dir),
+        "MODEL_DIR": str(model_dir),
+        "GENERATION_BACKEND": "stub",
+        "GPU_COUNT": "1",
+        "PREPROCESS_CACHE_DIR": str(tmp_path / "cache" / "preprocess"),
+        "RESULT_CACHE": "0",
+        "CHECKPOINT_DIR": str(tmp_path / "checkpoints"),
+        "METRICS_LOG": "",
+        "LOCAL_MODEL_DIR": str(tmp_path / "staging"),
+    }
+    outputs = tmp_path / "outputs"
+    outputs.mkdir()
+
+    def run(*job_inputs):
+        result = subprocess.run([sys.executable, "-c", STUB_JOBS, json.dumps(job_inputs), str(outputs)],
+                                cwd=ROOT, env=env, capture_output=True, text=True, timeout=300)
+        assert result.returncode == 0, result.stderr[-3000:]
+        return [json.loads(line[len("EVENTS "):]) for line in result.stdout.splitlines()
+                if line.startswith("EVENTS ")]
+
+    run.video, run.photos, run.outputs = video, photos, outputs
+    return run
+
+
+def test_stub_backend_end_to_end(stub_worker):
+    video, photos = stub_worker.video, stub_worker.photos
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=str(video.parent)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        inline, by_url = stub_worker(
+            {"video_base64": base64.b64encode(video.read_bytes()).decode(),
+             "photo_base64": base64.b64encode(photos[0].read_bytes()).decode()},
+            {"video_url": f"{base_url}/{video.name}", "photo_urls": [f"{base_url}/{photo.name}" for photo in photos]}
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    for events in (inline, by_url):
+        *progress, result = events
+        assert result["status"] == "success", result
+        assert {event["stage"] for event in progress} >= {"ingest", "preprocess", "generate", "encode"}
+        assert all(event["status"] == "in_progress" for event in progress)
+        assert result["plan"]["source"]["frames"] > 0
+    assert "outputs" not in inline[-1]
+    assert len(by_url[-1]["outputs"]) == 2
+
+    # The stub passes the (preprocessed) input video through as the generated clip
+    expected = probe_media(video)
+    produced = sorted(stub_worker.outputs.iterdir())
+    assert [path.name for path in produced] == ["job0_0.mp4", "job1_0.mp4", "job1_1.mp4"]
+    for path in produced:
+        media = probe_media(path)
+        assert (media["width"], media["height"]) == (expected["width"], expected["height"])
+        assert media["duration"] == pytest.approx(expected["duration"], abs=0.5)
@@ -0,0 +1,189 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import ingest
+from ingest import fetch, fetch_all
+
+PAYLOAD = bytes(range(256)) * 256  # 64KB
+
+
+class Server:
+    """A local HTTP server for PAYLOAD, with per-path misbehaviour, that records every request."""
+
+    def __init__(self):
+        self.requests = []
+        self.fail_next_get = set()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                server.requests.append(("HEAD", self.path, None))
+                if self.path == "/no-head":
+                    self.send_response(405)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if self.path == "/no-length":
+                    self.send_response(200)
+                    self.send_header("Connection", "close")
+                    self.end_headers()
+                    self.close_connection = True
+                    return
+                self.send_headers(200, len(PAYLOAD))
+
+            def do_GET(self):
+                server.requests.append(("GET", self.path, self.headers.get("Range")))
+                if self.path == "/no-length":
+                    # No Content-Length: the body runs until the connection closes
+                    self.send_response(200)
+                    self.send_header("Connection", "close")
+                    self.end_headers()
+                    self.close_connection = True
+                    self.wfile.write(PAYLOAD)
+                    return
+                start, end = 0, len(PAYLOAD) - 1
+                requested = self.headers.get("Range")
+                if requested and self.path != "/no-ranges":
+                    first, last = requested.removeprefix("bytes=").split("-")
+                    start, end = int(first), int(last) if last else end
+                    self.send_headers(206, end - start + 1, f"bytes {start}-{end}/{len(PAYLOAD)}")
+                else:
+                    self.send_headers(200, len(PAYLOAD))
+                body = PAYLOAD[start:end + 1]
+                if self.path in server.fail_next_get:
+                    # Promise the whole body, send part of it and drop the connection
+                    server.fail_next_get.discard(self.path)
+                    self.close_connection = True
+                    self.wfile.write(body[:len(body) // 3])
+                    return
+                self.wfile.write(body)
+
+            def send_headers(self, status, length, content_range=None):
+                self.send_response(status)
+                self.send_header("Content-Length", str(length))
+                if self.path != "/no-ranges":
+                    self.send_header("Accept-Ranges", "bytes")
+                if content_range:
+                    self.send_header("Content-Range", content_range)
+                self.end_headers()
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.httpd.server_port}{path}"
+
+    def gets(self, path):
+        return [headers for method, request_path, headers in self.requests
+                if method == "GET" and request_path == path]
+
+
+@pytest.fixture
+def server():
+    server = Server()
+    yield server
+    server.httpd.shutdown()
+    server.httpd.server_close()
+
+
+@pytest.fixture
+def small_parts(monkeypatch):
+    """Split anything over 8KB into ranges."""
+    monkeypatch.setattr(ingest, "MIN_PART_BYTES", 4096)
+    monkeypatch.setattr(ingest, "RANGE_PARTS", 4)
+
+
+def test_ranged_parallel_parts(server, small_parts, tmp_path):
+    result = fetch(server.url("/video.mp4"), tmp_path / "video.mp4")
+
+    assert result.parts == 4
+    assert result.size == len(PAYLOAD)
+    assert (tmp_path / "video.mp4").read_bytes() == PAYLOAD
+    quarter = len(PAYLOAD) // 4
+    assert sorted(server.gets("/video.mp4")) == sorted(
+        f"bytes={start}-{start + quarter - 1}" for start in range(0, len(PAYLOAD), quarter))
+
+
+def test_single_stream_without_range_support(server, small_parts, tmp_path):
+    result = fetch(server.url("/no-ranges"), tmp_path / "video.mp4")
+
+    assert result.parts == 1
+    assert (tmp_path / "video.mp4").read_bytes() == PAYLOAD
+    assert server.gets("/no-ranges") == [None]
+
+
+def test_probe_falls_back_to_get_when_head_is_rejected(server, tmp_path):
+    assert ingest.probe(server.url("/no-head")) == (len(PAYLOAD), True)
+    assert [method for method, _, _ in server.requests] == ["HEAD", "GET"]
+
+    result = fetch(server.url("/no-head"), tmp_path / "photo.jpg")
+    assert (tmp_path / "photo.jpg").read_bytes() == PAYLOAD
+    assert result.size == len(PAYLOAD)
+
+
+def test_size_limit_from_content_length(server, tmp_path):
+    with pytest.raises(ValueError, match="Input too large"):
+        fetch(server.url("/video.mp4"), tmp_path / "video.mp4", max_bytes=len(PAYLOAD) - 1)
+    # Refused from the probe alone, before any body was requested
+    assert server.gets("/video.mp4") == []
+
+
+def test_size_limit_without_content_length(server, tmp_path):
+    assert ingest.probe(server.url("/no-length"))[0] is None
+    with pytest.raises(ValueError, match="Input too large"):
+        fetch(server.url("/no-length"), tmp_path / "video.mp4", max_bytes=len(PAYLOAD) // 2)
+
+    result = fetch(server.url("/no-length"), tmp_path / "video.mp4", max_bytes=len(PAYLOAD))
+    assert result.size == len(PAYLOAD)
+    assert (tmp_path / "video.mp4").read_bytes() == PAYLOAD
+
+
+def test_stream_resumes_after_partial_download(server, monkeypatch, tmp_path):
+    # Chunks smaller than what gets through, so some of it is written before the drop
+    monkeypatch.setattr(ingest, "CHUNK_SIZE", 1024)
+    server.fail_next_get.add("/video.mp4")
+    result = fetch(server.url("/video.mp4"), tmp_path / "video.mp4")
+
+    assert (tmp_path / "video.mp4").read_bytes() == PAYLOAD
+    assert result.size == len(PAYLOAD)
+    first, resumed = server.gets("/video.mp4")
+    assert first is None
+    offset = int(resumed.removeprefix("bytes=").removesuffix("-"))
+    assert 0 < offset <= len(PAYLOAD) // 3
+
+
+def test_stream_restarts_when_server_ignores_resume_range(server, monkeypatch, tmp_path):
+    monkeypatch.setattr(ingest, "CHUNK_SIZE", 1024)
+    server.fail_next_get.add("/no-ranges")
+    fetch(server.url("/no-ranges"), tmp_path / "video.mp4")
+
+    assert (tmp_path / "video.mp4").read_bytes() == PAYLOAD
+    assert len(server.gets("/no-ranges")) == 2
+
+
+def test_range_part_resumes_after_partial_download(server, small_parts, tmp_path):
+    server.fail_next_get.add("/video.mp4")
+    result = fetch(server.url("/video.mp4"), tmp_path / "video.mp4")
+
+    assert result.parts == 4
+    assert (tmp_path / "video.mp4").read_bytes() == PAYLOAD
+    # Four parts plus one request picking up where the dropped part stopped
+    assert len(server.gets("/video.mp4")) == 5
+
+
+def test_fetch_all_keeps_order(server, tmp_path):
+    items = [(server.url(path), tmp_path / name)
+             for path, name in [("/video.mp4", "video.mp4"), ("/no-head", "a.jpg"), ("/no-ranges", "b.jpg")]]
+    results = fetch_all(items)
+
+    assert [result.path for result in results] == [dest for _, dest in items]
+    assert all(dest.read_bytes() == PAYLOAD for _, dest in items)
+    assert fetch_all([]) == []
@@ -0,0 +1,81 @@
+import subprocess
+
+import pytest
+
+import admission
+from admission import COST_MODEL, detect_vram_gb
+from memory_policy import generate_args, select_mode
+
+# 20s runs at 30 fps, 720p
+FRAMES = 600
+RESOLUTION = (1280, 720)
+
+
+@pytest.fixture
+def nvidia_smi(monkeypatch):
+    """Report the given GPU sizes (in MiB) from a mocked nvidia-smi."""
+    monkeypatch.delenv("ADMISSION_MAX_VRAM_GB", raising=False)
+
+    def mock(*sizes_mb):
+        def run(cmd, **kwargs):
+            return subprocess.CompletedProcess(cmd, 0, "\n".join(str(size) for size in sizes_mb) + "\n", "")
+        monkeypatch.setattr(admission.subprocess, "run", run)
+    return mock
+
+
+@pytest.mark.parametrize("vram_mb, mode, fits", [
+    (81920, "max_speed", True),
+    (49152, "balanced", True),
+    (24576, "min_vram", False),
+])
+def test_auto_picks_fastest_mode_that_fits(nvidia_smi, vram_mb, mode, fits):
+    nvidia_smi(vram_mb)
+    memory = select_mode(detect_vram_gb(), RESOLUTION, FRAMES, COST_MODEL, "auto", headroom=2)
+    assert memory["mode"] == mode
+    assert memory["fits"] is fits
+
+
+def test_smallest_gpu_decides(nvidia_smi):
+    nvidia_smi(81920, 49152)
+    assert detect_vram_gb() == 48
+    assert select_mode(detect_vram_gb(), RESOLUTION, FRAMES, COST_MODEL, "auto", headroom=2)["mode"] == "balanced"
+
+
+def test_shorter_runs_need_less(nvidia_smi):
+    nvidia_smi(49152)
+    memory = select_mode(detect_vram_gb(), RESOLUTION, 120, COST_MODEL, "auto", headroom=2)
+    assert memory["mode"] == "balanced"
+    assert memory["peak_vram_gb"] < select_mode(48, RESOLUTION, FRAMES, COST_MODEL, "auto", headroom=2)["peak_vram_gb"]
+
+
+@pytest.mark.parametrize("vram_gb, requested, fits", [
+    (24, "max_speed", False),
+    (80, "min_vram", True),
+    (48, "balanced", True),
+])
+def test_requested_mode_is_kept(vram_gb, requested, fits):
+    memory = select_mode(vram_gb, RESOLUTION, FRAMES, COST_MODEL, requested, headroom=2)
+    assert memory["mode"] == requested
+    assert memory["fits"] is fits
+
+
+def test_selection_carries_switches():
+    memory = select_mode(48, RESOLUTION, FRAMES, COST_MODEL, "auto", headroom=2)
+    assert (memory["offload_model"], memory["t5_cpu"], memory["convert_model_dtype"]) == (False, True, True)
+    assert memory["vram_gb"] == 48
+    assert memory["run_frames"] == FRAMES
+
+
+@pytest.mark.parametrize("mode, args", [
+    ("max_speed", ["--offload_model", "False"]),
+    ("balanced", ["--offload_model", "False", "--t5_cpu", "--convert_model_dtype"]),
+    ("min_vram", ["--offload_model", "True", "--t5_cpu", "--convert_model_dtype"]),
+])
+def test_generate_args(mode, args):
+    assert generate_args(select_mode(80, RESOLUTION, FRAMES, COST_MODEL, mode)) == args
+
+
+def test_generate_args_multi_gpu_and_none():
+    memory = select_mode(24, RESOLUTION, FRAMES, COST_MODEL, "min_vram")
+    assert generate_args(memory, num_gpus=2) == []
+    assert generate_args(None) == []
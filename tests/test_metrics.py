@@ -0,0 +1,35 @@
+import sys
+
+import metrics
+from metrics import JobMetrics, activate, run_process
+
+MB = 1024 ** 2
+
+
+def child_peak_mb(cmd: list) -> float:
+    job = JobMetrics("test")
+    with activate(job):
+        result = run_process(cmd, capture_output=True)
+    assert result.returncode == 0
+    return job.as_dict()["processes"][metrics._process_name(cmd)]["peak_rss_mb"]
+
+
+def test_child_peak_rss_excludes_parent():
+    # Resident in this process before the fork; ru_maxrss would report it for the child
+    ballast = b"x" * (300 * MB)
+    assert child_peak_mb(["true"]) < 50
+    del ballast
+
+
+def test_child_peak_rss_is_measured():
+    script = "import time; data = b'x' * (200 * 1024 * 1024); time.sleep(1)"
+    assert child_peak_mb([sys.executable, "-c", script]) > 150
+
+
+def test_child_cpu_and_wall_time_recorded():
+    job = JobMetrics("test")
+    with activate(job):
+        run_process([sys.executable, "-c", "sum(range(10 ** 6))"])
+    child = job.children[0]
+    assert child["seconds"] > 0
+    assert child["cpu_seconds"] > 0
@@ -0,0 +1,268 @@
+import fcntl
+import hashlib
+import json
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import pytest
+
+import provision
+from provision import MARKER, download_repo_file, ensure_model, is_complete, list_repo_files
+
+REPO = "Wan-AI/Test-Model"
+FILES = {
+    "config.json": b'{"dim": 5120}\n',
+    "diffusion_model-00001.safetensors": bytes(range(256)) * 40,
+    "process_checkpoint/det/yolov10m.onnx": bytes(reversed(range(256))) * 24,
+}
+LFS = {"diffusion_model-00001.safetensors", "process_checkpoint/det/yolov10m.onnx"}
+
+
+def git_sha1(data: bytes) -> str:
+    return hashlib.sha1(f"blob {len(data)}\0".encode() + data).hexdigest()
+
+
+def tree_item(path: str, data: bytes) -> dict:
+    if path in LFS:
+        return {"type": "file", "path": path, "size": 135, "oid": git_sha1(b"pointer"),
+                "lfs": {"oid": hashlib.sha256(data).hexdigest(), "size": len(data)}}
+    return {"type": "file", "path": path, "size": len(data), "oid": git_sha1(data)}
+
+
+class Hub:
+    """A local stand-in for the hub: a paginated tree listing and ranged resolve downloads."""
+
+    def __init__(self):
+        self.files = dict(FILES)
+        self.tree = [{"type": "directory", "path": "process_checkpoint"}] + \
+                    [tree_item(path, data) for path, data in FILES.items()]
+        self.requests = []
+        self.drop_next = set()
+        self.ignore_ranges = False
+        hub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                hub.requests.append((url.path, self.headers.get("Range"), self.headers.get("Authorization")))
+                if url.path == f"/api/models/{REPO}/tree/main":
+                    return self.listing(url.query)
+                prefix = f"/{REPO}/resolve/main/"
+                if url.path.startswith(prefix) and url.path[len(prefix):] in hub.files:
+                    return self.download(url.path[len(prefix):])
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def listing(self, query):
+                # Two items per page, linked like the hub's cursor pagination
+                page = int(dict(part.split("=") for part in query.split("&")).get("page", 0))
+                body = json.dumps(hub.tree[page * 2:page * 2 + 2]).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if page * 2 + 2 < len(hub.tree):
+                    self.send_header("Link", f'<{hub.url(f"/api/models/{REPO}/tree/main")}'
+                                             f'?recursive=true&page={page + 1}>; rel="next"')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def download(self, path):
+                data = hub.files[path]
+                start = 0
+                requested = self.headers.get("Range")
+                if requested and not hub.ignore_ranges:
+                    start = int(requested.removeprefix("bytes=").split("-")[0])
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Length", str(len(data) - start))
+                self.end_headers()
+                body = data[start:]
+                if path in hub.drop_next:
+                    hub.drop_next.discard(path)
+                    self.close_connection = True
+                    body = body[:len(body) // 2]
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def url(self, path=""):
+        return f"http://127.0.0.1:{self.httpd.server_port}{path}"
+
+    def downloads(self, path=None):
+        return [(request_path.split("/resolve/main/")[1], requested)
+                for request_path, requested, _ in self.requests
+                if "/resolve/main/" in request_path and (path is None or request_path.endswith("/" + path))]
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    hub = Hub()
+    monkeypatch.setattr(provision, "HF_ENDPOINT", hub.url())
+    monkeypatch.setattr(provision, "CHUNK_SIZE", 1024)
+    monkeypatch.delenv("HF_TOKEN", raising=False)
+    yield hub
+    hub.httpd.shutdown()
+    hub.httpd.server_close()
+
+
+def entry(path: str) -> dict:
+    return next(item for item in list_repo_files(REPO) if item["path"] == path)
+
+
+def test_tree_listing_follows_pages(hub):
+    files = list_repo_files(REPO)
+
+    assert [item["path"] for item in files] == list(FILES)
+    config, weights, _ = files
+    assert config == {"path": "config.json", "size": len(FILES["config.json"]),
+                      "sha256": None, "git_sha1": git_sha1(FILES["config.json"])}
+    # LFS files report the real size and sha256, not the pointer's
+    assert weights["size"] == len(FILES["diffusion_model-00001.safetensors"])
+    assert weights["sha256"] == hashlib.sha256(FILES["diffusion_model-00001.safetensors"]).hexdigest()
+    assert weights["git_sha1"] is None
+    assert len([request for request in hub.requests if "/tree/" in request[0]]) == 2
+
+
+def test_token_is_sent(hub, monkeypatch):
+    monkeypatch.setenv("HF_TOKEN", "hf_secret")
+    list_repo_files(REPO)
+    assert {authorization for _, _, authorization in hub.requests} == {"Bearer hf_secret"}
+
+
+def test_ensure_model_downloads_and_verifies(hub, tmp_path):
+    model_dir = ensure_model(tmp_path / "model", REPO, workers=3)
+
+    for path, data in FILES.items():
+        assert (model_dir / path).read_bytes() == data
+    assert not list(model_dir.rglob("*.part"))
+    marker = json.loads((model_dir / MARKER).read_text())
+    assert marker["files"] == len(FILES)
+    assert marker["bytes"] == sum(len(data) for data in FILES.values())
+
+    # A complete model is not touched again
+    hub.requests.clear()
+    assert ensure_model(model_dir, REPO) == model_dir
+    assert hub.requests == []
+
+
+@pytest.mark.parametrize("path", ["config.json", "diffusion_model-00001.safetensors"])
+def test_checksum_mismatch_is_rejected(hub, tmp_path, path):
+    expected = entry(path)
+    hub.files[path] = FILES[path][:-1] + b"?"
+
+    with pytest.raises(RuntimeError, match="checksum mismatch"):
+        download_repo_file(expected, tmp_path, REPO)
+    assert not (tmp_path / path).exists()
+    assert not (tmp_path / f"{path}.part").exists()
+
+
+def test_size_mismatch_is_rejected(hub, tmp_path):
+    expected = entry("config.json")
+    hub.files["config.json"] = FILES["config.json"] + b"\n"
+
+    with pytest.raises(RuntimeError, match="expected"):
+        download_repo_file(expected, tmp_path, REPO)
+    assert not (tmp_path / "config.json").exists()
+
+
+def test_failed_file_leaves_model_incomplete(hub, tmp_path):
+    hub.files["config.json"] = b"{}"
+    with pytest.raises(RuntimeError):
+        ensure_model(tmp_path / "model", REPO)
+    assert not is_complete(tmp_path / "model")
+
+
+def test_resume_from_part_file(hub, tmp_path):
+    path = "diffusion_model-00001.safetensors"
+    data = FILES[path]
+    (tmp_path / f"{path}.part").write_bytes(data[:4000])
+
+    download_repo_file(entry(path), tmp_path, REPO)
+
+    assert (tmp_path / path).read_bytes() == data
+    assert hub.downloads(path) == [(path, "bytes=4000-")]
+
+
+def test_resume_after_dropped_connection(hub, tmp_path):
+    path = "diffusion_model-00001.safetensors"
+    hub.drop_next.add(path)
+
+    download_repo_file(entry(path), tmp_path, REPO)
+
+    assert (tmp_path / path).read_bytes() == FILES[path]
+    first, resumed = hub.downloads(path)
+    assert first == (path, "bytes=0-")
+    offset = int(resumed[1].removeprefix("bytes=").removesuffix("-"))
+    assert 0 < offset <= len(FILES[path]) // 2
+
+
+def test_restart_when_range_is_ignored(hub, tmp_path):
+    path = "diffusion_model-00001.safetensors"
+    (tmp_path / f"{path}.part").write_bytes(b"stale bytes from another revision")
+    hub.ignore_ranges = True
+
+    download_repo_file(entry(path), tmp_path, REPO)
+
+    assert (tmp_path / path).read_bytes() == FILES[path]
+
+
+def test_waits_for_worker_holding_the_lock(hub, tmp_path):
+    model_dir = tmp_path / "model"
+    # Another worker (process) holds the provisioning lock and finishes the model
+    holder = subprocess.Popen([sys.executable, "-c", f"""
+import fcntl, sys
+from pathlib import Path
+with open({str(tmp_path / ".model.lock")!r}, "a") as lock_file:
+    fcntl.lockf(lock_file, fcntl.LOCK_EX)
+    print("locked", flush=True)
+    sys.stdin.readline()
+    Path({str(model_dir)!r}).mkdir()
+    (Path({str(model_dir)!r}) / {MARKER!r}).write_text("{{}}")
+"""], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        assert holder.stdout.readline().strip() == "locked"
+        waiter = threading.Thread(target=ensure_model, args=(model_dir, REPO))
+        waiter.start()
+        waiter.join(0.5)
+        assert waiter.is_alive()
+
+        holder.stdin.write("done\n")
+        holder.stdin.flush()
+        waiter.join(10)
+        assert not waiter.is_alive()
+    finally:
+        holder.kill()
+        holder.wait()
+
+    assert is_complete(model_dir)
+    assert hub.requests == []
+    # The lock is free again
+    with open(tmp_path / ".model.lock", "a") as lock_file:
+        fcntl.lockf(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def test_concurrent_workers_download_once(hub, tmp_path):
+    model_dir = tmp_path / "model"
+    script = "import sys, provision; provision.ensure_model(sys.argv[1], sys.argv[2])"
+    env = {"HF_ENDPOINT": hub.url(), "PATH": "/usr/bin:/bin"}
+    workers = [subprocess.Popen([sys.executable, "-c", script, str(model_dir), REPO],
+                                cwd=Path(provision.__file__).parent, env=env,
+                                stdout=subprocess.DEVNULL)
+               for _ in range(3)]
+    assert [worker.wait(60) for worker in workers] == [0, 0, 0]
+
+    assert is_complete(model_dir)
+    assert sorted(path for path, _ in hub.downloads()) == sorted(FILES)
@@ -0,0 +1,55 @@
+import pytest
+
+from scheduler import GpuScheduler, detect_gpu_count
+
+
+@pytest.mark.parametrize("num_gpus, demand, width", [
+    # A lone job takes the widest group the host allows
+    (8, 0, 8),
+    (8, 1, 8),
+    (4, 1, 4),
+    (1, 1, 1),
+    # Widths are powers of two: 6 GPUs give a group of 4
+    (6, 1, 4),
+    # More jobs queued, narrower groups
+    (8, 2, 4),
+    (8, 3, 2),
+    (8, 4, 2),
+    (8, 5, 1),
+    (8, 8, 1),
+    (8, 20, 1),
+    (4, 2, 2),
+    (4, 3, 1),
+])
+def test_choose_width(num_gpus, demand, width):
+    assert GpuScheduler(num_gpus=num_gpus).choose_width(demand) == width
+
+
+def test_choose_width_respects_max_width():
+    scheduler = GpuScheduler(num_gpus=8, max_width=2)
+    assert scheduler.choose_width(1) == 2
+    assert scheduler.choose_width(8) == 1
+
+
+@pytest.mark.parametrize("pending, width", [(0, 4), (1, 4), (2, 2), (3, 1), (6, 1)])
+def test_pending_jobs_narrow_the_group(pending, width):
+    scheduler = GpuScheduler(num_gpus=4, pending=lambda: pending)
+    gpus = scheduler.acquire()
+    assert len(gpus) == width
+    scheduler.release(gpus)
+    assert scheduler.stats()["free"] == 4
+
+
+def test_groups_do_not_overlap():
+    scheduler = GpuScheduler(num_gpus=4, pending=lambda: 2)
+    first, second = scheduler.acquire(), scheduler.acquire()
+    assert sorted(first + second) == [0, 1, 2, 3]
+    assert scheduler.stats()["active"] == 2
+
+
+def test_detect_gpu_count(monkeypatch):
+    monkeypatch.setenv("GPU_COUNT", "4")
+    assert detect_gpu_count() == 4
+    monkeypatch.delenv("GPU_COUNT")
+    monkeypatch.setenv("CUDA_VISIBLE_DEVICES", "0,2, 3")
+    assert detect_gpu_count() == 3
@@ -0,0 +1,76 @@
+import pytest
+
+import storage
+from storage import FileStorage, S3Storage, output_key
+
+
+@pytest.fixture
+def no_presign(monkeypatch):
+    monkeypatch.setattr(storage, "PRESIGN", False)
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / "output.mp4"
+    path.write_bytes(b"\x00\x00\x00\x18ftypmp42" + bytes(range(256)) * 64)
+    return path
+
+
+def test_file_storage_copies_under_key(tmp_path, video):
+    root = tmp_path / "bucket"
+    key = output_key("job-1", video.name)
+    url = FileStorage(root).upload(video, key)
+
+    dest = root / key
+    assert dest.read_bytes() == video.read_bytes()
+    assert url == dest.resolve().as_uri()
+    # Only the published file is left behind, no partial copies
+    assert [path.name for path in dest.parent.iterdir()] == [video.name]
+
+
+def test_file_storage_base_url(tmp_path, video):
+    url = FileStorage(tmp_path / "bucket", "http://files.local/out/").upload(video, "faceswap/job-1/output.mp4")
+    assert url == "http://files.local/out/faceswap/job-1/output.mp4"
+
+
+def test_file_storage_replaces_existing(tmp_path, video):
+    root = tmp_path / "bucket"
+    (root / "faceswap").mkdir(parents=True)
+    (root / "faceswap" / "output.mp4").write_bytes(b"old")
+    FileStorage(root).upload(video, "faceswap/output.mp4")
+    assert (root / "faceswap" / "output.mp4").read_bytes() == video.read_bytes()
+
+
+def test_get_storage_file_backend(monkeypatch, tmp_path):
+    monkeypatch.setattr(storage, "STORAGE_BACKEND", "file")
+    monkeypatch.setattr(storage, "_storage", None)
+    monkeypatch.delenv("STORAGE_ROOT", raising=False)
+    assert storage.get_storage() is None
+
+    monkeypatch.setenv("STORAGE_ROOT", str(tmp_path))
+    backend = storage.get_storage()
+    assert isinstance(backend, FileStorage) and backend.root == tmp_path
+
+
+@pytest.mark.skipif(storage.boto3 is None, reason="boto3 not installed")
+class TestS3Url:
+    def s3(self, **kwargs):
+        return S3Storage("outputs", access_key="key", secret_key="secret", **kwargs)
+
+    def test_public_url(self, no_presign):
+        backend = self.s3(endpoint_url="https://r2.example.com", public_url="https://cdn.example.com/")
+        assert backend.url("faceswap/a.mp4") == "https://cdn.example.com/faceswap/a.mp4"
+
+    def test_endpoint_url(self, no_presign):
+        backend = self.s3(endpoint_url="https://minio.local:9000/")
+        assert backend.url("faceswap/a.mp4") == "https://minio.local:9000/outputs/faceswap/a.mp4"
+
+    def test_aws_url_without_endpoint(self, no_presign):
+        backend = self.s3(region="eu-west-1")
+        assert backend.url("faceswap/a.mp4") == "https://outputs.s3.eu-west-1.amazonaws.com/faceswap/a.mp4"
+
+    def test_aws_url_default_region(self, no_presign, monkeypatch):
+        for name in ("AWS_REGION", "AWS_DEFAULT_REGION"):
+            monkeypatch.delenv(name, raising=False)
+        monkeypatch.setenv("AWS_CONFIG_FILE", "/nonexistent")
+        assert self.s3().url("a.mp4") == "https://outputs.s3.us-east-1.amazonaws.com/a.mp4"